@@ -0,0 +1,49 @@
+if 'custom' not in globals():
+    from mage_ai.data_preparation.decorators import custom
+if 'test' not in globals():
+    from mage_ai.data_preparation.decorators import test
+
+import pendulum
+
+from alto_academy_workshop.utils.backfill import run_backfill
+from alto_academy_workshop.utils.pipeline import PipelineConfig
+
+
+@custom
+def backfill(*args, **kwargs):
+    """
+    Reprocess a historical range of raw data from CrateDB into TimescaleDB.
+
+    The range [backfill_start, backfill_end) is split into units of backfill_chunk_interval
+    (the chunk interval of the destination hypertable) that run across backfill_processes processes.
+    Completed units are checkpointed, so running the pipeline again resumes an interrupted backfill.
+    """
+    backfill_start = kwargs.get("backfill_start", None)
+    if backfill_start is None:
+        raise Exception(f"Please provide the start of the backfill range.")
+    backfill_end = kwargs.get("backfill_end", None)
+    if backfill_end is None:
+        raise Exception(f"Please provide the end of the backfill range.")
+    backfill_chunk_interval = kwargs.get("backfill_chunk_interval", "1 day")
+    backfill_processes = int(kwargs.get("backfill_processes", 4))
+
+    config = PipelineConfig.from_kwargs(**kwargs)
+    summary = run_backfill(
+        config=config,
+        start_timestamp=pendulum.parse(str(backfill_start)).timestamp(),
+        end_timestamp=pendulum.parse(str(backfill_end)).timestamp(),
+        chunk_interval=backfill_chunk_interval,
+        processes=backfill_processes
+    )
+    print(f"Backfill finished: {summary}")
+
+    return summary
+
+
+@test
+def test_output(output, *args) -> None:
+    """
+    Template code for testing the output of the block.
+    """
+    assert output is not None, 'The output is undefined'
+    assert output['failed'] == 0, 'Some backfill units failed'
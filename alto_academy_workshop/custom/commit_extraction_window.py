@@ -0,0 +1,36 @@
+if 'custom' not in globals():
+    from mage_ai.data_preparation.decorators import custom
+if 'test' not in globals():
+    from mage_ai.data_preparation.decorators import test
+
+from alto_academy_workshop.utils.metrics import timed_block
+from alto_academy_workshop.utils.watermark import commit_extraction_window
+
+
+@custom
+@timed_block
+def commit(export_results, *args, **kwargs):
+    """
+    Move the watermark once the data of every shard is written into TimescaleDB.
+
+    The exporter reduces the outputs of its shards into the list of their results.
+    """
+    if not isinstance(export_results, list):
+        export_results = [export_results]
+    failed = [result for result in export_results if not (result or {}).get("written")]
+    if failed:
+        print(f"{len(failed)} of {len(export_results)} shard(s) were not written, the window will be extracted again")
+        return False
+
+    # Only move the watermark once the window is written, so that a failed run is extracted again
+    commit_extraction_window(**kwargs)
+    print(f"Committed the window of {sum(result['rows'] for result in export_results)} row(s) in {len(export_results)} shard(s)")
+    return True
+
+
+@test
+def test_output(output, *args) -> None:
+    """
+    Template code for testing the output of the block.
+    """
+    assert output is not None, 'The output is undefined'
@@ -27,7 +27,7 @@ def create(*args, **kwargs):
     if timescaledb_port is None:
         raise Exception(f"Please provide timescaleDB database table.")
 
-    from alto_academy_workshop.utils.database import AltoTimescaleDB
+    from alto_academy_workshop.utils.database import UPSERT_KEY, AltoTimescaleDB
     timescaleDB = AltoTimescaleDB(
         db_name=timescaledb_db_name,
         username=timescaledb_username,
@@ -42,7 +42,8 @@ def create(*args, **kwargs):
         {"name": "device_id", "type": "VARCHAR(128) NOT NULL"},
         {"name": "aggregation_type", "type": "VARCHAR(32)"},
         {"name": "datapoint", "type": "VARCHAR(64) NOT NULL"},
-        {"name": "value", "type": "TEXT"},
+        {"name": "value", "type": "DOUBLE PRECISION"},
+        {"name": "value_text", "type": "TEXT"},  # modal/categorical values
     ]
 
     timescaleDB.create_table(
@@ -50,6 +51,21 @@ def create(*args, **kwargs):
         columns_config=columns_config,
         time_column="timestamp",
         chunk_interval="1 day",
+        compress_segmentby=["device_id", "datapoint"],
+        compress_orderby="timestamp",
+        compress_after=kwargs.get("timescaledb_compress_after", "7 days"),
+        retention=kwargs.get("timescaledb_retention", None),
+        unique_columns=list(UPSERT_KEY),  # lets the exporter upsert, so that retried runs write no duplicates
     )
 
+    # Materialized rollups for coarse resolutions, ex. "15min,1h,1d"
+    timescaledb_rollups = kwargs.get("timescaledb_rollups", None)
+    if timescaledb_rollups:
+        timescaleDB.create_rollups(
+            table_name=timescaledb_destination_table,
+            resolutions=[r.strip() for r in str(timescaledb_rollups).split(",") if r.strip()],
+            time_column="timestamp",
+        )
+    timescaleDB.close()
+
     return True
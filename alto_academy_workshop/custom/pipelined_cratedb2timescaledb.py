@@ -0,0 +1,71 @@
+if 'custom' not in globals():
+    from mage_ai.data_preparation.decorators import custom
+if 'test' not in globals():
+    from mage_ai.data_preparation.decorators import test
+
+import threading
+
+from alto_academy_workshop.utils.metrics import timed_block
+from alto_academy_workshop.utils.pipeline import PipelineConfig, run_pipelined
+from alto_academy_workshop.utils.watermark import get_watermark_store, watermark_key
+
+
+@custom
+@timed_block
+def run(*args, **kwargs):
+    """
+    Move the raw data from CrateDB into TimescaleDB continuously, one window of query_period_seconds at a time.
+
+    Extraction, aggregation and insert run in their own threads on consecutive windows (see run_pipelined),
+    so CrateDB, pandas and TimescaleDB are busy at the same time. The block starts at the stored watermark,
+    moves it after every window written, and returns after pipelined_run_seconds so that the next trigger
+    takes over.
+    """
+    cratedb_source_table = kwargs.get("cratedb_source_table", None)
+    if cratedb_source_table is None:
+        raise Exception(f"Please provide the CrateDB source table.")
+
+    interval_seconds = int(kwargs.get("query_period_seconds", 60))
+    resample_seconds = int(kwargs.get("resample_seconds", 60))
+    grace_seconds = float(kwargs.get("watermark_grace_seconds", 0))
+    run_seconds = float(kwargs.get("pipelined_run_seconds", 3600))
+    queue_size = int(kwargs.get("pipelined_queue_size", 2))
+
+    # Start at the watermark, or at the last window before the run without one
+    store = get_watermark_store(**kwargs)
+    key = watermark_key(**kwargs)
+    start_timestamp = store.get(key)
+    if start_timestamp is None:
+        start_timestamp = kwargs["interval_start_datetime"].timestamp() - interval_seconds
+        start_timestamp -= start_timestamp % resample_seconds
+
+    stop = threading.Event()
+    timer = threading.Timer(run_seconds, stop.set)
+    timer.start()
+    try:
+        stats = run_pipelined(
+            config=PipelineConfig.from_kwargs(**kwargs),
+            start_timestamp=start_timestamp,
+            interval_seconds=interval_seconds,
+            queue_size=queue_size,
+            grace_seconds=grace_seconds,
+            on_written=lambda start, end: store.set(key, end),  # Windows are written in order
+            stop_event=stop
+        )
+    finally:
+        timer.cancel()
+        store.close()
+
+    print(f"Processed {stats['windows']} window(s), {stats['raw_rows']} raw row(s) into {stats['aggregated_rows']} "
+          f"aggregated row(s) in {stats['seconds']:.1f}s (busy: extract {stats['extract_seconds']:.1f}s, "
+          f"aggregate {stats['aggregate_seconds']:.1f}s, write {stats['write_seconds']:.1f}s)")
+
+    return stats
+
+
+@test
+def test_output(output, *args) -> None:
+    """
+    Template code for testing the output of the block.
+    """
+    assert output is not None, 'The output is undefined'
@@ -0,0 +1,42 @@
+if 'custom' not in globals():
+    from mage_ai.data_preparation.decorators import custom
+if 'test' not in globals():
+    from mage_ai.data_preparation.decorators import test
+
+from alto_academy_workshop.utils.metrics import timed_block
+from alto_academy_workshop.utils.pipeline import PipelineConfig, stream_window
+from alto_academy_workshop.utils.watermark import commit_extraction_window, resolve_extraction_window
+
+
+@custom
+@timed_block
+def stream(*args, **kwargs):
+    """
+    Move the raw data of this run from CrateDB into TimescaleDB one batch of devices at a time.
+
+    Each batch of extraction_batch_size devices is extracted, aggregated and inserted before the next one
+    is queried, so the memory used does not grow with the window or the number of devices.
+    The window is chosen as in the cratedb2timescaledb pipeline (see resolve_extraction_window).
+    """
+    cratedb_source_table = kwargs.get("cratedb_source_table", None)
+    if cratedb_source_table is None:
+        raise Exception(f"Please provide the CrateDB source table.")
+
+    start_timestamp, end_timestamp = resolve_extraction_window(**kwargs)
+    config = PipelineConfig.from_kwargs(**kwargs)
+    stats = stream_window(config, start_timestamp, end_timestamp)
+    print(f"Processed {stats['raw_rows']} raw row(s) into {stats['aggregated_rows']} aggregated row(s) "
+          f"in {stats['batches']} batch(es) of at most {stats['max_batch_rows']} row(s) in {stats['seconds']:.1f}s")
+
+    # Only move the watermark once every batch is written, so that a failed run is extracted again
+    commit_extraction_window(**kwargs)
+
+    return stats
+
+
+@test
+def test_output(output, *args) -> None:
+    """
+    Template code for testing the output of the block.
+    """
+    assert output is not None, 'The output is undefined'
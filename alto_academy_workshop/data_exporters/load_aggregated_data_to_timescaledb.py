@@ -1,13 +1,21 @@
 if 'data_exporter' not in globals():
     from mage_ai.data_preparation.decorators import data_exporter
 
+from alto_academy_workshop.utils.handoff import maybe_read
+from alto_academy_workshop.utils.metrics import timed_block
 
 @data_exporter
+@timed_block
 def export_data(data_and_table, *args, **kwargs):
     """
     Insert the given data into TimescaleDB table.
+
+    Runs once per shard of construct_filter. Returns whether the data was written, for the
+    commit_extraction_window block to move the watermark once every shard is written. A failed
+    insert is raised, so that the run fails and the window is extracted again.
     """
     data, _ = data_and_table  # Unpack the inputs
+    data = maybe_read(data, delete=True)  # Read the aggregated data handed off as a file, if any, and delete the file
     timescaledb_db_name = kwargs.get("timescaledb_db_name", None)
     if timescaledb_db_name is None:
         raise Exception(f"Please provide timescaleDB database name.")
@@ -27,6 +35,11 @@ def export_data(data_and_table, *args, **kwargs):
     if timescaledb_port is None:
         raise Exception(f"Please provide timescaleDB database table.")
 
+    timescaledb_insert_method = kwargs.get("timescaledb_insert_method", "copy")
+    timescaledb_copy_format = kwargs.get("timescaledb_copy_format", "text")
+    # 'auto' upserts into a table with the unique index of create_table, so that a re-run window replaces its rows
+    timescaledb_write_mode = kwargs.get("timescaledb_write_mode", "auto")
+
     from alto_academy_workshop.utils.database import AltoTimescaleDB
     timescaleDB = AltoTimescaleDB(
         db_name=timescaledb_db_name,
@@ -36,15 +49,25 @@ def export_data(data_and_table, *args, **kwargs):
         port=timescaledb_port
     )
     
-    if not data:
+    if data is None or len(data) == 0:
         print('The list of data is empty')
         # print('The list of data is empty')
-
+        timescaleDB.close()
+        return {"written": True, "rows": 0}
 
     try:
-        timescaleDB.insert_data(table_name=timescaledb_destination_table, data=data)
+        timescaleDB.insert_data(
+            table_name=timescaledb_destination_table,
+            data=data,
+            method=timescaledb_insert_method,
+            copy_format=timescaledb_copy_format,
+            mode=timescaledb_write_mode
+        )
         print(f"Successfully inserted {len(data)} row(s) of data into TimescaleDB")
+        return {"written": True, "rows": len(data)}
     except Exception as e:
         print(f"Cannot insert data to TimescaleDB due to the follow error {e}")
-        # raise Exception(f"Cannot insert data to TimescaleDB due to the follow error {e}")
+        raise
+    finally:
+        timescaleDB.close()
 
@@ -3,8 +3,15 @@ if 'data_loader' not in globals():
 if 'test' not in globals():
     from mage_ai.data_preparation.decorators import test
 
+from alto_academy_workshop.utils.catalog import DeviceCatalog
+from alto_academy_workshop.utils.filters import build_device_filters
+from alto_academy_workshop.utils.watermark import resolve_extraction_window
+from alto_academy_workshop.utils.metrics import timed_block
+from alto_academy_workshop.utils.sharding import dynamic_block_output, shard_filters
+
 
 @data_loader
+@timed_block
 def load_data(devices_datapoints, *args, **kwargs):
     """
     Template code for loading data from any source.
@@ -12,23 +19,21 @@ def load_data(devices_datapoints, *args, **kwargs):
     Returns:
         Anything (e.g. data frame, dictionary, array, int, str, etc.)
     """
-    query_period_seconds = kwargs.get("query_period_seconds", 60)
-    if isinstance(query_period_seconds, str):
-        query_period_seconds = int(query_period_seconds)
-    # construct filter
-    start_timestamp = kwargs['interval_start_datetime'].timestamp() - query_period_seconds
-    end_timestamp = kwargs['interval_start_datetime'].timestamp()
+    # construct filter for the window of this run (see resolve_extraction_window for the extraction modes)
+    start_timestamp, end_timestamp = resolve_extraction_window(**kwargs)
     
     # end_timestamp = 1693045380
     # start_timestamp = end_timestamp - query_period_seconds
 
-    filter_list = []
-    for device_id, datapoints in devices_datapoints.items():
-        filters = {
-            'device_id': {'=': device_id},
-            'datapoint': {'IN': datapoints},
-            'timestamp': {'>=': int(start_timestamp) * 1000, '<': int(end_timestamp) * 1000},  # Times 1000 to be in ms uni
-        }
-        filter_list.append(filters)
+    filter_list = build_device_filters(devices_datapoints, start_timestamp, end_timestamp)
+
+    # This is a dynamic block: extraction, aggregation and export run once per shard of devices.
+    # The shards are balanced by the row counts of the device catalog, if 'device_catalog' is set.
+    shard_count = int(kwargs.get("shard_count", 1))
+    row_counts = None
+    if kwargs.get("device_catalog", False):
+        row_counts = DeviceCatalog(cratedb=None).row_counts(kwargs.get("cratedb_source_table"))
+    shards = shard_filters(filter_list, shard_count, row_counts)
+    print(f"Split {len(filter_list)} device(s) into {len(shards)} shard(s) of {[len(shard) for shard in shards]} device(s)")
 
-    return filter_list
\ No newline at end of file
+    return dynamic_block_output(shards)
@@ -6,9 +6,14 @@ if 'test' not in globals():
 import pandas as pd
 
 # import database utilities
+from alto_academy_workshop.utils.aggregation import index_by_timestamp
 from alto_academy_workshop.utils.database import AltoCrateDB
+from alto_academy_workshop.utils.handoff import hand_off
+from alto_academy_workshop.utils.metrics import timed_block
+from alto_academy_workshop.utils.raw_cache import get_raw_cache
 
 @data_loader
+@timed_block
 def load_data(filter_list, *args, **kwargs):
     """
     Template code for loading data from any source.
@@ -29,31 +34,47 @@ def load_data(filter_list, *args, **kwargs):
         print("CrateDB source table is not provided. Please provide the soure table.")
         return None
     
+    extraction_batch_size = int(kwargs.get("extraction_batch_size", 500))
+
+    if kwargs.get("aggregation_engine") == "pushdown":
+        # The aggregate block queries the buckets from CrateDB itself
+        print("Aggregation is pushed down to CrateDB, skipping the raw data extraction.")
+        return [filter_list, pd.DataFrame()]
+
     cratedb = AltoCrateDB(
         host=cratedb_host,
-        port=cratedb_port
+        port=cratedb_port,
+        cache=get_raw_cache(**kwargs)  # Reuse the closed time buckets already fetched, if 'raw_cache' is set
     )
-    all_df = pd.DataFrame()
-
-    for f in filter_list:
-        if isinstance(f, str):
-            continue
-        data = cratedb.query_data(table_name=cratedb_source_table, filters=f)
-        df = pd.DataFrame(data)
-        if df.empty:
-            print(f"Data for device '{list(f['device_id'].values())[0]}' is not found")
-            continue
-        else:
-            print(f"Found {len(df)} entries for the filter {f}")
-            all_df = pd.concat([all_df, df], ignore_index=True)  # Concat dataframe
+
+    if extraction_batch_size > 0:
+        # Query all devices with a few multi-device queries and build the dataframe once
+        all_df = cratedb.query_data_batched(
+            table_name=cratedb_source_table,
+            filter_list=filter_list,
+            batch_size=extraction_batch_size,
+            as_frame=True
+        )
+        print(f"Found {len(all_df)} entries for {len(filter_list)} filter(s)")
+    else:
+        dfs = []
+        for f in filter_list:
+            if isinstance(f, str):
+                continue
+            df = cratedb.query_data(table_name=cratedb_source_table, filters=f, as_frame=True)
+            if df.empty:
+                print(f"Data for device '{list(f['device_id'].values())[0]}' is not found")
+                continue
+            else:
+                print(f"Found {len(df)} entries for the filter {f}")
+                dfs.append(df)
+        all_df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()  # Concat dataframes once
+    cratedb.close()
 
     if not all_df.empty:
-        # all_df['timestamp'] = all_df['timestamp'] * 1000
-        all_df['timestamp'] = pd.to_datetime(all_df['timestamp'], unit='ms')# .dt.round('1min')
-        # all_df['timestamp'].astype('datetime64[s]')
-        all_df = all_df.set_index('timestamp')
-        all_df = all_df.sort_index(ascending=True)
+        all_df = index_by_timestamp(all_df)
     else:
         print(f"No data is found for the filters {filter_list}")
-        
-    return [filter_list, all_df]
\ No newline at end of file
+
+    # With 'block_handoff' = 'arrow' or 'parquet', only a handle to a memory-mappable file is pickled by Mage
+    return [filter_list, hand_off(all_df, name="raw", **kwargs)]
\ No newline at end of file
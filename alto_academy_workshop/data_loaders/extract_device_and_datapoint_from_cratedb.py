@@ -4,9 +4,13 @@ if 'test' not in globals():
     from mage_ai.data_preparation.decorators import test
 
 # import database utilities
+from alto_academy_workshop.utils.catalog import DeviceCatalog
 from alto_academy_workshop.utils.database import AltoCrateDB
+from alto_academy_workshop.utils.metrics import timed_block
+from alto_academy_workshop.utils.watermark import resolve_extraction_window
 
 @data_loader
+@timed_block
 def load_data(*args, **kwargs):
     """
     loading device and datapoint from CrateDB.
@@ -26,25 +30,33 @@ def load_data(*args, **kwargs):
     if cratedb_source_table is None:
         print("CrateDB source table is not provided. Please provide the soure table.")
         return None
-    query_period_seconds = kwargs.get("query_period_seconds", 60)
-    if isinstance(query_period_seconds, str):
-        query_period_seconds = int(query_period_seconds)
 
     cratedb = AltoCrateDB(
         host=cratedb_host,
         port=cratedb_port
     )
 
-    start_timestamp = kwargs['interval_start_datetime'].timestamp() - query_period_seconds
-    end_timestamp = kwargs['interval_start_datetime'].timestamp()
+    if kwargs.get("device_catalog", False):
+        # read the known devices from the cached catalog, which only scans the rows added since its last refresh
+        catalog = DeviceCatalog(
+            cratedb=cratedb,
+            ttl_seconds=float(kwargs.get("device_catalog_ttl_seconds", 86400)),
+            grace_seconds=float(kwargs.get("watermark_grace_seconds", 0))
+        )
+        devices_datapoints = catalog.get(cratedb_source_table)
+        cratedb.close()
+        return devices_datapoints
+
+    start_timestamp, end_timestamp = resolve_extraction_window(**kwargs)
     # end_timestamp = 1693045380
     # start_timestamp = end_timestamp - query_period_seconds
     # select unique device_id and datapoint from table
     devices_datapoints = cratedb.get_unique_deviceid_datapoint(
         table_name=cratedb_source_table,
-        start_timestamp=start_timestamp,
-        end_timestamp=end_timestamp
+        start_timestamp=int(start_timestamp) * 1000,  # Times 1000 to be in ms unit, as the raw timestamps
+        end_timestamp=int(end_timestamp) * 1000
     )
+    cratedb.close()
 
     return devices_datapoints
 
@@ -3,22 +3,19 @@ if 'transformer' not in globals():
 if 'test' not in globals():
     from mage_ai.data_preparation.decorators import test
 
+import pandas as pd
 import pendulum
 
-def seconds_to_duration(seconds):
-    """
-    Convert seconds (numeric) to duration string. Round to the nearest minute or hour.
-    """
-    if seconds < 60:
-        return f"{seconds}sec"
-    elif seconds < 3600:
-        minutes = seconds // 60
-        return f"{minutes}min"
-    else:
-        hours = seconds // 3600
-        return f"{hours}h"
+from alto_academy_workshop.utils.aggregation import (
+    aggregate_frame, aggregate_pushdown, resample_categorical, seconds_to_duration
+)
+from alto_academy_workshop.utils.database import AltoCrateDB
+from alto_academy_workshop.utils.handoff import hand_off, maybe_read
+from alto_academy_workshop.utils.metrics import timed_block
+from alto_academy_workshop.utils.type_registry import DatapointTypeRegistry
 
 @transformer
+@timed_block
 def transform(data2transform, *args, **kwargs):
     """
     Aggregate the raw data.
@@ -28,10 +25,33 @@ def transform(data2transform, *args, **kwargs):
     resample_period = seconds_to_duration(resample_seconds)
     query_period_seconds = kwargs.get("query_period_seconds", 60)
     expected_num_of_data_per_point = int(query_period_seconds) // int(resample_seconds)
+    aggregation_engine = kwargs.get("aggregation_engine", "vectorized")
 
-    filter_list, all_df = data2transform[0], data2transform[1]
+    filter_list, all_df = data2transform[0], maybe_read(data2transform[1], delete=True)
 
     agg_data = list()
+
+    if aggregation_engine == "pushdown":
+        # Aggregate inside CrateDB, the extract block did not pull the raw rows
+        cratedb = AltoCrateDB(
+            host=kwargs.get("cratedb_host", "host.docker.internal"),
+            port=int(kwargs.get("cratedb_port", 4200))
+        )
+        try:
+            agg_df = aggregate_pushdown(
+                cratedb,
+                table_name=kwargs.get("cratedb_source_table"),
+                filter_list=filter_list,
+                resample_seconds=int(resample_seconds),
+                batch_size=int(kwargs.get("extraction_batch_size", 500))
+            )
+        finally:
+            cratedb.close()
+        points_per_series = agg_df.groupby(["device_id", "datapoint"]).size()
+        print(f"Aggregated {len(points_per_series)} series into {len(agg_df)} data points in CrateDB "
+              f"({(points_per_series < expected_num_of_data_per_point).sum()} series with fewer than "
+              f"{expected_num_of_data_per_point} data points)")
+        return hand_off(agg_df, name="aggregated", **kwargs), timescaledb_destination_table
     
     if isinstance(all_df, list):
         if all_df == []:
@@ -41,6 +61,28 @@ def transform(data2transform, *args, **kwargs):
         if all_df.empty:
             print("There is no raw data for all devices to aggregate.")
             return agg_data, timescaledb_destination_table
+
+    if aggregation_engine == "vectorized":
+        # Aggregate all devices and datapoints in one pass and return a columnar result
+        # Read the datapoint types from the registry instead of probing every series on every run
+        type_registry = None
+        if kwargs.get("datapoint_type_registry", False):
+            type_registry = DatapointTypeRegistry(
+                tolerance=float(kwargs.get("datapoint_type_tolerance", 0.01)),
+                window_values=int(kwargs.get("datapoint_type_window_values", 10000))
+            )
+        agg_df = aggregate_frame(
+            all_df,
+            resample_seconds=int(resample_seconds),
+            filter_list=filter_list,
+            type_registry=type_registry
+        )
+        points_per_series = agg_df.groupby(["device_id", "datapoint"]).size()
+        print(f"Aggregated {len(points_per_series)} series into {len(agg_df)} data points "
+              f"({(points_per_series < expected_num_of_data_per_point).sum()} series with fewer than "
+              f"{expected_num_of_data_per_point} data points)")
+        return hand_off(agg_df, name="aggregated", **kwargs), timescaledb_destination_table
+
     for f in filter_list:
         device_id = list(f['device_id'].values())[0]
         datapoints = list(f['datapoint'].values())[0]
@@ -74,7 +116,7 @@ def transform(data2transform, *args, **kwargs):
                     elif agg_func == "last":
                         agg_series = series.resample(resample_period).last()
                     elif agg_func == "mode":
-                        agg_series = series.resample(resample_period).apply(lambda x: x.mode())
+                        agg_series = resample_categorical(series, resample_period, how="mode")
                     elif agg_func == "max":
                         agg_series = series.resample(resample_period).max()
                     elif agg_func == "sum":
@@ -86,7 +128,8 @@ def transform(data2transform, *args, **kwargs):
                     print(f"{len(agg_series)}/{expected_num_of_data_per_point} data points found for '{datapoint}' for device '{device_id}' using '{agg_func}' functions")
 
                     for idx, v in agg_series.items():
-                        if agg_series.dtype != 'object':
+                        # Modes of text values have the str dtype of pandas >= 3 instead of object
+                        if pd.api.types.is_numeric_dtype(agg_series.dtype):
                             v = round(v, 4)
                         ts = idx.timestamp()
                         agg_data.append({
@@ -99,4 +142,4 @@ def transform(data2transform, *args, **kwargs):
         else:
             print("There is no data for Device:", device_id)
 
-    return agg_data, timescaledb_destination_table
\ No newline at end of file
+    return hand_off(agg_data, name="aggregated", **kwargs), timescaledb_destination_table
\ No newline at end of file
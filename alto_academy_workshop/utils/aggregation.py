@@ -0,0 +1,409 @@
+import numpy as np
+import pandas as pd
+
+from alto_academy_workshop.utils.filters import batch_device_filters
+
+AGGREGATION_TIMEZONE = "Asia/Bangkok"
+SERIES_KEYS = ["device_id", "datapoint"]
+OUTPUT_COLUMNS = ["timestamp", "device_id", "aggregation_type", "datapoint", "value"]
+
+
+def seconds_to_duration(seconds):
+    """
+    Convert seconds (numeric) to duration string. Round to the nearest minute or hour.
+    """
+    if seconds < 60:
+        return f"{seconds}sec"
+    elif seconds < 3600:
+        minutes = seconds // 60
+        return f"{minutes}min"
+    else:
+        hours = seconds // 3600
+        return f"{hours}h"
+
+
+def index_by_timestamp(all_df: pd.DataFrame) -> pd.DataFrame:
+    """ Convert the 'timestamp' column of raw CrateDB data (epoch milliseconds) into a sorted datetime index """
+    all_df['timestamp'] = pd.to_datetime(all_df['timestamp'], unit='ms')
+    all_df = all_df.set_index('timestamp')
+    return all_df.sort_index(ascending=True)
+
+
+def _wanted_pairs(filter_list: list) -> pd.MultiIndex:
+    """ Return the (device_id, datapoint) pairs requested by the filters from `construct_filter` """
+    pairs = []
+    for f in filter_list:
+        if isinstance(f, str):
+            continue
+        device_id = list(f['device_id'].values())[0]
+        datapoints = list(f['datapoint'].values())[0]
+        if not isinstance(datapoints, list):
+            datapoints = [datapoints]
+        pairs += [(device_id, datapoint) for datapoint in datapoints]
+    return pd.MultiIndex.from_tuples(pairs, names=SERIES_KEYS)
+
+
+def _fill_empty_buckets(agg: pd.Series, step: pd.Timedelta) -> pd.Series:
+    """
+    Add the empty buckets between the first and the last bucket of every series, like `resample` does
+
+    Args:
+        agg (pd.Series): Aggregated values indexed by (device_id, datapoint, timestamp)
+        step (pd.Timedelta): Bucket width
+
+    """
+    bounds = agg.index.to_frame(index=False).groupby(SERIES_KEYS, sort=False)["timestamp"].agg(["min", "max", "size"])
+    counts = ((bounds["max"] - bounds["min"]) // step + 1).to_numpy(dtype=np.int64)
+    if (counts == bounds["size"].to_numpy()).all():
+        return agg
+
+    # Position of every bucket inside its series, computed without a Python loop over the series
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    timestamps = np.repeat(bounds["min"].to_numpy(), counts) + offsets * step.to_timedelta64()
+    full_index = pd.MultiIndex.from_arrays(
+        [
+            np.repeat(bounds.index.get_level_values("device_id"), counts),
+            np.repeat(bounds.index.get_level_values("datapoint"), counts),
+            timestamps,
+        ],
+        names=agg.index.names,
+    )
+    return agg.reindex(full_index)
+
+
+def _keep_pairs(frame: pd.DataFrame, wanted) -> pd.DataFrame:
+    """ Keep the rows of the wanted (device_id, datapoint) pairs, or all rows if `wanted` is None """
+    if wanted is None or frame.empty:
+        return frame
+    return frame[pd.MultiIndex.from_frame(frame[SERIES_KEYS]).isin(list(wanted))]
+
+
+def mode_from_counts(counts: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """
+    Pick the most frequent value of each group from value counts
+
+    Args:
+        counts (pd.DataFrame): Rows of `keys`, 'value' and its 'count'
+        keys (list): Columns identifying a group, ex. ['device_id', 'datapoint', 'timestamp']
+
+    Returns:
+        modes (pd.DataFrame): One row per group with the value of the highest count. Ties are broken by
+            taking the smallest value, like `pd.Series.mode().iloc[0]`.
+
+    """
+    ordered = counts.sort_values(
+        keys + ["count", "value"],
+        ascending=[True] * len(keys) + [False, True],
+        kind="mergesort"
+    )
+    return ordered.drop_duplicates(keys, keep="first")
+
+
+def _factorize_sorted(values: np.ndarray):
+    """ `pd.factorize(sort=True)`, falling back to sorting by the string representation for mixed types """
+    try:
+        return pd.factorize(values, sort=True)
+    except TypeError:
+        codes, uniques = pd.factorize(values)
+        order = np.argsort(np.asarray(uniques, dtype=str), kind="stable")
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        return np.where(codes >= 0, ranks[codes], -1), np.asarray(uniques, dtype=object)[order]
+
+
+def categorical_aggregate(group_codes: np.ndarray, values, n_groups: int, how: str = "mode") -> np.ndarray:
+    """
+    Aggregate values of any type per group with NumPy operations on categorical codes
+
+    The values are factorized once (sorted, so a smaller code is a smaller value), and the groups are
+    reduced with `np.unique`/`np.lexsort` instead of a Python callback per group. Null values are ignored.
+
+    Args:
+        group_codes (np.ndarray): Group of every value, from 0 to `n_groups` - 1
+        values (array-like): Values to aggregate, in time order within each group
+        n_groups (int): Number of groups
+        how (str): 'mode' for the most frequent value (ties are broken by taking the smallest value, like
+            `pd.Series.mode().iloc[0]`), 'first' or 'last' for the first or last non-null value
+
+    Returns:
+        result (np.ndarray): Object array with the value of every group, None for groups without values
+
+    """
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    value_codes, uniques = _factorize_sorted(np.asarray(values, dtype=object))
+    valid = value_codes >= 0
+    group_codes, value_codes = group_codes[valid], value_codes[valid]
+    result = np.full(n_groups, None, dtype=object)
+    if len(value_codes) == 0:
+        return result
+
+    if how == "mode":
+        # Count every (group, value) pair, then keep the highest count per group and the smallest value on ties
+        pairs, counts = np.unique(group_codes * len(uniques) + value_codes, return_counts=True)
+        groups, codes = pairs // len(uniques), pairs % len(uniques)
+        order = np.lexsort((codes, -counts, groups))
+        groups, codes = groups[order], codes[order]
+        first = np.r_[True, groups[1:] != groups[:-1]]
+        result[groups[first]] = uniques[codes[first]]
+    elif how == "first":
+        groups, positions = np.unique(group_codes, return_index=True)
+        result[groups] = uniques[value_codes[positions]]
+    elif how == "last":
+        groups, positions = np.unique(group_codes[::-1], return_index=True)
+        result[groups] = uniques[value_codes[::-1][positions]]
+    else:
+        raise ValueError(f"Unknown categorical aggregation: {how}")
+    return result
+
+
+def resample_categorical(series: pd.Series, resample_period: str, how: str = "mode") -> pd.Series:
+    """
+    `series.resample(resample_period)` aggregated with `categorical_aggregate`, including the empty buckets
+
+    Args:
+        series (pd.Series): Values indexed by a sorted datetime index
+        resample_period (str): Bucket width, ex. '1min'
+        how (str): 'mode', 'first' or 'last'
+
+    """
+    if series.empty:
+        return series
+    step = pd.Timedelta(pd.tseries.frequencies.to_offset(resample_period))
+    # Bins start at midnight of the first day, like the default origin of `resample`
+    origin = series.index.min().floor("D")
+    bins = np.asarray((series.index - origin) // step, dtype=np.int64)
+    first_bin = bins.min()
+    n_groups = int(bins.max() - first_bin + 1)
+    result = categorical_aggregate(bins - first_bin, series.to_numpy(), n_groups, how)
+    index = origin + (first_bin + np.arange(n_groups)) * step
+    return pd.Series(result, index=pd.DatetimeIndex(index, name=series.index.name), name=series.name)
+
+
+def _to_float(values: pd.Series):
+    """
+    Convert values to float value by value, as `astype(float)` does in `aggregate.transform`
+
+    `pd.to_numeric` converts most values in one vectorized step. The few strings it rejects but `float()`
+    accepts, ex. 'nan', 'inf' or ' 1.5', are converted once per distinct value.
+
+    Returns:
+        (numeric_values, failed): Values as floats (NaN where the conversion failed), and a boolean array of
+            the non-null values that could not be converted
+
+    """
+    numeric_values = pd.to_numeric(values, errors="coerce")
+    failed = numeric_values.isna().to_numpy() & values.notna().to_numpy()
+    if failed.any():
+        retry = values[failed]
+        converted = {}
+        for value in pd.unique(retry):
+            try:
+                converted[value] = float(value)
+            except (TypeError, ValueError):
+                pass
+        if converted:
+            numeric_values = numeric_values.astype(float)
+            numeric_values[failed] = retry.map(converted).astype(float)
+            failed[failed] = ~retry.isin(list(converted)).to_numpy()
+    return numeric_values, failed
+
+
+def _classify_series(frame: pd.DataFrame, type_registry):
+    """
+    Split the rows into numeric and categorical series with a `DatapointTypeRegistry`
+
+    Only the series that are numeric or not known yet are converted to float, in one vectorized step. Their
+    counts of values and non-numeric values are added to the registry, which decides their type.
+
+    Returns:
+        (is_numeric, numeric_values): Boolean array of the rows of numeric series, and the values as floats
+            (NaN for the rows that were not converted or could not be)
+
+    """
+    pair_codes, pairs = pd.MultiIndex.from_frame(frame[SERIES_KEYS]).factorize()
+    pairs = list(pairs)
+    pair_types = np.array(type_registry.get_types(pairs), dtype=object)
+
+    convert = (pair_types != "categorical")[pair_codes]
+    numeric_values = pd.Series(np.nan, index=frame.index)
+    failed = np.zeros(len(frame), dtype=bool)
+    numeric_values[convert], failed[convert] = _to_float(frame["value"][convert])
+    present = frame["value"].notna().to_numpy() & convert
+
+    observed = np.flatnonzero(pair_types != "categorical")
+    if len(observed):
+        values = np.bincount(pair_codes[present], minlength=len(pairs))
+        non_numeric = np.bincount(pair_codes[failed], minlength=len(pairs))
+        pair_types[observed] = type_registry.observe(
+            [pairs[i] for i in observed], values[observed], non_numeric[observed]
+        )
+
+    is_numeric = (pair_types == "numeric")[pair_codes]
+    return is_numeric, numeric_values
+
+
+def aggregate_frame(all_df: pd.DataFrame,
+                    resample_seconds: int = 60,
+                    filter_list: list = None,
+                    tz: str = AGGREGATION_TIMEZONE,
+                    type_registry=None
+                    ) -> pd.DataFrame:
+    """
+    Aggregate the raw data of all series (device_id, datapoint) in one grouped pass
+
+    A series is aggregated with 'mean' when all of its values can be converted to float, otherwise with
+    'mode', as `aggregate.transform` does per series. Buckets are computed with a single
+    `groupby([device_id, datapoint, pd.Grouper(freq=...)])` over the whole frame, and the empty buckets
+    between the first and the last bucket of a series are added back so that the output matches `resample`.
+
+    Args:
+        all_df (pd.DataFrame): Raw data indexed by timestamp (UTC) with 'device_id', 'datapoint' and 'value' columns
+        resample_seconds (int): Bucket width in seconds
+        filter_list (list): Filters from `construct_filter`. If given, only the requested series are aggregated.
+        tz (str): Time zone of the output timestamps
+        type_registry (DatapointTypeRegistry): If given, the series types are read from the registry instead of
+            being probed (see `_classify_series`), and the non-numeric values of numeric series are ignored
+
+    Returns:
+        agg_df (pd.DataFrame): Aggregated data with the columns 'timestamp', 'device_id', 'aggregation_type',
+            'datapoint' and 'value', one row per series and bucket
+
+    """
+    resample_period = seconds_to_duration(resample_seconds)
+    if all_df is None or len(all_df) == 0:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+    frame = pd.DataFrame({
+        "timestamp": all_df.index.to_numpy(),
+        "device_id": all_df["device_id"].to_numpy(),
+        "datapoint": all_df["datapoint"].to_numpy(),
+        "value": all_df["value"].to_numpy(),
+    })
+    if filter_list is not None:
+        frame = frame[pd.MultiIndex.from_frame(frame[SERIES_KEYS]).isin(_wanted_pairs(filter_list))]
+        if frame.empty:
+            return pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+    if type_registry is not None:
+        is_numeric, numeric_values = _classify_series(frame, type_registry)
+    else:
+        # A series is numeric if none of its non-null values fails the conversion to float
+        numeric_values, failed = _to_float(frame["value"])
+        failed = pd.Series(failed, index=frame.index)
+        is_numeric = ~failed.groupby([frame["device_id"], frame["datapoint"]]).transform("any").to_numpy(dtype=bool)
+
+    step = pd.Timedelta(pd.tseries.frequencies.to_offset(resample_period))
+    bucket = pd.Grouper(key="timestamp", freq=resample_period)
+    results = []
+
+    numeric = frame[is_numeric].assign(value=numeric_values[is_numeric])
+    if not numeric.empty:
+        agg = numeric.groupby(SERIES_KEYS + [bucket])["value"].mean()
+        agg = _fill_empty_buckets(agg, step).round(4)
+        results.append(agg.reset_index().assign(aggregation_type=f"mean_{resample_period}"))
+
+    categorical = frame[~is_numeric]
+    if not categorical.empty:
+        # Same bins as the numeric series, then one vectorized mode over the categorical codes of all series
+        origin = frame["timestamp"].min().floor("D")
+        categorical = categorical.assign(timestamp=origin + (categorical["timestamp"] - origin) // step * step)
+        grouped = categorical.groupby(SERIES_KEYS + ["timestamp"], sort=True)
+        group_codes = grouped.ngroup().to_numpy()
+        group_index = grouped.size().index
+        agg = pd.Series(
+            categorical_aggregate(group_codes, categorical["value"].to_numpy(), len(group_index), "mode"),
+            index=group_index,
+            name="value"
+        )
+        agg = _fill_empty_buckets(agg, step)
+        results.append(agg.reset_index().assign(aggregation_type=f"mode_{resample_period}"))
+
+    agg_df = pd.concat(results, ignore_index=True)
+    agg_df["timestamp"] = agg_df["timestamp"].dt.tz_localize("UTC").dt.tz_convert(tz)
+
+    return agg_df[OUTPUT_COLUMNS]
+
+
+def aggregate_pushdown(cratedb,
+                       table_name: str,
+                       filter_list: list,
+                       resample_seconds: int = 60,
+                       batch_size: int = 500,
+                       tz: str = AGGREGATION_TIMEZONE
+                       ) -> pd.DataFrame:
+    """
+    Aggregate the raw data inside CrateDB and return the same output as `aggregate_frame`
+
+    Bucket means, with the values cast to numbers, are computed by `AltoCrateDB.query_bucket_stats`. A series
+    is numeric when every non-null value can be cast, as in `aggregate_frame`. For the other series, the
+    per-bucket value counts are read with `AltoCrateDB.query_bucket_value_counts` and the mode is picked from
+    them. Only aggregated rows leave the database. Devices are queried in batches of `batch_size` as in
+    `query_data_batched`.
+
+    Args:
+        cratedb (AltoCrateDB): Database holding the raw data
+        table_name (str): Name of the raw data table
+        filter_list (list): Filters from `construct_filter`
+        resample_seconds (int): Bucket width in seconds
+        batch_size (int): Maximum number of devices per query
+        tz (str): Time zone of the output timestamps
+
+    Returns:
+        agg_df (pd.DataFrame): Aggregated data with the columns 'timestamp', 'device_id', 'aggregation_type',
+            'datapoint' and 'value'
+
+    """
+    resample_period = seconds_to_duration(resample_seconds)
+    step = pd.Timedelta(pd.tseries.frequencies.to_offset(resample_period))
+    bucket_seconds = int(step.total_seconds())
+    batches = batch_device_filters(filter_list, batch_size)
+
+    stats = [
+        _keep_pairs(cratedb.query_bucket_stats(table_name, filters, bucket_seconds), wanted)
+        for filters, wanted in batches
+    ]
+    stats = pd.concat(stats, ignore_index=True) if stats else pd.DataFrame()
+    if stats.empty:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+    stats["timestamp"] = pd.to_datetime(stats["bucket"], unit="ms")
+
+    totals = stats.groupby(SERIES_KEYS)[["value_count", "numeric_count"]].transform("sum")
+    is_numeric = (totals["value_count"] == totals["numeric_count"]).to_numpy()
+    results = []
+
+    numeric = stats[is_numeric]
+    if not numeric.empty:
+        agg = numeric.set_index(SERIES_KEYS + ["timestamp"])["numeric_mean"].rename("value").sort_index()
+        agg = _fill_empty_buckets(agg, step).round(4)
+        results.append(agg.reset_index().assign(aggregation_type=f"mean_{resample_period}"))
+
+    categorical_pairs = set(map(tuple, stats.loc[~is_numeric, SERIES_KEYS].drop_duplicates().to_numpy().tolist()))
+    if categorical_pairs:
+        counts = []
+        for filters, wanted in batches:
+            wanted = categorical_pairs if wanted is None else wanted & categorical_pairs
+            if not wanted:
+                continue
+            filters = {
+                **filters,
+                'device_id': {'IN': sorted({device_id for device_id, _ in wanted})},
+                'datapoint': {'IN': sorted({datapoint for _, datapoint in wanted})},
+            }
+            counts.append(_keep_pairs(cratedb.query_bucket_value_counts(table_name, filters, bucket_seconds), wanted))
+        counts = pd.concat(counts, ignore_index=True) if counts else pd.DataFrame(columns=["value"])
+        counts = counts[counts["value"].notna()]
+        # The raw rows may have been deleted between the two queries
+        if not counts.empty:
+            counts["timestamp"] = pd.to_datetime(counts["bucket"], unit="ms")
+
+            modes = mode_from_counts(counts, SERIES_KEYS + ["timestamp"])
+            agg = modes.set_index(SERIES_KEYS + ["timestamp"])["value"].sort_index()
+            agg = _fill_empty_buckets(agg, step)
+            results.append(agg.reset_index().assign(aggregation_type=f"mode_{resample_period}"))
+
+    if not results:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+    agg_df = pd.concat(results, ignore_index=True)
+    agg_df["timestamp"] = agg_df["timestamp"].dt.tz_localize("UTC").dt.tz_convert(tz)
+
+    return agg_df[OUTPUT_COLUMNS]
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+import aiohttp
+import pandas as pd
+
+from alto_academy_workshop.utils.database import AltoCrateDB, _format_rows
+from alto_academy_workshop.utils.filters import compile_query
+
+
+class CrateDBHTTPError(Exception):
+    """ Error returned by the CrateDB HTTP endpoint """
+
+
+def split_range(start: int, end: int, step: int) -> list:
+    """
+    Split the half-open range [start, end) into sub-ranges whose inner bounds are multiples of `step`
+
+    ex. split_range(5, 25, 10) -> [(5, 10), (10, 20), (20, 25)]
+    """
+    bounds = [start]
+    bound = (start // step + 1) * step
+    while bound < end:
+        bounds.append(bound)
+        bound += step
+    bounds.append(end)
+    return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if lo < hi]
+
+
+@dataclass
+class AsyncAltoCrateDB(AltoCrateDB):
+    """
+    Class for Alto CrateDB using asyncio and the HTTP `_sql` endpoint
+
+    All requests share one `aiohttp.ClientSession`, created on first use and closed by `aclose()`.
+    At most `max_concurrency` statements run at the same time. The blocking methods of `AltoCrateDB`
+    are still available.
+    """
+    scheme: str = 'http'
+    max_concurrency: int = 8
+    request_timeout: float = 300
+    _session: aiohttp.ClientSession = field(default=None, init=False, repr=False, compare=False)
+    _semaphore: asyncio.Semaphore = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def sql_url(self) -> str:
+        host = str(self.host)
+        if "://" not in host:
+            host = f"{self.scheme}://{host}"
+        return f"{host}:{self.port}/_sql"
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            auth = aiohttp.BasicAuth(self.username, self.password or '') if self.username else None
+            self._session = aiohttp.ClientSession(
+                auth=auth,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def execute(self, stmt: str, args: list = None):
+        """
+        Execute one SQL statement
+
+        Args:
+            stmt (str): SQL statement, with '?' placeholders for `args`
+            args (list): Values of the placeholders
+
+        Returns:
+            (rows, column_names)
+
+        """
+        session = await self._get_session()
+        payload = {"stmt": stmt}
+        if args:
+            payload["args"] = args
+
+        async with self._semaphore:
+            async with session.post(self.sql_url, json=payload) as response:
+                result = await response.json(content_type=None)
+
+        if "error" in result:
+            raise CrateDBHTTPError(f"{result['error'].get('code')}: {result['error'].get('message')}")
+        return result.get("rows", []), result.get("cols", [])
+
+    async def aquery_data(self, table_name: str, filters: dict, as_frame: bool = False, order_by: str = None):
+        """
+        Query data from CrateDB, see `AltoCrateDB.query_data`
+
+        Args:
+            table_name (str): Name of the table to query data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`
+            as_frame (bool): Return a dataframe instead of a list of dictionaries
+            order_by (str): Optional ORDER BY expression
+
+        """
+        query_string, args = compile_query(f"SELECT * FROM {table_name}", filters)
+        if order_by:
+            query_string += f"\nORDER BY {order_by}"
+
+        logging.debug(f"Querying data from CrateDB over HTTP: {query_string} -- {args}")
+        rows, column_names = await self.execute(query_string, args)
+        return _format_rows(rows, column_names, 'frame' if as_frame else 'records')
+
+    async def aquery_range(self,
+                           table_name: str,
+                           filters: dict,
+                           start_timestamp: int,
+                           end_timestamp: int,
+                           partition_ms: int = 86400000,
+                           as_frame: bool = False
+                           ):
+        """
+        Query [start_timestamp, end_timestamp) with concurrent sub-range scans
+
+        The range is split at multiples of `partition_ms` (use the partition interval of the table so that
+        every scan hits one partition) and the sub-ranges are queried concurrently, at most
+        `max_concurrency` at a time. The results are merged in timestamp order.
+
+        Args:
+            table_name (str): Name of the table to query data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`, without 'timestamp'
+            start_timestamp (int): Start of the range in milliseconds (inclusive)
+            end_timestamp (int): End of the range in milliseconds (exclusive)
+            partition_ms (int): Width of the sub-ranges in milliseconds
+            as_frame (bool): Return a dataframe instead of a list of dictionaries
+
+        """
+        tasks = [
+            self.aquery_data(
+                table_name=table_name,
+                filters={**filters, 'timestamp': {'>=': lo, '<': hi}},
+                as_frame=as_frame,
+                order_by='timestamp'
+            )
+            for lo, hi in split_range(int(start_timestamp), int(end_timestamp), int(partition_ms))
+        ]
+        # Sub-ranges are disjoint and sorted, so concatenating the sorted results keeps timestamp order
+        results = await asyncio.gather(*tasks)
+
+        if as_frame:
+            return pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+        return [row for result in results for row in result]
+
+    def query_range(self, *args, **kwargs):
+        """ Blocking wrapper of `aquery_range` for synchronous callers such as pipeline blocks """
+        async def run():
+            try:
+                return await self.aquery_range(*args, **kwargs)
+            finally:
+                await self.aclose()
+
+        return asyncio.run(run())
+
+    async def aclose(self):
+        """ Close the shared HTTP session """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
@@ -0,0 +1,145 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from alto_academy_workshop.utils import state
+from alto_academy_workshop.utils.database import UPSERT_KEY
+from alto_academy_workshop.utils.pipeline import PipelineConfig, process_window
+
+
+def plan_work_units(start_timestamp: float, end_timestamp: float, chunk_interval: str = '1 day') -> list:
+    """
+    Split [start_timestamp, end_timestamp) into work units aligned to the hypertable chunk interval
+
+    Aligning the units to `chunk_interval` makes every unit write into a single hypertable chunk.
+
+    Args:
+        start_timestamp (float): Start of the range in seconds
+        end_timestamp (float): End of the range in seconds
+        chunk_interval (str): Chunk interval of the destination hypertable, ex. '1 day' or '12 hours'
+
+    Returns:
+        units (list[tuple]): List of (start, end) in seconds
+
+    """
+    step = int(pd.Timedelta(chunk_interval).total_seconds())
+    start, end = int(start_timestamp), int(end_timestamp)
+    bounds = [start] + list(range((start // step + 1) * step, end, step)) + [end]
+    return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if lo < hi]
+
+
+def backfill_unit(config: PipelineConfig, start_timestamp: float, end_timestamp: float) -> dict:
+    """
+    Process one work unit with `process_window` so that it can be run again after a failure
+
+    A unit can fail after some of its rows were written, ex. in the streaming execution mode. So a unit is
+    upserted into a destination table with the unique index of `UPSERT_KEY`, and the rows of its range are
+    deleted first from other tables. Either way, the retry of a unit writes no duplicates and does not fail
+    on the rows of the failed attempt.
+    """
+    with config.timescaledb() as timescaledb:
+        if timescaledb.has_unique_key(config.timescaledb_destination_table, UPSERT_KEY):
+            config = replace(config, timescaledb_write_mode='upsert')
+        else:
+            config = replace(config, timescaledb_write_mode='insert')
+            deleted = timescaledb.delete_data(config.timescaledb_destination_table, {"timestamp": {
+                ">=": datetime.fromtimestamp(start_timestamp, tz=timezone.utc),
+                "<": datetime.fromtimestamp(end_timestamp, tz=timezone.utc),
+            }})
+            if deleted > 0:
+                print(f"Deleted {deleted} row(s) written by a previous attempt of the unit")
+    return process_window(config, start_timestamp, end_timestamp)
+
+
+def _checkpoint_key(config: PipelineConfig, start_timestamp: float, end_timestamp: float) -> str:
+    return f"{config.cratedb_source_table}->{config.timescaledb_destination_table}:{int(start_timestamp)}-{int(end_timestamp)}"
+
+
+def run_backfill(config: PipelineConfig,
+                 start_timestamp: float,
+                 end_timestamp: float,
+                 chunk_interval: str = '1 day',
+                 processes: int = 4,
+                 checkpoint_path: str = None
+                 ) -> dict:
+    """
+    Reprocess [start_timestamp, end_timestamp) with the cratedb2timescaledb steps across a process pool
+
+    Each work unit (see `plan_work_units`) runs discovery, extraction, `aggregate_frame` and `insert_data`
+    in a worker process (see `backfill_unit`). A unit is recorded in the checkpoint file once it has been
+    written, and units already in the checkpoint are skipped, so an interrupted backfill resumes where it
+    stopped. A unit whose extraction or insert raised is never checkpointed: query errors are raised by the
+    database classes, so an outage is not mistaken for a range without data. The retry of a unit that failed
+    part way writes over the rows of the failed attempt, whatever the `timescaledb_write_mode`. At the end, the
+rollups of the destination table are refreshed over the range of the written units (see `refresh_rollups`).
+
+    Args:
+        config (PipelineConfig): Pipeline settings
+        start_timestamp (float): Start of the range in seconds
+        end_timestamp (float): End of the range in seconds
+        chunk_interval (str): Width of the work units, normally the chunk interval of the destination hypertable
+        processes (int): Number of worker processes
+        checkpoint_path (str): Path of the checkpoint file, in the default state directory if not given
+
+    Returns:
+        summary (dict): Number of units done, skipped and failed, rows processed, and the refreshed 'rollups'
+
+    """
+    checkpoint_path = checkpoint_path or state.state_path("backfill_checkpoints.json")
+    key = _checkpoint_key(config, start_timestamp, end_timestamp)
+    checkpoints = state.read_json(checkpoint_path, default={})
+    done = set(checkpoints.get(key, []))
+
+    units = plan_work_units(start_timestamp, end_timestamp, chunk_interval)
+    pending = [unit for unit in units if unit[0] not in done]
+    summary = {"units": len(units), "skipped": len(units) - len(pending), "done": 0, "failed": 0,
+               "raw_rows": 0, "aggregated_rows": 0}
+    print(f"Backfilling {len(pending)} of {len(units)} unit(s) of {chunk_interval} with {processes} process(es)")
+
+    started_at = time.monotonic()
+    written = []
+    with ProcessPoolExecutor(max_workers=max(int(processes), 1)) as executor:
+        futures = {executor.submit(backfill_unit, config, lo, hi): (lo, hi) for lo, hi in pending}
+        for future in as_completed(futures):
+            lo, hi = futures[future]
+            unit_name = f"{pd.Timestamp(lo, unit='s')} - {pd.Timestamp(hi, unit='s')}"
+            try:
+                stats = future.result()
+            except Exception as e:
+                # Not checkpointed, so that the next run extracts the unit again
+                summary["failed"] += 1
+                print(f"Failed to backfill {unit_name}: {e}")
+                continue
+
+            # Checkpoint right away so that a crash never reprocesses a unit that was written
+            done.add(lo)
+            checkpoints = state.read_json(checkpoint_path, default={})
+            checkpoints[key] = sorted(done)
+            state.write_json(checkpoint_path, checkpoints)
+
+            written.append((lo, hi))
+            summary["done"] += 1
+            summary["raw_rows"] += stats["raw_rows"]
+            summary["aggregated_rows"] += stats["aggregated_rows"]
+            finished = summary["done"] + summary["failed"]
+            elapsed = time.monotonic() - started_at
+            eta = elapsed / finished * (len(pending) - finished)
+            print(f"[{finished}/{len(pending)}] {unit_name}: {stats['raw_rows']} raw row(s) -> "
+                  f"{stats['aggregated_rows']} aggregated row(s) in {stats['seconds']:.1f}s (ETA {eta:.0f}s)")
+
+    # Roll up the written range, which the refresh policies of the rollups do not cover
+    if written:
+        try:
+            with config.timescaledb() as timescaledb:
+                summary["rollups"] = timescaledb.refresh_rollups(
+                    config.timescaledb_destination_table,
+                    min(lo for lo, _ in written),
+                    max(hi for _, hi in written)
+                )
+        except Exception as e:
+            print(f"Failed to refresh the rollups of '{config.timescaledb_destination_table}': {e}")
+
+    return summary
@@ -0,0 +1,101 @@
+import threading
+import time
+from dataclasses import dataclass, field
+
+from alto_academy_workshop.utils import state
+
+
+@dataclass
+class DeviceCatalog:
+    """
+    Cache of the (device_id, datapoint) pairs found in CrateDB tables, persisted in a local JSON state file
+
+    The first lookup of a table, and every lookup after `ttl_seconds`, rebuilds the catalog with a full scan.
+    Other lookups only scan the rows newer than the latest timestamp already seen minus `grace_seconds`, so
+    the device list of a table on an every-minute schedule costs a scan of the last minutes of data, and
+    devices whose rows arrive late are still found. The catalog also counts the rows of every device seen
+    since it was built, which `row_counts` returns for balancing shards.
+
+    The state file is shared by the blocks running in other processes (ex. one per shard). Lookups re-read
+    the file and write it under a file lock (see `state.locked`), so that the catalogs of other tables are kept.
+
+    Args:
+        cratedb (AltoCrateDB): Database to read the catalog from
+        path (str): Path of the state file
+        ttl_seconds (float): Age after which the catalog of a table is rebuilt from scratch
+        grace_seconds (float): How late rows can arrive after the rows of later timestamps, ex. the
+            'watermark_grace_seconds' of the pipeline
+
+    """
+    cratedb: object
+    path: str = field(default_factory=lambda: state.state_path("device_catalog.json"))
+    ttl_seconds: float = 86400
+    grace_seconds: float = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def get(self, table_name: str) -> dict:
+        """
+        Return the datapoints of every device of the table, refreshing the catalog first
+
+        Returns:
+            devices_datapoints (dict): Dictionary of device_id to a list of datapoints, as `get_unique_deviceid_datapoint`
+
+        """
+        with self._lock, state.locked(self.path):
+            catalogs = state.read_json(self.path, default={})
+            entry = catalogs.get(table_name)
+            if entry is None or time.time() - entry["built_at"] > self.ttl_seconds:
+                entry = {"built_at": time.time(), "max_timestamp": None, "devices": {}, "row_counts": {}}
+
+            self._refresh(table_name, entry)
+            catalogs[table_name] = entry
+            state.write_json(self.path, catalogs)
+
+        return {device_id: sorted(datapoints) for device_id, datapoints in entry["devices"].items()}
+
+    def row_counts(self, table_name: str) -> dict:
+        """ Return the number of rows of every device of the table seen by the catalog, without refreshing it """
+        entry = state.read_json(self.path, default={}).get(table_name) or {}
+        return dict(entry.get("row_counts", {}))
+
+    def invalidate(self, table_name: str = None) -> None:
+        """ Drop the catalog of a table, or of every table, so that the next lookup rebuilds it """
+        with self._lock, state.locked(self.path):
+            catalogs = state.read_json(self.path, default={})
+            if table_name is None:
+                catalogs = {}
+            else:
+                catalogs.pop(table_name, None)
+            state.write_json(self.path, catalogs)
+
+    def _refresh(self, table_name: str, entry: dict) -> None:
+        """
+        Add the pairs of the rows newer than the latest timestamp of the catalog entry minus the grace period
+
+        Only the rows newer than the latest timestamp are counted, since the older ones of the grace period
+        were counted by the previous refresh.
+        """
+        query_string = f"SELECT device_id, datapoint, MAX(timestamp), COUNT(*) FROM {table_name}"
+        args = []
+        if entry["max_timestamp"] is not None:
+            query_string = (
+                "SELECT device_id, datapoint, MAX(timestamp), SUM(CASE WHEN timestamp > ? THEN 1 ELSE 0 END) "
+                f"FROM {table_name} WHERE timestamp > ?"
+            )
+            args += [entry["max_timestamp"], entry["max_timestamp"] - int(self.grace_seconds * 1000)]
+        query_string += " GROUP BY device_id, datapoint"
+
+        with self.cratedb.session() as cursor:
+            cursor.execute(query_string, args)
+            rows = cursor.fetchall()
+
+        devices = entry["devices"]
+        row_counts = entry.setdefault("row_counts", {})
+        for device_id, datapoint, max_timestamp, count in rows:
+            row_counts[device_id] = row_counts.get(device_id, 0) + int(count or 0)
+            datapoints = devices.setdefault(device_id, [])
+            if datapoint not in datapoints:
+                datapoints.append(datapoint)
+            if max_timestamp is not None and (entry["max_timestamp"] is None or max_timestamp > entry["max_timestamp"]):
+                entry["max_timestamp"] = max_timestamp
+        entry["refreshed_at"] = time.time()
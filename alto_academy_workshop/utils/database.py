@@ -1,12 +1,24 @@
+import hashlib
 import logging
+import math
+import time
+import uuid
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from typing import List
 
+import pandas as pd
 import pendulum
 import psycopg2
+import psycopg2.errors
 from crate import client
 
+from alto_academy_workshop.utils import metrics, pgcopy
+from alto_academy_workshop.utils.filters import batch_device_filters, compile_filters, compile_query
+from alto_academy_workshop.utils.pool import ConnectionPool
+
 
 def _generate_sql_string_for_list(_list: list) -> str:
     """ Return string in a correct format for SQL query
@@ -32,12 +44,121 @@ def _generate_sql_string_for_list(_list: list) -> str:
         return str(tuple(_list))
 
 
+def _format_rows(rows: list, column_names: List[str], output: str = 'records'):
+    """ Convert rows fetched from a cursor into the requested output format
+
+    Args:
+        rows (list): List of row tuples/lists as returned by `cursor.fetchall()`
+        column_names (list[str]): Column names from `cursor.description`
+        output (str): 'records' for a list of dictionaries, 'frame' for a dataframe
+            or 'columns' for a dictionary of NumPy arrays keyed by column name
+
+    """
+    if output == 'records':
+        return [dict(zip(column_names, row)) for row in rows]
+
+    # Build the columns straight from the row tuples without intermediate dictionaries
+    frame = pd.DataFrame.from_records(rows, columns=column_names)
+    if output == 'frame':
+        return frame
+    elif output == 'columns':
+        return {col: frame[col].to_numpy() for col in frame.columns}
+    else:
+        raise ValueError(f"Unknown output format: {output}")
+
+# Columns identifying a row of aggregated data, used by the upsert mode of `AltoTimescaleDB.insert_data`
+UPSERT_KEY = ("timestamp", "device_id", "aggregation_type", "datapoint")
+
+
+def _interval_seconds(resolution) -> int:
+    """ Width of a resolution such as '15min', '1h', '1 day' or a number of seconds, in seconds """
+    if isinstance(resolution, (int, float)):
+        return int(resolution)
+    resolution = resolution.strip()
+    if resolution.endswith("d"):
+        resolution = resolution[:-1] + "D"  # The 'd' unit is deprecated by pandas >= 3
+    return int(pd.Timedelta(resolution).total_seconds())
+
+
+def _interval_name(resolution) -> str:
+    """ Normalised name of a resolution in its largest whole unit, ex. '1d' for '1 day' or '24h', '90min' for '1.5h' """
+    seconds = _interval_seconds(resolution)
+    for unit, width in (("d", 86400), ("h", 3600), ("min", 60)):
+        if seconds % width == 0:
+            return f"{seconds // width}{unit}"
+    return f"{seconds}sec"
+
+
+def rollup_name(table_name: str, resolution) -> str:
+    """ Name of the continuous aggregate of `table_name` at the given resolution, ex. 'aggregated_data_15min' """
+    return f"{table_name}_{_interval_name(resolution)}"
+
+
+def _split_text_values(data, value_column: str = 'value', text_column: str = 'value_text'):
+    """ Move the modal/categorical values of `value_column` into `text_column`
+
+    A value goes to `text_column` when its row has a 'mode_*' aggregation type or when it is not a number.
+    The other values are converted to float and stay in `value_column`. The other column of a row is NULL,
+    and so are both columns for a NaN value (ex. an empty bucket), instead of a 'NaN' text or number.
+
+    Args:
+        data (list[dict] | pd.DataFrame): Rows to insert
+        value_column (str): Name of the numeric value column
+        text_column (str): Name of the text value column
+
+    Returns:
+        data (list[dict] | pd.DataFrame): Copy of the rows with both columns
+
+    """
+    if hasattr(data, "columns"):
+        values = data[value_column]
+        values = values.astype(object).where(values.notna(), None)
+        numeric = pd.to_numeric(values, errors='coerce')
+        is_text = (numeric.isna() & values.notna() & (values.astype(str).str.lower() != 'nan')).to_numpy()
+        if 'aggregation_type' in data.columns:
+            # Not in place: pandas >= 3 returns read-only arrays
+            is_text = is_text | data['aggregation_type'].astype(str).str.startswith('mode').to_numpy()
+        data = data.copy()
+        data[text_column] = values.where(is_text & values.notna().to_numpy(), None)
+        data[value_column] = numeric.astype(object).where(~is_text & numeric.notna().to_numpy(), None)
+        return data
+
+    rows = []
+    for row in data:
+        row = dict(row)
+        value = row.get(value_column)
+        if isinstance(value, float) and math.isnan(value):
+            value = None
+        is_text = str(row.get('aggregation_type', '')).startswith('mode')
+        if value is not None and not is_text:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                is_text = True
+            else:
+                value = None if math.isnan(value) else value
+        row[text_column] = None if value is None or not is_text else str(value)
+        row[value_column] = None if is_text else value
+        rows.append(row)
+    return rows
+
+
 class AltoDatabase(ABC):
-    """ Abstract class for Alto Database """
+    """ Abstract class for Alto Database
+
+    Connections are borrowed from a bounded pool (see `ConnectionPool`) through `session()`.
+    Subclasses define how to open and check a connection, and should be closed with `close()`
+    or used as a context manager so that pooled connections are not leaked.
+    """
 
     def __init__(self, **kwargs):
         pass
 
+    def __init_subclass__(cls, **kwargs):
+        # Measure the latency, rows and bytes of every public method (see `metrics.instrument`)
+        super().__init_subclass__(**kwargs)
+        metrics.instrument_class(cls, skip=("session", "close", "aclose"))
+
     @abstractmethod
     def query_data(self, **kwargs):
         pass
@@ -46,65 +167,105 @@ class AltoDatabase(ABC):
     def insert_data(self, **kwargs):
         pass
 
+    @abstractmethod
+    def _connect(self):
+        """ Open a new connection to the database """
+        pass
+
+    def _check_connection(self, connection) -> bool:
+        """ Return True if the given pooled connection is still usable """
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        finally:
+            cursor.close()
 
-@dataclass
-class AltoCrateDB(AltoDatabase):
-    """ Class for Alto CrateDB """
-    host: str = 'localhost'
-    port: int = 4200
-    username: str = None
-    password: str = None
+    def _reset_connection(self, connection):
+        """ Clean up a connection before it goes back to the pool """
+        pass
 
-    def _add_where_clause(self, query_string: str, filters: dict):
-        """
-        Add the WHERE conditioning strings to the query string from the given filters dictionary
+    def _open_connection(self):
+        """ Open a new pooled connection, measuring the connection time """
+        with metrics.get_recorder().timed("db_connect", database=type(self).__name__):
+            return self._connect()
+
+    @property
+    def pool(self) -> ConnectionPool:
+        """ Connection pool of this database, created on first use """
+        if getattr(self, '_pool', None) is None:
+            self._pool = ConnectionPool(
+                connect=self._open_connection,
+                max_size=self.pool_size,
+                check=self._check_connection,
+                reset=self._reset_connection,
+            )
+        return self._pool
 
-        Args:
-            query_string (str): Query string to be modified
-            filters (dict): Dictionary of filters to apply to the query with the format below
+    @contextmanager
+    def session(self):
+        """
+        Borrow a pooled connection and yield a cursor on it
 
-        Returns:
-            query_string (str): Modified query string
+        The transaction is committed when the block exits normally. On error the connection is
+        rolled back by the pool and checked before its next use.
 
+            with db.session() as cursor:
+                cursor.execute(...)
         """
-        prefix = ""
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            finally:
+                cursor.close()
 
-        if "WHERE" not in query_string:
-            query_string += " WHERE "
+    def close(self):
+        """ Close all pooled connections. The database object can still be used afterwards. """
+        pool, self._pool = getattr(self, '_pool', None), None
+        if pool is not None:
+            pool.close()
 
-        for col_name, f in filters.items():
-            for oper, value in f.items():
-                if value is None:
-                    logging.debug(f"Invalid value for column [{col_name}] -- value = {value}")
-                    continue
+    def __enter__(self):
+        return self
 
-                # Preprocess value to be compatible with CrateDB query string
-                if isinstance(value, str):
-                    value_string = f"'{value}'"
-                elif isinstance(value, list):
-                    value_string = str(tuple(value)) if len(value) > 1 else str(tuple(value)).replace(",", "")
-                else:
-                    value_string = str(value)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-                # Add filter to query string
-                if oper in [">", "<", ">=", "<=", "=", "!=", "LIKE", "NOT LIKE"]:
-                    query_string += f"{prefix}{col_name} {oper} {value_string}"
-                    prefix = "\nAND "
-                elif oper.upper() in ["IN", "NOT IN"] and isinstance(value, list):
-                    query_string += f"{prefix}{col_name} {oper.upper()} {value_string}"
-                    prefix = "\nAND "
-                else:
-                    print(f"Invalid filter specified for querying data from CrateDB -- {col_name}: {f}")
 
-        return query_string
+@dataclass
+class AltoCrateDB(AltoDatabase):
+    """ Class for Alto CrateDB
+
+    Set `cache` to a `RawDataCache` to read the closed time buckets of `query_data` from local Parquet files.
+    """
+    host: str = 'localhost'
+    port: int = 4200
+    username: str = None
+    password: str = None
+    pool_size: int = 4
+    cache: object = None
+    _pool: ConnectionPool = field(default=None, init=False, repr=False, compare=False)
+    _columns: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def _connect(self):
+        cratedb_url = str(self.host) + ':' + str(self.port)
+        return client.connect(
+            cratedb_url,
+            username=self.username,
+            password=self.password
+        )
 
-    def query_data(self, table_name: str, filters: dict):
+    def query_data(self, table_name: str, filters: dict, as_frame: bool = False):
         """
         Query data from CrateDB
 
         Args:
             table_name (str): Name of the table to query data from
             filters (dict): Dictionary of filters to apply to the query with the format below
+            as_frame (bool): Return a dataframe built directly from the fetched rows instead of a list of dictionaries
 
             filters = {                             |   ex.     filters = {
                 <column_name_1>: {                  |               timestamp: {
@@ -130,47 +291,301 @@ class AltoCrateDB(AltoDatabase):
                     'value': '1289.8812590049934'}, ....]
 
         """
-        query_string = f"SELECT * FROM {table_name}"
+        return self._query(table_name, filters, output='frame' if as_frame else 'records')
+
+    def query_columns(self, table_name: str, filters: dict) -> dict:
+        """
+        Query data from CrateDB in columnar form
+
+        Args:
+            table_name (str): Name of the table to query data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`
 
-        # Step 1: Generate query string from the given filters dictionary
-        query_string = self._add_where_clause(query_string, filters)
+        Returns:
+            data (dict): Dictionary of NumPy arrays keyed by column name
+
+        """
+        return self._query(table_name, filters, output='columns')
+
+    def _query(self, table_name: str, filters: dict, output: str):
+        # Serve the closed time buckets from the local cache when the filters allow it (see `RawDataCache`)
+        # A failed fetch raises before anything is cached, so it is never stored as an empty bucket
+        if self.cache is not None and self.cache.parse(filters) is not None:
+            frame = self.cache.query(self._fetch_frame, table_name, filters)
+            if output == 'frame':
+                return frame
+            return _format_rows(list(frame.itertuples(index=False, name=None)), list(frame.columns), output)
+
+        # Step 1: Compile the filters dictionary into a parameterized query
+        query_string, args = compile_query(f"SELECT * FROM {table_name}", filters)
 
         # Step 2: Query raw data from CrateDB
-        logging.debug(f"Querying data from CrateDB: {query_string}")
-        data: list = self.__execute_query_string(query_string)
+        logging.debug(f"Querying data from CrateDB: {query_string} -- {args}")
+        result = self.__execute_query_string(query_string, args)
         logging.debug(f"Finished querying data from CrateDB")
 
-        if data is None:
-            return []
+        return _format_rows(*result, output)
+
+    def _fetch_frame(self, table_name: str, filters: dict) -> pd.DataFrame:
+        """ Query data from CrateDB into a dataframe, raising on errors """
+        query_string, args = compile_query(f"SELECT * FROM {table_name}", filters)
+        with self.session() as cursor:
+            cursor.execute(query_string, args)
+            datas = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
+        return _format_rows(datas, column_names, 'frame')
+
+    def query_data_batched(self, table_name: str, filter_list: list, batch_size: int = 500, as_frame: bool = False):
+        """
+        Query data from CrateDB for a list of per-device filters using a few multi-device queries
+
+        Filters sharing the same conditions apart from `device_id` and `datapoint` are merged into
+        `device_id IN (...)` queries of at most `batch_size` devices (see `batch_device_filters`), so the
+        number of round trips no longer grows with the number of devices.
+
+        Args:
+            table_name (str): Name of the table to query data from
+            filter_list (list): List of filters dictionary in the format accepted by `query_data`
+            batch_size (int): Maximum number of devices per query
+            as_frame (bool): Return one dataframe instead of a list of dictionaries
+
+        Returns:
+            data (list | pd.DataFrame): List of data from CrateDB. Each element is a dictionary with column name as keys.
+
+        """
+        data = []
+        for rows in self.iter_query_batched(table_name, filter_list, batch_size=batch_size, as_frame=as_frame):
+            if as_frame:
+                data.append(rows)
+            else:
+                data.extend(rows)
+
+        if as_frame:
+            return pd.concat(data, ignore_index=True) if data else pd.DataFrame()
 
         return data
 
-    def insert_data(self, table_name: str, data: list):
-        """ Insert data into CrateDB
+    def iter_query_batched(self, table_name: str, filter_list: list, batch_size: int = 500, as_frame: bool = False):
+        """
+        Query data from CrateDB like `query_data_batched`, yielding the data of one batch of devices at a time
+
+        Only one batch is held in memory at a time, so the memory used by the caller depends on `batch_size`
+        instead of the number of devices.
+
+        Yields:
+            data (list | pd.DataFrame): Data of the wanted (device_id, datapoint) pairs of one batch of devices
+
+        """
+        for filters, wanted in batch_device_filters(filter_list, batch_size):
+            rows = self.query_data(table_name=table_name, filters=filters, as_frame=as_frame)
+            if wanted is not None and as_frame:
+                if not rows.empty:
+                    pairs = pd.MultiIndex.from_frame(rows[['device_id', 'datapoint']])
+                    rows = rows[pairs.isin(list(wanted))]
+            elif wanted is not None:
+                rows = [row for row in rows if (row.get('device_id'), row.get('datapoint')) in wanted]
+            yield rows
+
+    def query_bucket_stats(self, table_name: str, filters: dict, resample_seconds: int = 60) -> pd.DataFrame:
+        """
+        Aggregate the values of each (device_id, datapoint) in buckets of `resample_seconds` inside CrateDB
 
         Args:
-            table_name (str): Table name
-            data (list[dict]): List of dictionaries. Each dictionary is a row of data
+            table_name (str): Name of the table to query data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`
+            resample_seconds (int): Bucket width in seconds. Buckets are aligned to the epoch.
+
+        Returns:
+            data (pd.DataFrame): One row per device_id, datapoint and bucket (epoch milliseconds) with the number of
+                non-null values ('value_count'), the number of values that can be cast to a number ('numeric_count')
+                and the mean of those values ('numeric_mean')
 
         """
-        cratedb_url = str(self.host) + ':' + str(self.port)
-        connection = client.connect(cratedb_url)
-        cursor = connection.cursor()
+        query_string, args = compile_query(f"""
+            SELECT device_id, datapoint,
+                   DATE_BIN(INTERVAL '{int(resample_seconds)} seconds', CAST(timestamp AS TIMESTAMP WITH TIME ZONE), 0) AS bucket,
+                   COUNT(value) AS value_count,
+                   COUNT(TRY_CAST(value AS DOUBLE PRECISION)) AS numeric_count,
+                   AVG(TRY_CAST(value AS DOUBLE PRECISION)) AS numeric_mean
+            FROM {table_name}""", filters)
+        query_string += "\nGROUP BY 1, 2, 3"
+
+        with self.session() as cursor:
+            cursor.execute(query_string, args)
+            datas = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
 
-        # Get column names from CrateDB
-        cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}'")
-        column_names = [row[0] for row in cursor.fetchall()]
+        return _format_rows(datas, column_names, 'frame')
 
-        # Construct SQL insert command
-        insert_string = f"INSERT INTO {table_name} ({','.join(column_names)}) VALUES ({','.join(['?'] * len(column_names))})"
+    def query_bucket_value_counts(self, table_name: str, filters: dict, resample_seconds: int = 60) -> pd.DataFrame:
+        """
+        Count the occurrences of each value of each (device_id, datapoint) in buckets of `resample_seconds` inside CrateDB
+
+        Returns:
+            data (pd.DataFrame): One row per device_id, datapoint, bucket (epoch milliseconds) and value with its 'count'
+
+        """
+        query_string, args = compile_query(f"""
+            SELECT device_id, datapoint,
+                   DATE_BIN(INTERVAL '{int(resample_seconds)} seconds', CAST(timestamp AS TIMESTAMP WITH TIME ZONE), 0) AS bucket,
+                   value,
+                   COUNT(*) AS count
+            FROM {table_name}""", filters)
+        query_string += "\nGROUP BY 1, 2, 3, 4"
+
+        with self.session() as cursor:
+            cursor.execute(query_string, args)
+            datas = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
+
+        return _format_rows(datas, column_names, 'frame')
+
+    def iter_query(self,
+                   table_name: str,
+                   filters: dict,
+                   chunk_rows: int = 50000,
+                   as_frame: bool = False,
+                   key_column: str = 'timestamp',
+                   tiebreak_column: str = '_id'
+                   ):
+        """
+        Query data from CrateDB in chunks of at most `chunk_rows` rows
+
+        Pages are read with keyset pagination: rows are ordered by `key_column` and then by the unique
+        `tiebreak_column`, and each page starts strictly after the (key, tiebreaker) of the last row read.
+        Every row is read exactly once, even when many rows share a key value, and no OFFSET is needed.
+        Only one page is held in memory at a time.
 
-        # Construct payload and execute many to insert data
-        entry = []
-        for row in data:
-            entry += [tuple([row[col] for col in column_names])]
+        Args:
+            table_name (str): Name of the table to query data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`
+            chunk_rows (int): Maximum number of rows per chunk
+            as_frame (bool): Yield dataframes instead of lists of dictionaries
+            key_column (str): Column used for pagination
+            tiebreak_column (str): Unique column ordering the rows sharing the same key value. The default
+                `_id` system column is not part of the yielded rows.
 
-        cursor.executemany(insert_string, entry)
-        cursor.close()
+        Yields:
+            data (list | pd.DataFrame): Chunk of data from CrateDB
+
+        """
+        chunk_rows = max(int(chunk_rows), 1)
+        output = 'frame' if as_frame else 'records'
+        conditions, args = compile_filters(filters)
+        after_last = f"({key_column} > ? OR ({key_column} = ? AND {tiebreak_column} > ?))"
+        last_row = None
+
+        while True:
+            page_conditions, page_args = [conditions] if conditions else [], list(args)
+            if last_row is not None:
+                last_key, last_tiebreaker = last_row
+                page_conditions.append(after_last)
+                page_args += [last_key, last_key, last_tiebreaker]
+
+            query_string = f"SELECT *, {tiebreak_column} AS _page_tiebreaker FROM {table_name}"
+            if page_conditions:
+                query_string += " WHERE " + "\nAND ".join(page_conditions)
+            query_string += f"\nORDER BY {key_column}, {tiebreak_column}\nLIMIT ?"
+            with self.session() as cursor:
+                cursor.execute(query_string, page_args + [chunk_rows])
+                rows = cursor.fetchall()
+                column_names = [desc[0] for desc in cursor.description]
+
+            if not rows:
+                return
+            key_idx = column_names.index(key_column)
+            last_row = (rows[-1][key_idx], rows[-1][-1])
+            # Drop the tiebreaker selected for the pagination
+            yield _format_rows([row[:-1] for row in rows], column_names[:-1], output)
+            if len(rows) < chunk_rows:
+                return
+
+    def get_column_names(self, table_name: str, refresh: bool = False) -> List[str]:
+        """ Return the column names of a table in table order, read from `information_schema` once per table """
+        if refresh or table_name not in self._columns:
+            with self.session() as cursor:
+                cursor.execute(
+                    "SELECT column_name FROM information_schema.columns WHERE table_name = ? ORDER BY ordinal_position",
+                    [table_name]
+                )
+                self._columns[table_name] = [row[0] for row in cursor.fetchall()]
+        return self._columns[table_name]
+
+    def insert_data(self,
+                    table_name: str,
+                    data: list,
+                    batch_size: int = 5000,
+                    max_workers: int = None,
+                    max_retries: int = 3
+                    ) -> dict:
+        """ Insert data into CrateDB with bulk requests
+
+        Rows are sent in bulk requests of `batch_size` rows, with up to `max_workers` requests in flight on a
+        thread pool (at most `pool_size` at a time, one pooled connection each). The rows are read lazily, so
+        only the batches in flight are held in memory. Rows reported as failed by the bulk response
+        (rowcount -2) are sent again, up to `max_retries` times with a backoff, without resending the others.
+
+        Args:
+            table_name (str): Table name
+            data (list[dict] | pd.DataFrame): List of dictionaries (each dictionary is a row of data) or a dataframe
+            batch_size (int): Number of rows per bulk request
+            max_workers (int): Number of bulk requests in flight, `pool_size` if not given
+            max_retries (int): Number of times failed rows are sent again
+
+        Returns:
+            summary (dict): Number of 'rows', 'inserted' and 'failed' rows
+
+        """
+        # Step 1: Get the column names, cached per table, and construct the SQL insert command
+        column_names = self.get_column_names(table_name)
+        insert_string = f"INSERT INTO {table_name} ({','.join(column_names)}) VALUES ({','.join(['?'] * len(column_names))})"
+        max_workers = max(int(max_workers or self.pool_size), 1)
+
+        # Step 2: Send the batches, keeping at most 2 batches per worker in memory
+        summary = {"rows": 0, "inserted": 0, "failed": 0}
+        batches = pgcopy.iter_chunks(pgcopy.iter_rows(data, column_names), batch_size)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for batch in batches:
+                summary["rows"] += len(batch)
+                pending.add(executor.submit(self._insert_batch, insert_string, batch, max_retries))
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._add_batch_results(summary, done)
+            self._add_batch_results(summary, pending)
+
+        metrics.count(rows=summary["inserted"])
+        if summary["failed"]:
+            logging.warning(f"{summary['failed']} of {summary['rows']} row(s) could not be inserted into '{table_name}'")
+        return summary
+
+    @staticmethod
+    def _add_batch_results(summary: dict, futures) -> None:
+        for future in futures:
+            inserted, failed = future.result()
+            summary["inserted"] += inserted
+            summary["failed"] += failed
+
+    def _insert_batch(self, insert_string: str, batch: List[tuple], max_retries: int):
+        """ Send one bulk request, then the failed rows again. Returns the number of inserted and failed rows. """
+        inserted = 0
+        for attempt in range(max_retries + 1):
+            if attempt:
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 10))
+            try:
+                with self.session() as cursor:
+                    results = cursor.executemany(insert_string, batch)
+            except Exception as e:
+                # The whole request failed, ex. the connection was lost
+                logging.debug(f"Bulk insert of {len(batch)} row(s) failed (attempt {attempt + 1}): {e}")
+                continue
+
+            failed = [row for row, result in zip(batch, results or []) if result.get("rowcount") == -2]
+            inserted += len(batch) - len(failed)
+            batch = failed
+            if not batch:
+                break
+        return inserted, len(batch)
 
     def delete_data(self, table_name: str, filters: dict):
         """
@@ -192,19 +607,13 @@ class AltoCrateDB(AltoDatabase):
             Supported operators: "=", "!=", ">", "<", ">=", "<=", "IN", "NOT IN", "LIKE", "NOT LIKE"
 
         """
-        # Step 1: Initialize cursor
-        cratedb_url = str(self.host) + ':' + str(self.port)
-        connection = client.connect(cratedb_url)
-        cursor = connection.cursor()
-
-        # Step 2: Generate SQL string to delete data
-        sql_string = f"DELETE FROM {table_name}"
-        sql_string = self._add_where_clause(sql_string, filters)
+        # Step 1: Compile the filters dictionary into a parameterized statement
+        sql_string, args = compile_query(f"DELETE FROM {table_name}", filters)
 
-        # Step 3: Execute SQL string
-        cursor.execute(sql_string)
-        row_count = cursor.rowcount
-        cursor.close()
+        # Step 2: Execute SQL string on a pooled connection
+        with self.session() as cursor:
+            cursor.execute(sql_string, args)
+            row_count = cursor.rowcount
 
         return row_count
 
@@ -214,93 +623,55 @@ class AltoCrateDB(AltoDatabase):
                 table_name (str): Name of the table to query data from
                 filters (dict): Dictionary of filters to apply to the data counting
         """
-        # Step 1: Initialize cursor
-        cratedb_url = str(self.host) + ':' + str(self.port)
-        connection = client.connect(cratedb_url)
-        cursor = connection.cursor()
+        # Step 1: Compile the filters dictionary into a parameterized statement
+        sql_string, args = compile_query(f"SELECT COUNT(*) FROM {table_name}", filters)
 
-        # Step 2: Generate SQL string to delete data
-        sql_string = f"SELECT COUNT(*) FROM {table_name}"
-        sql_string = self._add_where_clause(sql_string, filters)
-
-        # Step 3: Execute SQL string
-        cursor.execute(sql_string)
-        count = cursor.fetchone()[0]
+        # Step 2: Execute SQL string on a pooled connection
+        with self.session() as cursor:
+            cursor.execute(sql_string, args)
+            count = cursor.fetchone()[0]
 
         return count
     
     def get_unique_deviceid_datapoint(self, table_name, start_timestamp, end_timestamp):
-        cursor = None
-        try:
-            query_string = f"""
-                            SELECT DISTINCT device_id, datapoint
-                            FROM {table_name}
-                            WHERE timestamp >= {start_timestamp} AND timestamp < {end_timestamp}
-                            """
-            cratedb_url = str(self.host) + ':' + str(self.port)
-            connection = client.connect(
-                cratedb_url,
-                username=self.username,
-                password=self.password
-            )
-            cursor = connection.cursor()
-            cursor.execute(query_string)
+        """
+        Return the datapoints of every device with data in [start_timestamp, end_timestamp), in milliseconds.
+        A window without data has no devices. Raises if the query fails.
+        """
+        # The pairs of the whole table are never read: the devices without data in the window have nothing to extract
+        query_string = f"""
+                        SELECT DISTINCT device_id, datapoint
+                        FROM {table_name}
+                        WHERE timestamp >= ? AND timestamp < ?
+                        """
+        with self.session() as cursor:
+            cursor.execute(query_string, [start_timestamp, end_timestamp])
             datas = cursor.fetchall()
-            devices_datapoints = {}
-            for data in datas:
-                if data[0] in devices_datapoints.keys():
-                    devices_datapoints[data[0]].append(data[1])
-                else:
-                    devices_datapoints[data[0]] = [data[1]]
-            
-            if devices_datapoints == {}:
-                query_string, _ = query_string.split("WHERE")
-                cursor.execute(query_string)
-                datas = cursor.fetchall()
-                devices_datapoints = {}
-                for data in datas:
-                    if data[0] in devices_datapoints.keys():
-                        devices_datapoints[data[0]].append(data[1])
-                    else:
-                        devices_datapoints[data[0]] = [data[1]]
-            connection.close()
 
-            return devices_datapoints
-        except Exception as e:
-            print(e)
-            return {}
+        devices_datapoints = {}
+        for data in datas:
+            if data[0] in devices_datapoints.keys():
+                devices_datapoints[data[0]].append(data[1])
+            else:
+                devices_datapoints[data[0]] = [data[1]]
 
-    def __execute_query_string(self, query_string: str):
+        return devices_datapoints
+
+    def __execute_query_string(self, query_string: str, args: list = None):
         """
-        Query data from CrateDB with specified query string.
+        Query data from CrateDB with specified query string and bind arguments.
+
+        A failed query raises, so that it is never mistaken for a window without data.
+
+        Returns:
+            (rows, column_names)
         """
-        cursor = None
-        try:
-            cratedb_url = str(self.host) + ':' + str(self.port)
-            connection = client.connect(
-                cratedb_url,
-                username=self.username,
-                password=self.password
-            )
-            cursor = connection.cursor()
-            cursor.execute(query_string)
+        with self.session() as cursor:
+            cursor.execute(query_string, args)
             datas = cursor.fetchall()
-            connection.close()
-
             column_names = [desc[0] for desc in cursor.description]
 
-            # Preprocess list-of-lists into list-of-dicts with correct keys and values
-            res = list()
-            for row in datas:
-                res.append({k: v for k, v in zip(column_names, row)})
-            
-            return res
-        
-        except Exception as e:
-            logging.debug(f"Data could not be queried: {e}")
-        finally:
-            if cursor:
-                cursor.close()
+        return datas, column_names
 
 @dataclass
 class AltoTimescaleDB(AltoDatabase):
@@ -310,6 +681,10 @@ class AltoTimescaleDB(AltoDatabase):
     password: str = ''
     host: str = 'localhost'
     port: int = 5432
+    pool_size: int = 4
+    _pool: ConnectionPool = field(default=None, init=False, repr=False, compare=False)
+    _unique_keys: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+    _column_types: dict = field(default_factory=dict, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         """
@@ -317,55 +692,69 @@ class AltoTimescaleDB(AltoDatabase):
         """
         self.connection_string = f"dbname={self.db_name} user={self.username} password={self.password} host={self.host} port={self.port}"
 
-    def _add_where_clause(self, query_string: str, filters: dict):
-        """
-        Add the WHERE conditioning strings to the query string from the given filters dictionary
+    def _connect(self):
+        return psycopg2.connect(self.connection_string)
 
-        Args:
-            query_string (str): Query string to be modified
-            filters (dict): Dictionary of filters to apply to the query with the format below
+    def _check_connection(self, connection) -> bool:
+        if connection.closed:
+            return False
+        healthy = super()._check_connection(connection)
+        connection.rollback()
+        return healthy
 
-        Returns:
-            query_string (str): Modified query string
+    def _reset_connection(self, connection):
+        # End any transaction left open by the borrower. Raises on a broken connection so that the pool discards it.
+        connection.rollback()
 
+    def _execute_prepared(self, cursor, sql_string: str, args: list, retry: bool = True):
         """
-        prefix = ""
-
-        if "WHERE" not in query_string:
-            query_string += " WHERE "
+        Execute a statement with $1, $2, ... placeholders as a prepared statement
 
-        for col_name, f in filters.items():
-            for oper, value in f.items():
-                if value is None:
-                    logging.debug(f"Invalid value for column [{col_name}] -- value = {value}")
-                    continue
+        The statement is prepared once per pooled connection and executed by name afterwards,
+        so that PostgreSQL plans it once and reuses the plan. A prepared statement lives as long as the
+        connection, whatever happens to the transaction, so it stays known after a failed EXECUTE.
 
-                # Preprocess value to be compatible with CrateDB query string
-                if isinstance(value, str):
-                    value_string = f"'{value}'"
-                elif isinstance(value, list):
-                    value_string = str(tuple(value)) if len(value) > 1 else str(tuple(value)).replace(",", "")
-                else:
-                    value_string = str(value)
-
-                # Add filter to query string
-                if oper in [">", "<", ">=", "<=", "=", "!=", "LIKE", "NOT LIKE"]:
-                    query_string += f"{prefix}{col_name} {oper} {value_string}"
-                    prefix = "\nAND "
-                elif oper.upper() in ["IN", "NOT IN"] and isinstance(value, list):
-                    query_string += f"{prefix}{col_name} {oper.upper()} {value_string}"
-                    prefix = "\nAND "
-                else:
-                    print(f"Invalid filter specified for querying data from CrateDB -- {col_name}: {f}")
+        If the columns of a table read by the statement changed since it was prepared (ex. `ALTER TABLE` on a
+        `SELECT *`), PostgreSQL refuses to execute it. The statement is then deallocated and prepared again,
+        after a rollback of the transaction, which only holds reads.
+        """
+        name = "alto_" + hashlib.md5(sql_string.encode()).hexdigest()[:16]
+        prepared = self.pool.info(cursor.connection).setdefault("prepared", set())
+        if name not in prepared:
+            # The savepoint keeps the transaction usable if the statement exists already
+            cursor.execute("SAVEPOINT alto_prepare")
+            try:
+                cursor.execute(f"PREPARE {name} AS {sql_string}")
+            except psycopg2.errors.DuplicatePreparedStatement:
+                cursor.execute("ROLLBACK TO SAVEPOINT alto_prepare")
+            else:
+                cursor.execute("RELEASE SAVEPOINT alto_prepare")
+            prepared.add(name)
 
-        return query_string
+        try:
+            if args:
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args)
+            else:
+                cursor.execute(f"EXECUTE {name}")
+        except psycopg2.errors.FeatureNotSupported as e:
+            if "cached plan must not change result type" not in str(e) or not retry:
+                raise
+            cursor.connection.rollback()
+            cursor.execute(f"DEALLOCATE {name}")
+            prepared.discard(name)
+            self._execute_prepared(cursor, sql_string, args, retry=False)
 
     def create_table(self,
                      table_name: str,
                      columns_config: List[dict],
                      time_column: str = 'datetime',
                      chunk_interval: str = '7 day',
-                     partition_col: str = None
+                     partition_col: str = None,
+                     compress_segmentby: List[str] = None,
+                     compress_orderby: str = None,
+                     compress_after: str = None,
+                     retention: str = None,
+                     unique_columns: List[str] = None
                      ):
         """
         Create a table in TimescaleDB
@@ -376,13 +765,16 @@ class AltoTimescaleDB(AltoDatabase):
             time_column (str): Column name to be used as the time column
             chunk_interval (str): Chunk interval for conversion to the hypertable in TimescaleDB
             partition_col (str): Column name to be used for second-order partitioning (following the chunk interval)
+            compress_segmentby (list[str]): Columns to segment compressed chunks by, ex. ['device_id', 'datapoint'].
+                Compression is enabled when this or `compress_after` is given.
+            compress_orderby (str): Order of the rows within a compressed segment, `time_column` if not given
+            compress_after (str): Age of the chunks to compress by a compression policy, ex. '7 days'
+            retention (str): Age of the chunks to drop by a retention policy, ex. '365 days'
+            unique_columns (list[str]): Columns of a unique index, ex. `UPSERT_KEY` for the upsert mode of
+                `insert_data`. It must include `time_column`.
 
         """
-        # Step 1: Establish connection to Azure TimescaleDB
-        connection = psycopg2.connect(self.connection_string)
-        cursor = connection.cursor()
-
-        # Step 2: Generate SQL string to create table from the given columns_config dictionary
+        # Step 1: Generate SQL string to create table from the given columns_config dictionary
         sql_string = f"CREATE TABLE {table_name} ("
         for col in columns_config:
             col_name = col['name']
@@ -390,69 +782,511 @@ class AltoTimescaleDB(AltoDatabase):
             sql_string += f"{col_name} {col_type}, "
         sql_string = sql_string[:-2] + ");"
 
-        # Step 3: Create table in TimescaleDB
-        try:
-            print(f"Creating table '{table_name}' in TimescaleDB...")
-            cursor.execute(sql_string)
-            connection.commit()
-        except Exception as e:
-            print(f"Error in creating the table '{table_name}': {e}")
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
 
-        # Step 4: Convert table to hypertable if 'timestamp' column exists
-        try:
-            print(f"Converting table '{table_name}' to hypertable...")
-            sql_string = f"""SELECT create_hypertable(
-                '{table_name}',
-                '{time_column}',
-                chunk_time_interval => INTERVAL '{chunk_interval}',
-                {f'partitioning_column => {partition_col},' if partition_col else ''}
-                {f'number_partitions => 8,' if partition_col else ''}
-                if_not_exists => TRUE
-            );"""
-            cursor.execute(sql_string)
-            connection.commit()
-        except Exception as e:
-            print(f"Error in creating hypertable from table '{table_name}': {e}")
-
-        cursor.close()
-        connection.close()
-
-    def insert_data(self, table_name: str, data: list):
+            # Step 2: Create table in TimescaleDB
+            self._column_types.pop(table_name, None)
+            try:
+                print(f"Creating table '{table_name}' in TimescaleDB...")
+                cursor.execute(sql_string)
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                print(f"Error in creating the table '{table_name}': {e}")
+
+            # Step 3: Convert table to hypertable if 'timestamp' column exists
+            try:
+                print(f"Converting table '{table_name}' to hypertable...")
+                sql_string = f"""SELECT create_hypertable(
+                    '{table_name}',
+                    '{time_column}',
+                    chunk_time_interval => INTERVAL '{chunk_interval}',
+                    {f'partitioning_column => {partition_col},' if partition_col else ''}
+                    {f'number_partitions => 8,' if partition_col else ''}
+                    if_not_exists => TRUE
+                );"""
+                cursor.execute(sql_string)
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                print(f"Error in creating hypertable from table '{table_name}': {e}")
+
+            # Step 4: Create the unique index used by upserts, before compression is enabled
+            if unique_columns:
+                self._unique_keys.pop(table_name, None)
+                try:
+                    print(f"Creating unique index on ({', '.join(unique_columns)}) of table '{table_name}'...")
+                    cursor.execute(
+                        f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_unique_idx ON {table_name} ({', '.join(unique_columns)});"
+                    )
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    print(f"Error in creating unique index on table '{table_name}': {e}")
+
+            # Step 5: Enable native compression and compress the chunks older than `compress_after`
+            if compress_segmentby or compress_after:
+                try:
+                    print(f"Enabling compression on hypertable '{table_name}'...")
+                    settings = [
+                        "timescaledb.compress",
+                        f"timescaledb.compress_orderby = '{compress_orderby or time_column}'",
+                    ]
+                    if compress_segmentby:
+                        settings.append(f"timescaledb.compress_segmentby = '{', '.join(compress_segmentby)}'")
+                    cursor.execute(f"ALTER TABLE {table_name} SET ({', '.join(settings)});")
+                    if compress_after:
+                        cursor.execute(
+                            f"SELECT add_compression_policy('{table_name}', INTERVAL '{compress_after}', if_not_exists => TRUE);"
+                        )
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    print(f"Error in enabling compression on hypertable '{table_name}': {e}")
+
+            # Step 6: Drop the chunks older than `retention`
+            if retention:
+                try:
+                    print(f"Adding retention policy of {retention} to hypertable '{table_name}'...")
+                    cursor.execute(
+                        f"SELECT add_retention_policy('{table_name}', INTERVAL '{retention}', if_not_exists => TRUE);"
+                    )
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    print(f"Error in adding retention policy to hypertable '{table_name}': {e}")
+
+            cursor.close()
+
+    def create_rollups(self,
+                       table_name: str,
+                       resolutions: List[str] = ('15min', '1h', '1d'),
+                       time_column: str = 'timestamp',
+                       value_column: str = 'value',
+                       aggregation_type_pattern: str = 'mean%',
+                       realtime: bool = False,
+                       refresh: bool = True
+                       ) -> List[str]:
+        """
+        Create hierarchical continuous aggregates (rollups) on top of an aggregated data table
+
+        The first resolution is computed from `table_name`, every next one from the previous rollup, so each
+        resolution must be a multiple of the previous one. Rollups keep 'value_sum', 'value_count', 'value_min'
+        and 'value_max' per bucket, device_id and datapoint so that coarser levels combine them exactly; the
+        mean is value_sum / value_count (see `query_rollup`). Only the rows whose aggregation_type matches
+        `aggregation_type_pattern` are rolled up, and their value is cast to DOUBLE PRECISION.
+        Each rollup gets a refresh policy covering its last 3 buckets, run once per bucket.
+
+        Args:
+            table_name (str): Name of the aggregated data hypertable
+            resolutions (list[str]): Rollup resolutions from finest to coarsest, ex. ['15min', '1h', '1d']
+            time_column (str): Time column of `table_name`
+            value_column (str): Value column of `table_name`
+            aggregation_type_pattern (str): LIKE pattern of the aggregation types to roll up
+            realtime (bool): Also aggregate the rows not materialized yet when the rollup is queried
+            refresh (bool): Materialize the existing data right after creating each rollup
+
+        Returns:
+            view_names (list[str]): Names of the rollups, from finest to coarsest
+
+        """
+        # Step 1: Validate the hierarchy of resolutions
+        widths = [_interval_seconds(resolution) for resolution in resolutions]
+        for finer, coarser in zip(widths[:-1], widths[1:]):
+            if coarser <= finer or coarser % finer != 0:
+                raise ValueError(f"Rollup resolutions must be increasing multiples of each other, got {list(resolutions)}")
+
+        view_names = []
+        with self.pool.connection() as connection:
+            # Continuous aggregates cannot be refreshed inside a transaction block
+            connection.autocommit = True
+            cursor = connection.cursor()
+            try:
+                source = None
+                for width in widths:
+                    view_name = rollup_name(table_name, width)
+                    bucket = f"time_bucket(INTERVAL '{width} seconds', {time_column if source is None else 'timestamp'})"
+
+                    # Step 2: Create the rollup from the table or from the previous rollup
+                    if source is None:
+                        numeric_value = f"CAST({value_column} AS DOUBLE PRECISION)"
+                        select_string = f"""SELECT {bucket} AS timestamp, device_id, datapoint,
+                            SUM({numeric_value}) AS value_sum,
+                            COUNT({numeric_value}) AS value_count,
+                            MIN({numeric_value}) AS value_min,
+                            MAX({numeric_value}) AS value_max
+                        FROM {table_name}
+                        WHERE aggregation_type LIKE '{aggregation_type_pattern}'"""
+                    else:
+                        select_string = f"""SELECT {bucket} AS timestamp, device_id, datapoint,
+                            SUM(value_sum) AS value_sum,
+                            SUM(value_count) AS value_count,
+                            MIN(value_min) AS value_min,
+                            MAX(value_max) AS value_max
+                        FROM {source}"""
+                    print(f"Creating rollup '{view_name}' in TimescaleDB...")
+                    cursor.execute(f"""CREATE MATERIALIZED VIEW IF NOT EXISTS {view_name}
+                        WITH (timescaledb.continuous, timescaledb.materialized_only = {str(not realtime).lower()}) AS
+                        {select_string}
+                        GROUP BY 1, device_id, datapoint
+                        WITH NO DATA;""")
+
+                    # Step 3: Refresh the last 3 buckets once per bucket, leaving the current bucket out
+                    cursor.execute(f"""SELECT add_continuous_aggregate_policy(
+                        '{view_name}',
+                        start_offset => INTERVAL '{3 * width} seconds',
+                        end_offset => INTERVAL '{width} seconds',
+                        schedule_interval => INTERVAL '{width} seconds',
+                        if_not_exists => TRUE
+                    );""")
+
+                    # Step 4: Materialize the data already in the source
+                    if refresh:
+                        cursor.execute(f"CALL refresh_continuous_aggregate('{view_name}', NULL, NULL);")
+
+                    view_names.append(view_name)
+                    source = view_name
+            finally:
+                cursor.close()
+                connection.autocommit = False
+
+        return view_names
+
+    def list_rollups(self, table_name: str) -> List[dict]:
+        """
+        List the continuous aggregates built on top of a table, directly or through other rollups
+
+        Returns:
+            rollups (list[dict]): One dictionary per rollup with 'view_name', 'source' (the table or rollup it
+                is computed from), 'materialized_only', 'schedule_interval' and 'config' of the refresh policy,
+                parents before children
+
+        """
+        with self.session() as cursor:
+            cursor.execute("""
+                SELECT ca.view_name, ca.hypertable_name, ca.materialization_hypertable_name,
+                       ca.materialized_only, j.schedule_interval, j.config
+                FROM timescaledb_information.continuous_aggregates ca
+                LEFT JOIN timescaledb_information.jobs j
+                    ON j.proc_name = 'policy_refresh_continuous_aggregate'
+                    AND j.hypertable_name = ca.materialization_hypertable_name
+            """)
+            rows = cursor.fetchall()
+
+        # Walk the hierarchy: a child rollup reads from the materialization hypertable of its parent
+        sources = {table_name: table_name}
+        rollups = []
+        found = True
+        while found:
+            found = False
+            for view_name, hypertable, materialization, materialized_only, schedule_interval, config in rows:
+                if hypertable in sources and materialization not in sources:
+                    sources[materialization] = view_name
+                    rollups.append({
+                        "view_name": view_name,
+                        "source": sources[hypertable],
+                        "materialized_only": materialized_only,
+                        "schedule_interval": schedule_interval,
+                        "config": config,
+                    })
+                    found = True
+        return rollups
+
+    def drop_rollups(self, table_name: str, view_names: List[str] = None) -> List[str]:
+        """
+        Drop continuous aggregates of a table together with their refresh policies
+
+        Args:
+            table_name (str): Name of the aggregated data hypertable
+            view_names (list[str]): Rollups to drop, all rollups of the table if not given. The rollups built
+                on top of a dropped rollup are dropped too.
+
+        Returns:
+            view_names (list[str]): Names of the dropped rollups
+
+        """
+        rollups = self.list_rollups(table_name)
+        dropped = set()
+        for rollup in rollups:
+            if view_names is None or rollup["view_name"] in view_names or rollup["source"] in dropped:
+                dropped.add(rollup["view_name"])
+
+        # Drop children before their parents
+        ordered = [rollup["view_name"] for rollup in reversed(rollups) if rollup["view_name"] in dropped]
+        with self.session() as cursor:
+            for view_name in ordered:
+                print(f"Dropping rollup '{view_name}' from TimescaleDB...")
+                cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {view_name};")
+        return ordered
+
+    def refresh_rollups(self, table_name: str, start_timestamp: float, end_timestamp: float) -> List[str]:
+        """
+        Materialize the buckets of every rollup of a table that overlap a time range, ex. after a backfill
+
+        The refresh policies only cover the last buckets (see `create_rollups`), so older rows written later
+        are not rolled up until this is called. The range is widened to whole buckets of each rollup, and the
+        rollups are refreshed parents before children.
+
+        Args:
+            table_name (str): Name of the aggregated data hypertable
+            start_timestamp (float): Start of the range in seconds
+            end_timestamp (float): End of the range in seconds
+
+        Returns:
+            view_names (list[str]): Names of the refreshed rollups
+
+        """
+        rollups = self.list_rollups(table_name)
+        with self.pool.connection() as connection:
+            # Continuous aggregates cannot be refreshed inside a transaction block
+            connection.autocommit = True
+            cursor = connection.cursor()
+            try:
+                for rollup in rollups:
+                    # The refresh policy runs once per bucket, so its schedule interval is the bucket width
+                    width = rollup["schedule_interval"]
+                    width = int(width.total_seconds()) if width else 1
+                    start = int(start_timestamp) // width * width
+                    end = -(-int(end_timestamp) // width) * width
+                    print(f"Refreshing rollup '{rollup['view_name']}' from {pd.Timestamp(start, unit='s')} to {pd.Timestamp(end, unit='s')}...")
+                    cursor.execute(
+                        "CALL refresh_continuous_aggregate(%s, to_timestamp(%s), to_timestamp(%s));",
+                        [rollup["view_name"], start, end]
+                    )
+            finally:
+                cursor.close()
+                connection.autocommit = False
+        return [rollup["view_name"] for rollup in rollups]
+
+    def query_rollup(self, table_name: str, resolution: str, filters: dict, as_frame: bool = False):
+        """
+        Query a rollup created by `create_rollups` instead of scanning the aggregated data table
+
+        Args:
+            table_name (str): Name of the aggregated data hypertable
+            resolution (str): Resolution of the rollup, ex. '1h'
+            filters (dict): Dictionary of filters in the format accepted by `query_data`, on the columns
+                'timestamp', 'device_id' and 'datapoint'
+            as_frame (bool): Return a dataframe instead of a list of dictionaries
+
+        Returns:
+            data (list | pd.DataFrame): Rows with 'timestamp', 'device_id', 'datapoint', 'value' (the mean),
+                'value_min', 'value_max' and 'value_count'
+
+        """
+        view_name = rollup_name(table_name, resolution)
+        sql_string, args = compile_query(
+            "SELECT timestamp, device_id, datapoint, value_sum / NULLIF(value_count, 0) AS value, "
+            f"value_min, value_max, value_count FROM {view_name}",
+            filters,
+            paramstyle='numeric'
+        )
+        with self.session() as cursor:
+            self._execute_prepared(cursor, sql_string, args)
+            datas = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
+        return _format_rows(datas, column_names, 'frame' if as_frame else 'records')
+
+    def get_column_types(self, table_name: str, refresh: bool = False) -> List[tuple]:
+        """ Return the (column name, data type) of each column of a table in table order, read once per table """
+        if refresh or table_name not in self._column_types:
+            with self.session() as cursor:
+                cursor.execute(
+                    "SELECT column_name, data_type FROM information_schema.columns "
+                    "WHERE table_name = %s ORDER BY ordinal_position",
+                    [table_name]
+                )
+                self._column_types[table_name] = [(row[0], row[1]) for row in cursor.fetchall()]
+        return self._column_types[table_name]
+
+    def get_unique_keys(self, table_name: str, refresh: bool = False) -> List[tuple]:
+        """ Return the columns of every unique index of a table, read from `pg_index` once per table """
+        if refresh or table_name not in self._unique_keys:
+            with self.session() as cursor:
+                cursor.execute(
+                    "SELECT array_agg(a.attname::text ORDER BY a.attnum) FROM pg_index i "
+                    "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+                    "WHERE i.indrelid = to_regclass(%s) AND i.indisunique GROUP BY i.indexrelid",
+                    [table_name]
+                )
+                self._unique_keys[table_name] = [tuple(row[0]) for row in cursor.fetchall()]
+        return self._unique_keys[table_name]
+
+    def has_unique_key(self, table_name: str, columns: tuple = UPSERT_KEY) -> bool:
+        """ Return True if the table has a unique index on exactly these columns, which upserts need """
+        return any(set(key) == set(columns) for key in self.get_unique_keys(table_name))
+
+    def insert_data(self,
+                    table_name: str,
+                    data: list,
+                    method: str = 'copy',
+                    copy_format: str = 'text',
+                    chunk_rows: int = 50000,
+                    mode: str = 'auto',
+                    conflict_columns: tuple = UPSERT_KEY
+                    ):
         """ Insert data into TimescaleDB
 
+        With method 'copy', rows are streamed with `COPY ... FROM STDIN` in chunks of `chunk_rows` rows,
+        all within one transaction. If COPY fails, the transaction is rolled back and the rows are inserted
+        again with `executemany`. The binary format falls back to the text format when the table has a
+        column type without a binary encoder (see `pgcopy.binary_encoders`).
+        When the table has a 'value_text' column, the modal/categorical values are written there and the
+        numeric values to 'value' (see `_split_text_values`).
+
         Args:
             table_name (str): Table name
-            data (list[dict]): List of dictionaries. Each dictionary is a row of data
+            data (list[dict] | pd.DataFrame): List of dictionaries (each dictionary is a row of data) or a dataframe
+            method (str): 'copy' or 'executemany'
+            copy_format (str): 'text' or 'binary'
+            chunk_rows (int): Maximum number of rows per COPY statement
+            mode (str): 'insert' to append the rows, 'upsert' to replace the rows with the same
+                `conflict_columns` (see `_upsert_data`), so that a retried run does not write duplicates, or
+                'auto' to upsert into the tables with a unique index on `conflict_columns` (see the
+                `unique_columns` of `create_table`) and insert into the others
+            conflict_columns (tuple): Columns of the unique index of the table, used by the upsert mode
 
         """
-        # Step 1: Establish connection to Azure TimescaleDB
-        connection = psycopg2.connect(self.connection_string)
-        cursor = connection.cursor()
+        # Step 1: Get column names and types from TimescaleDB
+        column_types = self.get_column_types(table_name)
+        column_names = [name for name, _ in column_types]
+
+        # Step 2: Route the modal/categorical values to the 'value_text' column of tables that have one
+        if 'value_text' in column_names and (not hasattr(data, "columns") or 'value_text' not in data.columns):
+            data = _split_text_values(data)
+
+        # Step 3: Write the rows of a window written before over its rows instead of failing on the unique index
+        if mode == 'auto':
+            mode = 'upsert' if self.has_unique_key(table_name, conflict_columns) else 'insert'
+        if mode == 'upsert':
+            self._upsert_data(table_name, data, column_types, copy_format, chunk_rows, list(conflict_columns))
+            return
+        elif mode != 'insert':
+            raise ValueError(f"Unknown write mode: {mode}")
+
+        if method == 'copy':
+            try:
+                self._copy_data(table_name, data, column_types, copy_format, chunk_rows)
+                return
+            except Exception as e:
+                logging.warning(f"COPY into '{table_name}' failed, falling back to executemany: {e}")
+        elif method != 'executemany':
+            raise ValueError(f"Unknown insert method: {method}")
+
+        self._insert_data_executemany(table_name, data, column_names)
+
+    def _copy_data(self, table_name: str, data, column_types: List[tuple], copy_format: str, chunk_rows: int):
+        """ Stream rows into the table with COPY FROM STDIN """
+        with self.session() as cursor:
+            self._copy_rows(cursor, table_name, data, column_types, copy_format, chunk_rows)
+
+    def _copy_rows(self, cursor, table_name: str, data, column_types: List[tuple], copy_format: str, chunk_rows: int):
+        """ COPY the rows into a table with the given cursor, in chunks of `chunk_rows` rows """
+        column_names = [name for name, _ in column_types]
+        data_types = [data_type for _, data_type in column_types]
+        encoders = None
+        if copy_format == 'binary':
+            encoders = pgcopy.binary_encoders(data_types)
+            if encoders is None:
+                logging.debug(f"Binary COPY is not supported for the column types of '{table_name}', using text")
+        elif copy_format != 'text':
+            raise ValueError(f"Unknown COPY format: {copy_format}")
+
+        copy_string = f"COPY {table_name} ({','.join(column_names)}) FROM STDIN"
+        if encoders is not None:
+            copy_string += " WITH (FORMAT binary)"
+
+        for chunk in pgcopy.iter_chunks(pgcopy.iter_rows(data, column_names), chunk_rows):
+            if encoders is not None:
+                buffer = pgcopy.encode_binary(chunk, encoders, data_types)
+            else:
+                buffer = pgcopy.encode_text(chunk, data_types)
+            metrics.count(rows=len(chunk), bytes=buffer.seek(0, 2))
+            buffer.seek(0)
+            cursor.copy_expert(copy_string, buffer)
+
+    def _upsert_data(self,
+                     table_name: str,
+                     data,
+                     column_types: List[tuple],
+                     copy_format: str,
+                     chunk_rows: int,
+                     conflict_columns: List[str]
+                     ):
+        """
+        Insert or replace rows with a staging table and one set-based statement
 
-        # Step 2: Get column names from TimescaleDB
-        cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}'")
-        column_names = [row[0] for row in cursor.fetchall()]
+        The rows are COPied into a temporary table dropped at commit, then merged with
+        `INSERT ... SELECT DISTINCT ON (conflict_columns) ... ON CONFLICT (conflict_columns) DO UPDATE`.
+        When the data has several rows with the same key, the last one wins. The table needs a unique index
+        on `conflict_columns` (see the `unique_columns` of `create_table`).
+        """
+        column_names = [name for name, _ in column_types]
+        key = ", ".join(conflict_columns)
+        updates = [col for col in column_names if col not in conflict_columns]
+        staging = f"alto_staging_{uuid.uuid4().hex[:16]}"
+
+        with self.session() as cursor:
+            # Step 1: COPY the rows into a staging table that only lives until the commit
+            cursor.execute(f"CREATE TEMPORARY TABLE {staging} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP;")
+            self._copy_rows(cursor, staging, data, column_types, copy_format, chunk_rows)
+
+            # Step 2: Merge the staging table in one statement, keeping the last copy of duplicated keys
+            if updates:
+                on_conflict = "DO UPDATE SET " + ", ".join(f"{col} = EXCLUDED.{col}" for col in updates)
+            else:
+                on_conflict = "DO NOTHING"
+            cursor.execute(f"""INSERT INTO {table_name} ({', '.join(column_names)})
+                SELECT DISTINCT ON ({key}) {', '.join(column_names)}
+                FROM {staging}
+                ORDER BY {key}, ctid DESC
+                ON CONFLICT ({key}) {on_conflict};""")
+            logging.debug(f"Upserted {cursor.rowcount} row(s) into '{table_name}'")
+
+    def delete_data(self, table_name: str, filters: dict) -> int:
+        """
+        Delete data from TimescaleDB
 
-        # Step 3: Construct SQL insert command
-        insert_string = f"INSERT INTO {table_name} ({','.join(column_names)}) VALUES ({','.join(['%s'] * len(column_names))})"
+        Args:
+            table_name (str): Name of the table to delete data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`
+
+        Returns:
+            row_count (int): Number of deleted rows
+
+        """
+        # Step 1: Compile the filters dictionary into a parameterized statement
+        sql_string, args = compile_query(f"DELETE FROM {table_name}", filters, paramstyle='format')
+
+        # Step 2: Execute SQL string on a pooled connection
+        with self.session() as cursor:
+            cursor.execute(sql_string, args)
+            row_count = cursor.rowcount
+
+        return row_count
 
-        # Step 4: Construct payload and executemany to insert data
-        entry = []
-        for row in data:
-            entry += [tuple([row[col] for col in column_names])]
+    def _insert_data_executemany(self, table_name: str, data, column_names: List[str]):
+        """ Insert rows with one INSERT statement per row """
+        # Step 1: Borrow a pooled connection to TimescaleDB. The insert is committed when the session ends.
+        with self.session() as cursor:
+            # Step 2: Construct SQL insert command
+            insert_string = f"INSERT INTO {table_name} ({','.join(column_names)}) VALUES ({','.join(['%s'] * len(column_names))})"
 
-        cursor.executemany(insert_string, entry)
-        connection.commit()
-        connection.close()
-        cursor.close()
+            # Step 3: Construct payload and executemany to insert data
+            entry = list(pgcopy.iter_rows(data, column_names))
 
-    def query_data(self, table_name: str, filters: dict):
+            cursor.executemany(insert_string, entry)
+            metrics.count(rows=len(entry))
+
+    def query_data(self, table_name: str, filters: dict, as_frame: bool = False):
         """
         Query data from TimescaleDB
 
            Args:
                 table_name (str): Name of the table to query data from
                 filters (dict): Dictionary of filters to apply to the query with the format below
+                as_frame (bool): Return a dataframe built directly from the fetched rows instead of a list of dictionaries
 
                 filters = {                             |   ex.     filters = {
                     <column_name_1>: {                  |               timestamp: {
@@ -477,24 +1311,67 @@ class AltoTimescaleDB(AltoDatabase):
                        'datapoint': 'power',
                        'value': '1289.8812590049934'}, ....]
         """
-        # Step 1: Initialize cursor
-        connection = psycopg2.connect(self.connection_string)
-        cursor = connection.cursor()
+        return self._query(table_name, filters, output='frame' if as_frame else 'records')
 
-        # Step 2: Generate SQL string to query data
-        sql_string = f"SELECT * FROM {table_name}"
-        sql_string = self._add_where_clause(sql_string, filters)
+    def query_columns(self, table_name: str, filters: dict) -> dict:
+        """
+        Query data from TimescaleDB in columnar form
 
-        # Step 3: Execute SQL string
-        cursor.execute(sql_string)
-        datas = cursor.fetchall()
-        connection.close()
+        Args:
+            table_name (str): Name of the table to query data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`
 
-        column_names = [desc[0] for desc in cursor.description]
+        Returns:
+            data (dict): Dictionary of NumPy arrays keyed by column name
 
-        # Step 4: Preprocess list-of-lists into list-of-dicts with correct keys and values
-        res = list()
-        for row in datas:
-            res.append({k: v for k, v in zip(column_names, row)})
+        """
+        return self._query(table_name, filters, output='columns')
 
-        return res
\ No newline at end of file
+    def _query(self, table_name: str, filters: dict, output: str):
+        # Step 1: Compile the filters dictionary into a parameterized query
+        sql_string, args = compile_query(f"SELECT * FROM {table_name}", filters, paramstyle='numeric')
+
+        # Step 2: Execute the query as a prepared statement on a pooled connection
+        with self.session() as cursor:
+            self._execute_prepared(cursor, sql_string, args)
+            datas = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
+
+        # Step 3: Convert the rows into the requested format
+        return _format_rows(datas, column_names, output)
+
+    def iter_query(self, table_name: str, filters: dict, chunk_rows: int = 50000, as_frame: bool = False):
+        """
+        Query data from TimescaleDB in chunks of at most `chunk_rows` rows
+
+        Rows are read through a named (server-side) cursor so that only one chunk is held in memory at a time.
+        The pooled connection stays borrowed until the generator is exhausted or closed.
+
+        Args:
+            table_name (str): Name of the table to query data from
+            filters (dict): Dictionary of filters in the format accepted by `query_data`
+            chunk_rows (int): Maximum number of rows per chunk
+            as_frame (bool): Yield dataframes instead of lists of dictionaries
+
+        Yields:
+            data (list | pd.DataFrame): Chunk of data from TimescaleDB
+
+        """
+        chunk_rows = max(int(chunk_rows), 1)
+        output = 'frame' if as_frame else 'records'
+        # Server-side cursors cannot run a prepared statement, so the arguments are bound by psycopg2
+        sql_string, args = compile_query(f"SELECT * FROM {table_name}", filters, paramstyle='format')
+
+        with self.pool.connection() as connection:
+            cursor = connection.cursor(name=f"alto_iter_{uuid.uuid4().hex}")
+            cursor.itersize = chunk_rows
+            try:
+                cursor.execute(sql_string, args)
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    column_names = [desc[0] for desc in cursor.description]
+                    yield _format_rows(rows, column_names, output)
+            finally:
+                cursor.close()
@@ -0,0 +1,174 @@
+import logging
+from functools import lru_cache
+from typing import List, Tuple
+
+COMPARISON_OPERATORS = (">", "<", ">=", "<=", "=", "!=", "LIKE", "NOT LIKE")
+LIST_OPERATORS = ("IN", "NOT IN")
+
+# Placeholder for the i-th (1-based) bind argument in each DB-API paramstyle
+_PLACEHOLDERS = {
+    'qmark': lambda i: "?",  # crate
+    'format': lambda i: "%s",  # psycopg2
+    'numeric': lambda i: f"${i}",  # PostgreSQL PREPARE
+}
+
+
+@lru_cache(maxsize=1024)
+def _compile_shape(shape: tuple, paramstyle: str) -> str:
+    """ Compile the WHERE conditions of a filter shape, a tuple of (column name, operator) """
+    placeholder = _PLACEHOLDERS[paramstyle]
+    conditions = []
+    for i, (col_name, oper) in enumerate(shape, start=1):
+        # Lists are bound as one array argument so that the statement text does not depend on the list length
+        if oper == "IN":
+            conditions.append(f"{col_name} = ANY({placeholder(i)})")
+        elif oper == "NOT IN":
+            conditions.append(f"NOT ({col_name} = ANY({placeholder(i)}))")
+        else:
+            conditions.append(f"{col_name} {oper} {placeholder(i)}")
+    return "\nAND ".join(conditions)
+
+
+def compile_filters(filters: dict, paramstyle: str = 'qmark') -> Tuple[str, list]:
+    """
+    Compile a filters dictionary into parameterized WHERE conditions and their bind arguments
+
+    The SQL text only depends on the shape of the filters (columns and operators), never on the values,
+    and is memoized per shape. Repeated queries therefore send the same statement text, which lets the
+    database reuse its plan.
+
+        compile_filters({'device_id': {'IN': ['d1', 'd2']}, 'timestamp': {'>=': 100}})
+        -> ("device_id = ANY(?)\\nAND timestamp >= ?", [['d1', 'd2'], 100])
+
+    Args:
+        filters (dict): Dictionary of filters in the format accepted by `query_data`
+        paramstyle (str): 'qmark' (?), 'format' (%s) or 'numeric' ($1)
+
+    Returns:
+        (conditions, args): SQL conditions joined with AND (empty if there is no valid filter) and bind arguments
+
+    """
+    shape, args = [], []
+    for col_name, f in filters.items():
+        for oper, value in f.items():
+            if value is None:
+                logging.debug(f"Invalid value for column [{col_name}] -- value = {value}")
+                continue
+
+            oper = oper.upper()
+            if oper in COMPARISON_OPERATORS:
+                shape.append((col_name, oper))
+                args.append(value)
+            elif oper in LIST_OPERATORS and isinstance(value, list):
+                shape.append((col_name, oper))
+                args.append(list(value))
+            else:
+                print(f"Invalid filter specified for querying data -- {col_name}: {f}")
+
+    return _compile_shape(tuple(shape), paramstyle), args
+
+
+def compile_query(query_string: str, filters: dict, paramstyle: str = 'qmark') -> Tuple[str, list]:
+    """ Append the WHERE clause compiled from `filters` (see `compile_filters`) to a query string """
+    conditions, args = compile_filters(filters, paramstyle)
+    if conditions:
+        query_string += f" WHERE {conditions}"
+    return query_string, args
+
+
+def _single_value(f: dict, oper: str):
+    """ Return the value of the only condition in a column filter if it uses the given operator, else None """
+    if not isinstance(f, dict) or len(f) != 1:
+        return None
+    (key, value), = f.items()
+    if key.upper() != oper:
+        return None
+    return value
+
+
+def batch_device_filters(filter_list: list, batch_size: int = 500) -> List[Tuple[dict, set]]:
+    """
+    Group per-device filters into multi-device filters
+
+    Filters produced by `construct_filter` look like
+
+        {
+            'device_id': {'=': <device_id>},
+            'datapoint': {'IN': [<datapoint_1>, <datapoint_2>, ...]},
+            'timestamp': {'>=': <start_ms>, '<': <end_ms>},
+        }
+
+    Filters that share every condition except `device_id` and `datapoint` (e.g. the same time range) are
+    merged into one filter with `device_id IN (...)` and the union of their datapoints, with at most
+    `batch_size` devices per merged filter. Because the union of datapoints may select more
+    (device_id, datapoint) pairs than requested, each merged filter comes with the set of wanted pairs
+    so that the caller can drop the extra rows. Filters in any other shape are returned as they are
+    with `None` as the set of wanted pairs.
+
+    Args:
+        filter_list (list): List of filters dictionary in the format accepted by `query_data`
+        batch_size (int): Maximum number of devices per merged filter
+
+    Returns:
+        batches (list[tuple[dict, set]]): List of (filters, wanted (device_id, datapoint) pairs)
+
+    """
+    batch_size = max(int(batch_size), 1)
+    groups = {}
+    batches = []
+
+    for f in filter_list:
+        if not isinstance(f, dict):
+            continue
+        device_id = _single_value(f.get('device_id'), '=')
+        datapoints = _single_value(f.get('datapoint'), 'IN')
+        if datapoints is None:
+            datapoints = _single_value(f.get('datapoint'), '=')
+            datapoints = [datapoints] if datapoints is not None else None
+        if device_id is None or not datapoints:
+            batches.append((f, None))
+            continue
+
+        rest = {col: cond for col, cond in f.items() if col not in ('device_id', 'datapoint')}
+        key = repr(sorted((col, sorted(cond.items())) for col, cond in rest.items()))
+        group = groups.setdefault(key, {'rest': rest, 'devices': {}})
+        group['devices'].setdefault(device_id, set()).update(datapoints)
+
+    for group in groups.values():
+        devices = list(group['devices'].items())
+        for i in range(0, len(devices), batch_size):
+            chunk = devices[i:i + batch_size]
+            wanted = {(device_id, dp) for device_id, dps in chunk for dp in dps}
+            merged = {
+                'device_id': {'IN': [device_id for device_id, _ in chunk]},
+                'datapoint': {'IN': sorted({dp for _, dps in chunk for dp in dps})},
+                **group['rest'],
+            }
+            batches.append((merged, wanted))
+
+    return batches
+
+
+def build_device_filters(devices_datapoints: dict, start_timestamp: float, end_timestamp: float) -> list:
+    """
+    Build one filter per device for the half-open window [start_timestamp, end_timestamp)
+
+    Args:
+        devices_datapoints (dict): Dictionary of device_id to a list of datapoints
+        start_timestamp (float): Start of the window in seconds
+        end_timestamp (float): End of the window in seconds
+
+    Returns:
+        filter_list (list): List of filters dictionary in the format accepted by `query_data`
+
+    """
+    filter_list = []
+    for device_id, datapoints in devices_datapoints.items():
+        filters = {
+            'device_id': {'=': device_id},
+            'datapoint': {'IN': datapoints},
+            'timestamp': {'>=': int(start_timestamp) * 1000, '<': int(end_timestamp) * 1000},  # Times 1000 to be in ms uni
+        }
+        filter_list.append(filters)
+
+    return filter_list
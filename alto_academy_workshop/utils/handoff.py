@@ -0,0 +1,154 @@
+import os
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Under the data directory of Mage, which is shared by its executors when MAGE_DATA_DIR is on shared storage
+DEFAULT_HANDOFF_DIR = os.path.join(
+    os.environ.get("MAGE_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".mage_data"),
+    "alto_academy_workshop",
+    "handoff"
+)
+HANDOFF_FORMATS = ("arrow", "parquet")
+# Suffixes of the extra columns holding the text values and the None values of a column mixing numbers and text
+_TEXT_SUFFIX = "__text"
+_NONE_SUFFIX = "__none"
+
+
+def is_handle(obj) -> bool:
+    """ Return True if the object is a handle returned by `write_frame` """
+    return isinstance(obj, dict) and obj.get("handoff") in HANDOFF_FORMATS
+
+
+def _split_mixed_columns(frame: pd.DataFrame):
+    """
+    Split the object columns mixing numbers and text (ex. the 'value' of mean and mode rows) into a float
+    column and a text column, which Arrow can store. Returns the frame and the names of the split columns.
+
+    Both None and NaN are null in Arrow, so a boolean column marks the values that were None (not NaN) for
+    `read_frame` to give them back.
+    """
+    mixed = []
+    for col in frame.columns[frame.dtypes == object]:
+        values = frame[col]
+        numeric = pd.to_numeric(values, errors="coerce")
+        try:
+            is_text = values.str.len().notna().to_numpy()
+        except AttributeError:  # No strings in the column
+            is_text = np.zeros(len(frame), dtype=bool)
+        is_null = values.isna().to_numpy()
+        is_nan = is_null.copy()
+        is_nan[is_null] = values.to_numpy()[is_null].astype(str) == "nan"  # Float NaN, not None, pd.NA or NaT
+        is_number = (numeric.notna().to_numpy() & ~is_text) | is_nan
+        if is_number.any() and not is_number.all():
+            mixed.append(col)
+            frame = frame.assign(**{
+                col: numeric.where(is_number),
+                f"{col}{_TEXT_SUFFIX}": values.where(~is_number & ~is_null, None).astype(object),
+                f"{col}{_NONE_SUFFIX}": is_null & ~is_nan,
+            })
+    return frame, mixed
+
+
+def write_frame(frame: pd.DataFrame, fmt: str = "arrow", directory: str = None, name: str = "frame") -> dict:
+    """
+    Write a dataframe to an Arrow IPC or Parquet file and return a small handle to pass between blocks
+
+    Mage only pickles the handle. The Arrow IPC file is uncompressed so that `read_frame` memory-maps it
+    instead of reading it. The consumer deletes the file once read (see `read_frame`), and the files older
+    than a day in the hand-off directory, ex. of runs that failed before the consumer, are removed on every write.
+
+    Args:
+        frame (pd.DataFrame): Data to hand off, with its index
+        fmt (str): 'arrow' (IPC file) or 'parquet'
+        directory (str): Directory of the files, in the default hand-off directory if not given. When the
+            blocks run in several executors, it must be on storage that all of them can read.
+        name (str): Prefix of the file name
+
+    Returns:
+        handle (dict): JSON-serializable handle for `read_frame`
+
+    """
+    if fmt not in HANDOFF_FORMATS:
+        raise ValueError(f"Unknown hand-off format: {fmt}")
+    directory = directory or DEFAULT_HANDOFF_DIR
+    os.makedirs(directory, exist_ok=True)
+    cleanup(directory)
+
+    mixed = []
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        frame, mixed = _split_mixed_columns(frame)
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    path = os.path.join(directory, f"{name}_{uuid.uuid4().hex}.{'arrow' if fmt == 'arrow' else 'parquet'}")
+    if fmt == "arrow":
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        pq.write_table(table, path)
+
+    return {"handoff": fmt, "path": path, "rows": table.num_rows, "mixed_columns": mixed}
+
+
+def read_frame(handle: dict, delete: bool = False) -> pd.DataFrame:
+    """
+    Read the dataframe of a handle returned by `write_frame`, memory-mapping the file
+
+    Args:
+        handle (dict): Handle returned by `write_frame`
+        delete (bool): Delete the file once read, when the caller is its only consumer. A retry of the consumer
+            alone then fails to read it, and the producer has to run again.
+
+    """
+    if handle["handoff"] == "arrow":
+        with pa.memory_map(handle["path"], "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+    else:
+        table = pq.read_table(handle["path"], memory_map=True)
+    frame = table.to_pandas()
+    if delete:
+        # The frame stays valid: a file removed while memory-mapped is only freed once unmapped
+        os.remove(handle["path"])
+
+    for col in handle.get("mixed_columns", []):
+        text = frame.pop(f"{col}{_TEXT_SUFFIX}")
+        is_none = frame.pop(f"{col}{_NONE_SUFFIX}")
+        frame[col] = frame[col].astype(object).where(text.isna(), text).where(~is_none, None)
+    return frame
+
+
+def maybe_read(obj, delete: bool = False):
+    """ Return the dataframe of a handle, or the object itself if it is not a handle (see `read_frame`) """
+    return read_frame(obj, delete=delete) if is_handle(obj) else obj
+
+
+def hand_off(obj, name: str = "frame", **kwargs):
+    """
+    Return a handle to the data if the 'block_handoff' pipeline variable is 'arrow' or 'parquet', else the data
+
+    Lists of dictionaries (ex. the rows of the legacy aggregation) are handed off as a dataframe. The files are
+    written to the 'block_handoff_dir' pipeline variable, or to the default hand-off directory.
+    """
+    fmt = kwargs.get("block_handoff", "pickle")
+    if fmt in (None, "pickle") or obj is None:
+        return obj
+    frame = obj if isinstance(obj, pd.DataFrame) else pd.DataFrame(obj)
+    return write_frame(frame, fmt=fmt, directory=kwargs.get("block_handoff_dir"), name=name)
+
+
+def cleanup(directory: str = None, max_age_seconds: float = 86400) -> None:
+    """ Remove the hand-off files older than `max_age_seconds` """
+    directory = directory or DEFAULT_HANDOFF_DIR
+    now = time.time()
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age_seconds:
+                os.remove(entry.path)
+        except OSError:
+            pass
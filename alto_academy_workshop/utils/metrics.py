@@ -0,0 +1,340 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+from alto_academy_workshop.utils import state
+
+_current = contextvars.ContextVar("alto_metrics_measurement", default=None)
+# Escapes of a label value in the Prometheus text format
+_LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+class InMemorySink:
+    """ Keep every event in a list, ex. to assert on them in a test or a benchmark """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def find(self, metric: str = None, **labels) -> List[dict]:
+        """ Return the events of a metric whose labels include the given ones """
+        with self._lock:
+            return [
+                event for event in self.events
+                if (metric is None or event["metric"] == metric)
+                and all(event["labels"].get(key) == value for key, value in labels.items())
+            ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.events = []
+
+
+class JSONLogSink:
+    """ Log every event as one JSON object per line """
+
+    def __init__(self, logger_name: str = "alto_academy_workshop.metrics", level: int = logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def emit(self, event: dict) -> None:
+        self.logger.log(self.level, json.dumps(event, default=str))
+
+
+class PrometheusTextfileSink:
+    """
+    Keep running totals of the events and write them in the Prometheus text format
+
+    The file is meant for the textfile collector of node_exporter. For a metric 'db_call', the file has the
+    series 'alto_db_call_total' (by status), 'alto_db_call_seconds_total', 'alto_db_call_rows_total',
+    'alto_db_call_bytes_total' and 'alto_db_call_last_seconds'.
+
+    Several processes (ex. executors, shards or backfill workers) can write to the same file. Every process
+    adds the increments since its last write to the totals read from the file, under a file lock (see
+    `state.locked`), so that the totals only go up. The file is written at most once every `flush_seconds`,
+    and once more when the process exits.
+
+    Args:
+        path (str): Path of the .prom file
+        prefix (str): Prefix of the metric names
+        flush_seconds (float): Shortest time between two writes of the file
+
+    """
+
+    def __init__(self, path: str, prefix: str = "alto", flush_seconds: float = 10):
+        self.path = path
+        self.prefix = prefix
+        self.flush_seconds = flush_seconds
+        self._increments = {}
+        self._gauges = {}
+        self._flushed_at = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def emit(self, event: dict) -> None:
+        name = f"{self.prefix}_{event['metric']}"
+        labels = tuple(sorted((key, str(value)) for key, value in event["labels"].items()))
+        status = "error" if event.get("error") else "ok"
+        with self._lock:
+            self._add(f"{name}_total", labels + (("status", status),), 1)
+            self._add(f"{name}_seconds_total", labels, event["seconds"])
+            self._add(f"{name}_rows_total", labels, event.get("rows") or 0)
+            self._add(f"{name}_bytes_total", labels, event.get("bytes") or 0)
+            self._gauges[_series_name(f"{name}_last_seconds", labels)] = event["seconds"]
+            if self._flushed_at is None or time.monotonic() - self._flushed_at >= self.flush_seconds:
+                self._flush()
+
+    def flush(self) -> None:
+        """ Write the events received since the last write """
+        with self._lock:
+            self._flush()
+
+    def _add(self, name: str, labels: tuple, value: float) -> None:
+        series = _series_name(name, labels)
+        self._increments[series] = self._increments.get(series, 0) + value
+
+    def _flush(self) -> None:
+        if not self._increments and not self._gauges:
+            return
+        with state.locked(self.path):
+            series = _read_textfile(self.path)
+            for name, value in self._increments.items():
+                series[name] = series.get(name, 0) + value
+            series.update(self._gauges)
+            lines = [f"{name} {value}" for name, value in sorted(series.items())]
+
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".prom")
+            with os.fdopen(fd, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.path)
+        self._increments, self._gauges = {}, {}
+        self._flushed_at = time.monotonic()
+
+
+def _series_name(name: str, labels: tuple) -> str:
+    """ Series of the Prometheus text format, ex. 'alto_block_total{block="export",status="ok"}' """
+    label_string = ",".join(f'{key}="{value.translate(_LABEL_ESCAPES)}"' for key, value in labels)
+    return f"{name}{{{label_string}}}"
+
+
+def _read_textfile(path: str) -> dict:
+    """ Values of the series of a Prometheus text file by series name, empty if the file does not exist """
+    series = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    name, value = line.rsplit(" ", 1)
+                    series[name] = float(value)
+    except FileNotFoundError:
+        pass
+    return series
+
+
+class MetricsRecorder:
+    """ Send measurements to a list of sinks. Without sinks, recording costs next to nothing. """
+
+    def __init__(self, sinks: list = None):
+        self.sinks = list(sinks or [])
+
+    def emit(self, metric: str, labels: dict, seconds: float, **fields) -> None:
+        if not self.sinks:
+            return
+        event = {"metric": metric, "labels": labels, "seconds": seconds, "timestamp": time.time(), **fields}
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except Exception as e:
+                logging.debug(f"Metrics sink {type(sink).__name__} failed: {e}")
+
+    @contextmanager
+    def timed(self, metric: str, **labels):
+        """
+        Measure the duration of a block of code
+
+        The yielded dictionary collects the 'rows' and 'bytes' of the measurement, set directly or with `count()`
+        from the code running inside the block.
+
+            with recorder.timed("db_call", database="AltoCrateDB", method="query_data") as measurement:
+                measurement["rows"] = len(rows)
+        """
+        measurement = {"rows": None, "bytes": None}
+        token = _current.set(measurement)
+        started_at = time.perf_counter()
+        error = None
+        try:
+            yield measurement
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self.emit(metric, labels, time.perf_counter() - started_at, error=error, **measurement)
+
+
+_recorder = MetricsRecorder()
+
+
+def get_recorder() -> MetricsRecorder:
+    """ Return the recorder used by the instrumented database methods and blocks """
+    return _recorder
+
+
+def configure(sinks: list) -> MetricsRecorder:
+    """ Replace the sinks of the recorder """
+    _recorder.sinks = list(sinks)
+    return _recorder
+
+
+def configure_from_kwargs(**kwargs) -> MetricsRecorder:
+    """
+    Configure the sinks from the pipeline variables, unless they are configured already
+
+    'metrics_sinks' is a comma-separated list of 'log' and 'prometheus'. The Prometheus file is written to
+    'metrics_textfile', by default 'alto_academy_workshop.prom' in the current directory, at most once every
+    'metrics_flush_seconds' (10 by default).
+    """
+    if _recorder.sinks or not kwargs.get("metrics_sinks"):
+        return _recorder
+
+    sinks = []
+    for name in str(kwargs["metrics_sinks"]).split(","):
+        name = name.strip()
+        if name == "log":
+            sinks.append(JSONLogSink())
+        elif name == "prometheus":
+            sinks.append(PrometheusTextfileSink(
+                kwargs.get("metrics_textfile", "alto_academy_workshop.prom"),
+                flush_seconds=float(kwargs.get("metrics_flush_seconds", 10))
+            ))
+        elif name:
+            raise ValueError(f"Unknown metrics sink: {name}")
+    return configure(sinks)
+
+
+def count(rows: int = None, bytes: int = None) -> None:
+    """ Add rows and bytes to the innermost running measurement, if any """
+    measurement = _current.get()
+    if measurement is None:
+        return
+    if rows is not None:
+        measurement["rows"] = (measurement["rows"] or 0) + int(rows)
+    if bytes is not None:
+        measurement["bytes"] = (measurement["bytes"] or 0) + int(bytes)
+
+
+def _result_size(result):
+    """ Rows and bytes of a query result, without walking through the rows """
+    if hasattr(result, "memory_usage"):
+        return len(result), int(result.memory_usage(index=False).sum())
+    if isinstance(result, dict) and all(hasattr(value, "nbytes") for value in result.values()):
+        values = list(result.values())
+        return (len(values[0]) if values else 0), sum(value.nbytes for value in values)
+    if isinstance(result, list):
+        return len(result), None
+    return None, None
+
+
+def _record_result(measurement: dict, result) -> None:
+    rows, size = _result_size(result)
+    if measurement["rows"] is None:
+        measurement["rows"] = rows
+    if measurement["bytes"] is None:
+        measurement["bytes"] = size
+
+
+def instrument(func, metric: str = "db_call", **labels):
+    """
+    Wrap a function, coroutine function or generator function so that every call is measured
+
+    The rows and bytes of the result are recorded when they can be read from it cheaply (dataframes, lists,
+    dictionaries of arrays), and generators are measured until they are exhausted.
+    """
+    labels = {"method": func.__name__, **labels}
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Measured by hand: the generator is suspended between chunks, so it cannot hold the current measurement
+            started_at = time.perf_counter()
+            measurement = {"rows": 0, "bytes": 0}
+            error = None
+            try:
+                for chunk in func(*args, **kwargs):
+                    rows, size = _result_size(chunk)
+                    measurement["rows"] += rows or 0
+                    measurement["bytes"] += size or 0
+                    yield chunk
+            except GeneratorExit:
+                raise
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                _recorder.emit(metric, labels, time.perf_counter() - started_at, error=error, **measurement)
+    elif inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with _recorder.timed(metric, **labels) as measurement:
+                result = await func(*args, **kwargs)
+                _record_result(measurement, result)
+            return result
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _recorder.timed(metric, **labels) as measurement:
+                result = func(*args, **kwargs)
+                _record_result(measurement, result)
+            return result
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_class(cls, metric: str = "db_call", skip: tuple = ()) -> None:
+    """ Instrument the public methods defined in a class, labelled with the class name """
+    for name, member in list(vars(cls).items()):
+        if name.startswith("_") or name in skip or not inspect.isfunction(member):
+            continue
+        if getattr(member, "__instrumented__", False):
+            continue
+        setattr(cls, name, instrument(member, metric, database=cls.__name__))
+
+
+def timed_block(func):
+    """
+    Measure a Mage block function, labelled with the name of its file
+
+    Put it under the Mage decorator. The sinks are configured from the pipeline variables on the first call
+    (see `configure_from_kwargs`).
+
+        @data_loader
+        @timed_block
+        def load_data(*args, **kwargs):
+    """
+    block = os.path.splitext(os.path.basename(func.__code__.co_filename))[0]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        configure_from_kwargs(**kwargs)
+        with _recorder.timed("block", block=block) as measurement:
+            result = func(*args, **kwargs)
+            _record_result(measurement, result)
+        return result
+
+    return wrapper
@@ -0,0 +1,186 @@
+import io
+import math
+import struct
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+import pandas as pd
+
+_PG_EPOCH = datetime(2000, 1, 1)
+_PG_EPOCH_UTC = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_BINARY_TRAILER = struct.pack("!h", -1)
+_NULL_FIELD = struct.pack("!i", -1)
+
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+# Column types that can store a float NaN
+_FLOAT_TYPES = ("double precision", "real", "numeric")
+_TIMESTAMPTZ = "timestamp with time zone"
+
+
+def iter_rows(data, column_names: List[str]) -> Iterator[tuple]:
+    """
+    Iterate over the given data as tuples ordered by `column_names`
+
+    Args:
+        data (list[dict] | pd.DataFrame): List of dictionaries (one per row) or a dataframe with the columns
+        column_names (list[str]): Column names in the order of the output tuples
+
+    """
+    if hasattr(data, "itertuples"):
+        yield from data[column_names].itertuples(index=False, name=None)
+    else:
+        for row in data:
+            yield tuple(row[col] for col in column_names)
+
+
+def iter_chunks(rows: Iterable[tuple], chunk_rows: int) -> Iterator[List[tuple]]:
+    """ Split an iterable of rows into lists of at most `chunk_rows` rows """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, max(int(chunk_rows), 1)))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _is_null(value, keep_nan: bool = True) -> bool:
+    # None, pandas NaT and NA are NULL. Float NaN is kept as a value in float columns, like psycopg2 does,
+    # and is NULL in the other columns (ex. 'NaN' would be written as text).
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return not keep_nan and value != value
+    if isinstance(value, (str, int)):
+        return False
+    return pd.api.types.is_scalar(value) and bool(pd.isna(value))
+
+
+def _as_datetime(value) -> datetime:
+    """ Plain datetime of a datetime subclass such as pendulum's DateTime, whose arithmetic differs """
+    if type(value) is datetime:
+        return value
+    return datetime(value.year, value.month, value.day, value.hour, value.minute, value.second,
+                    value.microsecond, tzinfo=value.tzinfo, fold=value.fold)
+
+
+def _column_flags(column_types: List[str], count: int) -> tuple:
+    """ Per column: whether a float NaN is kept as NaN (float columns), and whether a naive datetime is UTC """
+    if column_types is None:
+        return [True] * count, [False] * count
+    return [t in _FLOAT_TYPES for t in column_types], [t == _TIMESTAMPTZ for t in column_types]
+
+
+def _to_string(value) -> str:
+    """ Convert a value to its PostgreSQL text representation """
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "Infinity" if value > 0 else "-Infinity"
+        return repr(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return str(value)
+
+
+def _text_field(value, keep_nan: bool, naive_utc: bool) -> str:
+    if _is_null(value, keep_nan):
+        return "\\N"
+    if naive_utc and isinstance(value, datetime) and value.tzinfo is None:
+        # Like the binary format, instead of the session time zone of the server
+        value = value.replace(tzinfo=timezone.utc)
+    return _to_string(value).translate(_TEXT_ESCAPES)
+
+
+def encode_text(rows: Iterable[tuple], column_types: List[str] = None) -> io.StringIO:
+    """
+    Encode rows in the COPY text format
+
+    With the `column_types`, a float NaN is written as NULL outside the float columns (ex. instead of the text
+    'NaN') and a naive datetime is written as UTC in 'timestamp with time zone' columns, like `encode_binary`.
+    """
+    buffer = io.StringIO()
+    keep_nan, naive_utc = None, None
+    for row in rows:
+        if keep_nan is None:
+            keep_nan, naive_utc = _column_flags(column_types, len(row))
+        buffer.write("\t".join(map(_text_field, row, keep_nan, naive_utc)))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _encode_timestamptz(value) -> bytes:
+    value = _as_datetime(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return struct.pack("!q", (value - _PG_EPOCH_UTC) // _MICROSECOND)
+
+
+def _encode_timestamp(value) -> bytes:
+    return struct.pack("!q", (_as_datetime(value).replace(tzinfo=None) - _PG_EPOCH) // _MICROSECOND)
+
+
+def _encode_string(value) -> bytes:
+    return _to_string(value).encode("utf-8")
+
+
+_BINARY_ENCODERS = {
+    "timestamp with time zone": _encode_timestamptz,
+    "timestamp without time zone": _encode_timestamp,
+    "double precision": lambda v: struct.pack("!d", float(v)),
+    "real": lambda v: struct.pack("!f", float(v)),
+    "bigint": lambda v: struct.pack("!q", int(v)),
+    "integer": lambda v: struct.pack("!i", int(v)),
+    "smallint": lambda v: struct.pack("!h", int(v)),
+    "boolean": lambda v: struct.pack("!?", bool(v)),
+    "text": _encode_string,
+    "character varying": _encode_string,
+    "character": _encode_string,
+}
+
+
+def binary_encoders(column_types: List[str]) -> list:
+    """
+    Return the binary field encoder for each column type, or None if a type is not supported
+
+    Args:
+        column_types (list[str]): Column types as reported by `information_schema.columns.data_type`
+
+    """
+    encoders = [_BINARY_ENCODERS.get(t) for t in column_types]
+    if any(encoder is None for encoder in encoders):
+        return None
+    return encoders
+
+
+def encode_binary(rows: Iterable[tuple], encoders: list, column_types: List[str] = None) -> io.BytesIO:
+    """
+    Encode rows in the COPY binary format using one encoder per column (see `binary_encoders`)
+
+    With the `column_types`, a float NaN is written as NULL outside the float columns.
+    """
+    buffer = io.BytesIO()
+    buffer.write(_BINARY_HEADER)
+    field_count = struct.pack("!h", len(encoders))
+    keep_nan, _ = _column_flags(column_types, len(encoders))
+    for row in rows:
+        buffer.write(field_count)
+        for value, encoder, keep in zip(row, encoders, keep_nan):
+            if _is_null(value, keep):
+                buffer.write(_NULL_FIELD)
+            else:
+                field = encoder(value)
+                buffer.write(struct.pack("!i", len(field)))
+                buffer.write(field)
+    buffer.write(_BINARY_TRAILER)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,345 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from alto_academy_workshop.utils.aggregation import aggregate_frame, index_by_timestamp
+from alto_academy_workshop.utils.database import AltoCrateDB, AltoTimescaleDB
+from alto_academy_workshop.utils.filters import build_device_filters
+from alto_academy_workshop.utils.raw_cache import get_raw_cache
+
+
+@dataclass
+class PipelineConfig:
+    """ Settings of the cratedb2timescaledb pipeline, built from the pipeline variables with `from_kwargs` """
+    cratedb_source_table: str
+    timescaledb_db_name: str
+    timescaledb_destination_table: str
+    cratedb_host: str = 'host.docker.internal'
+    cratedb_port: int = 4200
+    timescaledb_username: str = 'alto'
+    timescaledb_password: str = ''
+    timescaledb_host: str = 'localhost'
+    timescaledb_port: int = 5432
+    resample_seconds: int = 60
+    extraction_batch_size: int = 500
+    timescaledb_insert_method: str = 'copy'
+    timescaledb_copy_format: str = 'text'
+    timescaledb_write_mode: str = 'auto'
+    execution_mode: str = 'batch'
+    raw_cache: bool = False
+
+    @classmethod
+    def from_kwargs(cls, **kwargs):
+        """ Build the configuration from the keyword arguments given to a pipeline block """
+        names = cls.__dataclass_fields__.keys()
+        config = cls(**{name: kwargs[name] for name in names if kwargs.get(name) is not None})
+        config.cratedb_port = int(config.cratedb_port)
+        config.resample_seconds = int(config.resample_seconds)
+        config.extraction_batch_size = int(config.extraction_batch_size)
+        return config
+
+    def cratedb(self) -> AltoCrateDB:
+        return AltoCrateDB(host=self.cratedb_host, port=self.cratedb_port, cache=get_raw_cache(raw_cache=self.raw_cache))
+
+    def timescaledb(self) -> AltoTimescaleDB:
+        return AltoTimescaleDB(
+            db_name=self.timescaledb_db_name,
+            username=self.timescaledb_username,
+            password=self.timescaledb_password,
+            host=self.timescaledb_host,
+            port=self.timescaledb_port
+        )
+
+
+def process_window(config: PipelineConfig, start_timestamp: float, end_timestamp: float) -> dict:
+    """
+    Run discovery, extraction, aggregation and insert for the window [start_timestamp, end_timestamp)
+
+    This is what one run of the cratedb2timescaledb pipeline does, without going through the blocks.
+    With `execution_mode` 'streaming', the work is done one batch of devices at a time (see `stream_window`).
+
+    Args:
+        config (PipelineConfig): Pipeline settings
+        start_timestamp (float): Start of the window in seconds
+        end_timestamp (float): End of the window in seconds
+
+    Returns:
+        stats (dict): Number of raw and aggregated rows, and the duration in seconds
+
+    """
+    if config.execution_mode == 'streaming':
+        return stream_window(config, start_timestamp, end_timestamp)
+    elif config.execution_mode != 'batch':
+        raise ValueError(f"Unknown execution mode: {config.execution_mode}")
+
+    started_at = time.monotonic()
+
+    with config.cratedb() as cratedb:
+        filter_list, all_df = extract_window(config, cratedb, start_timestamp, end_timestamp)
+
+    agg_df = aggregate_window(config, all_df, filter_list)
+    if agg_df is not None:
+        with config.timescaledb() as timescaledb:
+            write_window(config, timescaledb, agg_df)
+
+    return {
+        "raw_rows": len(all_df),
+        "aggregated_rows": 0 if agg_df is None else len(agg_df),
+        "seconds": time.monotonic() - started_at,
+    }
+
+
+def extract_window(config: PipelineConfig, cratedb: AltoCrateDB, start_timestamp: float, end_timestamp: float):
+    """ Discover the devices of the window and extract their raw data. Returns the filters and the raw dataframe. """
+    devices_datapoints = cratedb.get_unique_deviceid_datapoint(
+        table_name=config.cratedb_source_table,
+        start_timestamp=int(start_timestamp) * 1000,
+        end_timestamp=int(end_timestamp) * 1000
+    )
+    filter_list = build_device_filters(devices_datapoints, start_timestamp, end_timestamp)
+    all_df = cratedb.query_data_batched(
+        table_name=config.cratedb_source_table,
+        filter_list=filter_list,
+        batch_size=config.extraction_batch_size,
+        as_frame=True
+    )
+    return filter_list, all_df
+
+
+def aggregate_window(config: PipelineConfig, all_df, filter_list: list):
+    """ Aggregate the raw dataframe of a window, or return None if it is empty """
+    if all_df.empty:
+        return None
+    return aggregate_frame(index_by_timestamp(all_df), resample_seconds=config.resample_seconds, filter_list=filter_list)
+
+
+def write_window(config: PipelineConfig, timescaledb: AltoTimescaleDB, agg_df) -> None:
+    """ Insert the aggregated dataframe of a window into the destination table """
+    timescaledb.insert_data(
+        table_name=config.timescaledb_destination_table,
+        data=agg_df,
+        method=config.timescaledb_insert_method,
+        copy_format=config.timescaledb_copy_format,
+        mode=config.timescaledb_write_mode
+    )
+
+
+def stream_window(config: PipelineConfig, start_timestamp: float, end_timestamp: float) -> dict:
+    """
+    Process the window [start_timestamp, end_timestamp) one batch of `extraction_batch_size` devices at a time
+
+    Every batch is extracted, aggregated and inserted before the next one is queried, so the peak memory
+    depends on the batch size instead of the size of the window. A series belongs to a single device, so the
+    result is the same as `process_window` in batch mode. Each batch is inserted in its own transaction; the
+    'auto' write mode upserts into a table with the unique index of `UPSERT_KEY` (see the create_table block),
+    so that a failed window can be run again. Query errors are raised, never taken
+    for an empty batch, so the caller does not commit the watermark of a window that was not read.
+
+    Returns:
+        stats (dict): Number of raw and aggregated rows and of batches, the largest batch and the duration in seconds
+
+    """
+    started_at = time.monotonic()
+    stats = {"raw_rows": 0, "aggregated_rows": 0, "batches": 0, "max_batch_rows": 0}
+
+    with config.cratedb() as cratedb, config.timescaledb() as timescaledb:
+        devices_datapoints = cratedb.get_unique_deviceid_datapoint(
+            table_name=config.cratedb_source_table,
+            start_timestamp=int(start_timestamp) * 1000,
+            end_timestamp=int(end_timestamp) * 1000
+        )
+        filter_list = build_device_filters(devices_datapoints, start_timestamp, end_timestamp)
+        batches = cratedb.iter_query_batched(
+            table_name=config.cratedb_source_table,
+            filter_list=filter_list,
+            batch_size=config.extraction_batch_size,
+            as_frame=True
+        )
+        for raw_df in batches:
+            if raw_df.empty:
+                continue
+            stats["batches"] += 1
+            stats["raw_rows"] += len(raw_df)
+            stats["max_batch_rows"] = max(stats["max_batch_rows"], len(raw_df))
+
+            # The batch only holds the wanted pairs already, so there is no need to filter again
+            agg_df = aggregate_frame(index_by_timestamp(raw_df), resample_seconds=config.resample_seconds)
+            timescaledb.insert_data(
+                table_name=config.timescaledb_destination_table,
+                data=agg_df,
+                method=config.timescaledb_insert_method,
+                copy_format=config.timescaledb_copy_format,
+                mode=config.timescaledb_write_mode
+            )
+            stats["aggregated_rows"] += len(agg_df)
+            del raw_df, agg_df
+
+    stats["seconds"] = time.monotonic() - started_at
+    return stats
+
+
+# Marks the end of the windows in the queues of `run_pipelined`
+_DONE = object()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """ Put an item in a bounded queue, waiting while it is full, unless the pipeline is stopping """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """ Get an item from a queue, or `_DONE` if the pipeline is stopping """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipelined(config: PipelineConfig,
+                  start_timestamp: float,
+                  interval_seconds: int,
+                  end_timestamp: float = None,
+                  queue_size: int = 2,
+                  grace_seconds: float = 0,
+                  on_written: Callable = None,
+                  stop_event: threading.Event = None
+                  ) -> dict:
+    """
+    Process consecutive windows of `interval_seconds` from `start_timestamp`, overlapping the stages
+
+    The extraction, aggregation and insert of `process_window` run in three threads connected by queues of at
+    most `queue_size` windows, so window N+1 is extracted while window N is aggregated and window N-1 is
+    inserted. When a stage falls behind, the queue in front of it fills up and the stages before it wait, which
+    bounds the memory to a few windows. The throughput is then set by the slowest stage instead of the sum of
+    the stages. The windows are inserted in order, and `on_written(start, end)` is called after each one, ex. to
+    move the watermark. An extraction or aggregation error goes down the queues after the windows before it:
+    those are still written, then the error is raised and no later window is written.
+
+    Without `end_timestamp`, it runs until `stop_event` is set, waiting for the end of each window plus
+    `grace_seconds` to pass before extracting it. Windows still in the queues when it stops are not written.
+
+    Args:
+        config (PipelineConfig): Pipeline settings
+        start_timestamp (float): Start of the first window in seconds
+        interval_seconds (int): Width of the windows in seconds
+        end_timestamp (float): End of the last window in seconds, or None to keep running
+        queue_size (int): Maximum number of windows waiting between two stages
+        grace_seconds (float): Time to wait after the end of a window for late rows
+        on_written (callable): Function (start, end) called once a window is inserted
+        stop_event (threading.Event): Event to set to stop the pipeline
+
+    Returns:
+        stats (dict): Number of windows, raw and aggregated rows, busy seconds of each stage and the duration in seconds
+
+    """
+    stop = stop_event or threading.Event()
+    raw_queue = queue.Queue(maxsize=max(int(queue_size), 1))
+    agg_queue = queue.Queue(maxsize=max(int(queue_size), 1))
+    interval_seconds = int(interval_seconds)
+    stats = {"windows": 0, "raw_rows": 0, "aggregated_rows": 0,
+             "extract_seconds": 0.0, "aggregate_seconds": 0.0, "write_seconds": 0.0}
+    errors = []
+
+    def extract():
+        try:
+            with config.cratedb() as cratedb:
+                window_start = start_timestamp
+                while not stop.is_set():
+                    window_end = window_start + interval_seconds
+                    if end_timestamp is not None and window_end > end_timestamp:
+                        break
+                    wait = window_end + grace_seconds - time.time()
+                    if wait > 0:
+                        stop.wait(wait)  # Wait for the window to close, or for the pipeline to stop
+                        continue
+
+                    busy_since = time.monotonic()
+                    filter_list, all_df = extract_window(config, cratedb, window_start, window_end)
+                    stats["extract_seconds"] += time.monotonic() - busy_since
+                    if not _put(raw_queue, (window_start, window_end, filter_list, all_df), stop):
+                        break
+                    window_start = window_end
+        except Exception as e:
+            # Send the error down the queues: the windows before it are written, then the writer raises it
+            _put(raw_queue, e, stop)
+        else:
+            _put(raw_queue, _DONE, stop)
+
+    def aggregate():
+        try:
+            while True:
+                item = _get(raw_queue, stop)
+                if item is _DONE or isinstance(item, Exception):
+                    _put(agg_queue, item, stop)
+                    break
+                window_start, window_end, filter_list, all_df = item
+                busy_since = time.monotonic()
+                agg_df = aggregate_window(config, all_df, filter_list)
+                stats["aggregate_seconds"] += time.monotonic() - busy_since
+                if not _put(agg_queue, (window_start, window_end, len(all_df), agg_df), stop):
+                    break
+                del item, all_df, agg_df
+        except Exception as e:
+            _put(agg_queue, e, stop)
+
+    def write():
+        with config.timescaledb() as timescaledb:
+            while True:
+                item = _get(agg_queue, stop)
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    # The window was not read or not aggregated: stop without calling `on_written`
+                    raise item
+                window_start, window_end, raw_rows, agg_df = item
+                busy_since = time.monotonic()
+                if agg_df is not None:
+                    write_window(config, timescaledb, agg_df)
+                stats["write_seconds"] += time.monotonic() - busy_since
+
+                stats["windows"] += 1
+                stats["raw_rows"] += raw_rows
+                stats["aggregated_rows"] += 0 if agg_df is None else len(agg_df)
+                if on_written is not None:
+                    on_written(window_start, window_end)
+                del item, agg_df
+
+    def run_stage(target):
+        try:
+            target()
+        except Exception as e:
+            # Stop the other stages, the error is raised once they are done
+            errors.append(e)
+            stop.set()
+
+    started_at = time.monotonic()
+    threads = [
+        threading.Thread(target=run_stage, args=(target,), name=f"pipelined-{target.__name__}", daemon=True)
+        for target in (extract, aggregate, write)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        raise
+
+    if errors:
+        raise errors[0]
+    stats["seconds"] = time.monotonic() - started_at
+    return stats
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+
+class PoolClosedError(Exception):
+    """ Raised when a connection is requested from a closed pool """
+
+
+class PoolTimeoutError(TimeoutError):
+    """ Raised when no connection becomes available within the pool timeout """
+
+
+class _Entry:
+    """ Pooled connection with its bookkeeping """
+
+    __slots__ = ("connection", "last_used", "needs_check", "info")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.last_used = time.monotonic()
+        self.needs_check = False
+        self.info = {}
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of DB-API connections
+
+    At most `max_size` connections exist at a time. Connections are created lazily, handed out
+    most-recently-used first, and checked with `check` before reuse when they have been idle for
+    longer than `check_interval` seconds or when the previous borrower raised an error.
+
+    Args:
+        connect (callable): Function returning a new connection
+        max_size (int): Maximum number of open connections
+        check (callable): Function taking a connection and returning True if it is still usable
+        reset (callable): Function taking a connection and cleaning it up before it goes back to the pool
+        check_interval (float): Idle time in seconds after which a connection is checked before reuse
+        timeout (float): Seconds to wait for a free connection, None to wait forever
+
+    """
+
+    def __init__(self,
+                 connect: Callable,
+                 max_size: int = 4,
+                 check: Callable = None,
+                 reset: Callable = None,
+                 check_interval: float = 30,
+                 timeout: float = None
+                 ):
+        self._connect = connect
+        self._check = check
+        self._reset = reset
+        self.max_size = max(int(max_size), 1)
+        self.check_interval = check_interval
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._idle = []
+        self._in_use = {}
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        """ Number of open connections """
+        with self._lock:
+            return len(self._idle) + len(self._in_use)
+
+    def acquire(self):
+        """ Borrow a connection from the pool, opening a new one if none is idle """
+        if self._closed:
+            raise PoolClosedError("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"No connection available within {self.timeout} seconds")
+
+        try:
+            entry = None
+            while entry is None:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    entry = _Entry(self._connect())
+                elif not self._is_healthy(entry):
+                    self._close_connection(entry.connection)
+                    entry = None
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use[id(entry.connection)] = entry
+        return entry.connection
+
+    def release(self, connection, failed: bool = False):
+        """
+        Return a borrowed connection to the pool
+
+        Args:
+            connection: Connection returned by `acquire`
+            failed (bool): Whether the borrower raised an error. The connection will be checked before its next use.
+
+        """
+        with self._lock:
+            entry = self._in_use.pop(id(connection), None)
+        if entry is None:
+            return
+
+        try:
+            keep = not self._closed
+            if keep and self._reset is not None:
+                try:
+                    self._reset(connection)
+                except Exception as e:
+                    logging.debug(f"Discarding connection that could not be reset: {e}")
+                    keep = False
+
+            if keep:
+                entry.last_used = time.monotonic()
+                entry.needs_check = failed
+                with self._lock:
+                    self._idle.append(entry)
+            else:
+                self._close_connection(connection)
+        finally:
+            self._slots.release()
+
+    def info(self, connection) -> dict:
+        """ Per-connection state of a borrowed connection (ex. prepared statements), kept for as long as the connection lives """
+        with self._lock:
+            return self._in_use[id(connection)].info
+
+    @contextmanager
+    def connection(self):
+        """ Context manager borrowing a connection and returning it to the pool on exit """
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, failed=True)
+            raise
+        else:
+            self.release(connection)
+
+    def close(self):
+        """ Close all idle connections. Connections still borrowed are closed when they are released. """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._close_connection(entry.connection)
+
+    def _is_healthy(self, entry: _Entry) -> bool:
+        if self._check is None:
+            return True
+        if not entry.needs_check and time.monotonic() - entry.last_used < self.check_interval:
+            return True
+        try:
+            return bool(self._check(entry.connection))
+        except Exception as e:
+            logging.debug(f"Connection health check failed: {e}")
+            return False
+
+    @staticmethod
+    def _close_connection(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logging.debug(f"Error while closing connection: {e}")
@@ -0,0 +1,198 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from alto_academy_workshop.utils import state
+from alto_academy_workshop.utils.filters import _single_value
+
+
+def _time_range(f: dict):
+    """ Return the [start, end) of a timestamp filter with a lower and an upper bound, else None """
+    if not isinstance(f, dict):
+        return None
+    ops = {oper.upper(): value for oper, value in f.items()}
+    if set(ops) not in ({">=", "<"}, {">=", "<="}, {">", "<"}, {">", "<="}):
+        return None
+    start = int(ops[">="]) if ">=" in ops else int(ops[">"]) + 1
+    end = int(ops["<"]) if "<" in ops else int(ops["<="]) + 1
+    return start, end
+
+
+def _values(f: dict):
+    """ Return the values of an '=' or 'IN' filter as a list, else None """
+    value = _single_value(f, "=")
+    if value is not None:
+        return [value]
+    value = _single_value(f, "IN")
+    return list(value) if isinstance(value, list) else None
+
+
+@dataclass
+class RawDataCache:
+    """
+    Read-through cache of raw CrateDB rows in local Parquet files, one file per table, device and time bucket
+
+    Only closed buckets, whose end is more than `grace_seconds` in the past, are cached. A bucket file holds all
+    the rows of the device in the bucket, whatever datapoints were requested, so that any later query of the
+    bucket can be served from it. The files are evicted least recently used first (by modification time, which
+    is updated on every read) once they take more than `max_bytes`.
+
+    Args:
+        directory (str): Root directory of the cache
+        bucket_seconds (int): Width of the time buckets
+        grace_seconds (int): Time after the end of a bucket before it is considered closed, for late rows
+        max_bytes (int): Disk budget of the cache
+
+    """
+    directory: str = field(default_factory=lambda: state.state_path("raw_cache"))
+    bucket_seconds: int = 86400
+    grace_seconds: int = 3600
+    max_bytes: int = 10 * 2 ** 30
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    @staticmethod
+    def parse(filters: dict):
+        """
+        Return (device_ids, datapoints, start, end) if the filters can be served from the cache, else None
+
+        The filters must select devices by '=' or 'IN', optionally datapoints by '=' or 'IN', and a bounded range
+        of timestamps in milliseconds. Datapoints is None when all datapoints are selected.
+        """
+        if not set(filters) <= {"device_id", "datapoint", "timestamp"}:
+            return None
+        device_ids = _values(filters.get("device_id"))
+        time_range = _time_range(filters.get("timestamp"))
+        if device_ids is None or time_range is None:
+            return None
+        datapoints = None
+        if "datapoint" in filters:
+            datapoints = _values(filters["datapoint"])
+            if datapoints is None:
+                return None
+        return device_ids, datapoints, time_range[0], time_range[1]
+
+    def _path(self, table_name: str, device_id, bucket: int) -> str:
+        return os.path.join(self.directory, table_name, f"device_id={quote(str(device_id), safe='')}", f"bucket={bucket}.parquet")
+
+    def query(self, fetch: Callable, table_name: str, filters: dict) -> pd.DataFrame:
+        """
+        Return the rows selected by `filters`, reading the closed buckets from the cache
+
+        Missing closed buckets are fetched with one query per bucket for all the devices missing it, and written
+        to the cache. The part of the range that is not closed yet is fetched with the given filters.
+
+        Args:
+            fetch (callable): Function (table_name, filters) -> dataframe querying CrateDB. It must raise on
+                errors so that a failed query is never cached as an empty bucket.
+            table_name (str): Name of the table
+            filters (dict): Filters accepted by `parse`
+
+        """
+        device_ids, datapoints, start, end = self.parse(filters)
+        bucket_ms = int(self.bucket_seconds) * 1000
+        closed_until = (int(time.time() * 1000) - int(self.grace_seconds) * 1000) // bucket_ms * bucket_ms
+        cached_end = min(end, closed_until)
+
+        # Step 1: Read the cached buckets and list the missing ones
+        frames, missing = [], {}
+        for bucket in range(start // bucket_ms * bucket_ms, cached_end, bucket_ms):
+            for device_id in device_ids:
+                path = self._path(table_name, device_id, bucket)
+                try:
+                    frames.append(pq.read_table(path, memory_map=True).to_pandas())
+                    os.utime(path)  # Mark as recently used
+                except (FileNotFoundError, pa.ArrowInvalid):
+                    missing.setdefault(bucket, []).append(device_id)
+
+        # Step 2: Fetch the missing buckets with every datapoint and cache them, empty ones included
+        for bucket, missing_devices in missing.items():
+            frame = fetch(table_name, {"device_id": {"IN": missing_devices}, "timestamp": {">=": bucket, "<": bucket + bucket_ms}})
+            groups = dict(tuple(frame.groupby("device_id", sort=False))) if not frame.empty else {}
+            for device_id in missing_devices:
+                part = groups.get(device_id, frame.iloc[0:0])
+                try:
+                    self._write(self._path(table_name, device_id, bucket), part)
+                except Exception as e:
+                    logging.debug(f"Bucket {bucket} of '{device_id}' could not be cached: {e}")
+                frames.append(part)
+        if missing:
+            self.evict()
+
+        # Step 3: Keep the requested datapoints and range, then add the part that is not closed yet
+        result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if not result.empty:
+            mask = (result["timestamp"] >= start) & (result["timestamp"] < end)
+            if datapoints is not None:
+                mask &= result["datapoint"].isin(datapoints)
+            result = result[mask]
+        if end > max(start, closed_until):
+            recent = fetch(table_name, {**filters, "timestamp": {">=": max(start, closed_until), "<": end}})
+            result = pd.concat([result, recent], ignore_index=True) if not result.empty else recent
+        return result.reset_index(drop=True)
+
+    def _write(self, path: str, frame: pd.DataFrame) -> None:
+        """ Write a bucket file atomically, so that concurrent readers never see a partial file """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".tmp_{uuid.uuid4().hex}.parquet")
+        try:
+            pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self) -> int:
+        """ Remove the least recently used files until the cache fits in `max_bytes`. Returns the number of files removed. """
+        with self._lock:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".parquet") and not name.startswith(".tmp_"):
+                        stat = os.stat(os.path.join(root, name))
+                        files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            return removed
+
+    def clear(self, table_name: str = None) -> None:
+        """ Remove the cached files of a table, or of every table """
+        root = os.path.join(self.directory, table_name) if table_name else self.directory
+        for directory, _, names in os.walk(root, topdown=False):
+            for name in names:
+                os.remove(os.path.join(directory, name))
+            if directory != self.directory:
+                os.rmdir(directory)
+
+
+def get_raw_cache(**kwargs):
+    """ Return the raw data cache configured by the pipeline variables, or None if 'raw_cache' is not set """
+    if not kwargs.get("raw_cache", False):
+        return None
+    cache = RawDataCache(
+        bucket_seconds=int(kwargs.get("raw_cache_bucket_seconds", 86400)),
+        grace_seconds=int(kwargs.get("raw_cache_grace_seconds", 3600)),
+        max_bytes=int(float(kwargs.get("raw_cache_max_gb", 10)) * 2 ** 30),
+    )
+    if kwargs.get("raw_cache_dir"):
+        cache.directory = kwargs["raw_cache_dir"]
+    return cache
@@ -0,0 +1,69 @@
+import hashlib
+import heapq
+from typing import List
+
+
+def stable_hash(device_id) -> int:
+    """ Hash of a device id that is the same in every process and Python version, unlike `hash()` """
+    return int.from_bytes(hashlib.blake2b(str(device_id).encode(), digest_size=8).digest(), "big")
+
+
+def assign_shards(device_ids: list, shard_count: int, row_counts: dict = None) -> dict:
+    """
+    Assign every device to one of `shard_count` shards
+
+    Without row counts, a device goes to the shard `stable_hash(device_id) % shard_count`, so it stays on the
+    same shard from one run to the next. With the historical row counts of the devices, the devices are
+    assigned heaviest first to the least loaded shard (longest processing time first), which keeps the
+    shards within one device of each other. Devices without a count weigh as much as the average device, and
+    ties are broken by the stable hash so that the same counts give the same shards.
+
+    Args:
+        device_ids (list): Device ids
+        shard_count (int): Number of shards
+        row_counts (dict): Dictionary of device_id to its number of rows, ex. from `DeviceCatalog.row_counts`
+
+    Returns:
+        shards (dict): Dictionary of device_id to its shard index
+
+    """
+    shard_count = max(int(shard_count), 1)
+    known = [row_counts[device_id] for device_id in device_ids if row_counts and row_counts.get(device_id)]
+    if not known:
+        return {device_id: stable_hash(device_id) % shard_count for device_id in device_ids}
+
+    default_count = sum(known) / len(known)
+    weights = {device_id: row_counts.get(device_id) or default_count for device_id in device_ids}
+    ordered = sorted(device_ids, key=lambda device_id: (-weights[device_id], stable_hash(device_id)))
+
+    loads = [(0, shard) for shard in range(shard_count)]
+    shards = {}
+    for device_id in ordered:
+        load, shard = heapq.heappop(loads)
+        shards[device_id] = shard
+        heapq.heappush(loads, (load + weights[device_id], shard))
+    return shards
+
+
+def shard_filters(filter_list: list, shard_count: int, row_counts: dict = None) -> List[list]:
+    """
+    Split the per-device filters of `build_device_filters` into `shard_count` lists (see `assign_shards`)
+
+    Filters that do not select a single device are put in the first shard. Empty shards are dropped.
+    """
+    device_ids = [f["device_id"]["="] for f in filter_list if "=" in f.get("device_id", {})]
+    assignment = assign_shards(device_ids, shard_count, row_counts)
+
+    shards = [[] for _ in range(max(int(shard_count), 1))]
+    for f in filter_list:
+        device_id = f.get("device_id", {}).get("=")
+        shards[assignment.get(device_id, 0)].append(f)
+    return [shard for shard in shards if shard]
+
+
+def dynamic_block_output(shards: List[list]) -> list:
+    """
+    Output of a Mage dynamic block running one downstream block per shard: the list of items and the list
+    of their metadata, which names every block instance after its shard
+    """
+    return [shards, [{"block_uuid": f"shard_{i}"} for i in range(len(shards))]]
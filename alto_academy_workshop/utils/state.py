@@ -0,0 +1,54 @@
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser("~"), ".mage_data", "alto_academy_workshop", "state")
+
+
+def state_path(filename: str, state_dir: str = None) -> str:
+    """ Return the path of a state file, in `state_dir` or the default state directory """
+    return os.path.join(state_dir or DEFAULT_STATE_DIR, filename)
+
+
+def read_json(path: str, default=None):
+    """ Read a JSON state file, returning `default` if it does not exist """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(path: str, data) -> None:
+    """ Write a JSON state file atomically so that a crash never leaves a partial file behind """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def locked(path: str):
+    """
+    Hold an exclusive lock on a state file across processes, with `flock` on a '<path>.lock' file
+
+    Read, update and write the state file within the lock so that concurrent writers do not overwrite
+    each other's updates.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
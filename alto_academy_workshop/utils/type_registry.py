@@ -0,0 +1,127 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+from alto_academy_workshop.utils import state
+
+NUMERIC = "numeric"
+CATEGORICAL = "categorical"
+AGGREGATIONS = {NUMERIC: ["mean"], CATEGORICAL: ["mode"]}
+
+
+@dataclass
+class DatapointTypeRegistry:
+    """
+    Value type of every (device_id, datapoint), learned from the observed data and persisted in a local JSON state file
+
+    Every entry counts the non-null values seen and how many of them were not numbers. A datapoint is numeric
+    while the share of non-numeric values stays within `tolerance`, so a few bad values do not turn a numeric
+    datapoint into a categorical one. Numeric datapoints are converted to float on every run anyway, so their
+    counts are updated for free. Categorical datapoints are not converted, and are only observed again once
+    their entry is older than `ttl_seconds`.
+
+    The counts only cover about the last `window_values` values: the older counts are scaled down as new
+    values come in. So a datapoint that starts sending text after weeks of numbers turns categorical after a
+    share of `tolerance` of the window, instead of a share of its whole history. Once the window is full of
+    numeric values, new numeric values leave the counts unchanged.
+
+    The state file is shared by the blocks running in other processes (ex. one per shard). Updates re-read
+    the file and are written atomically under a file lock (see `state.locked`), so that the entries written
+    by another process since the last read are merged instead of overwritten. The file is only written when
+    an entry changed.
+
+    Args:
+        path (str): Path of the state file
+        tolerance (float): Largest share of non-numeric values of a numeric datapoint
+        ttl_seconds (float): Age after which a categorical datapoint is observed again
+        window_values (int): Number of most recent values the share of non-numeric values is computed over
+
+    """
+    path: str = field(default_factory=lambda: state.state_path("datapoint_types.json"))
+    tolerance: float = 0.01
+    ttl_seconds: float = 86400
+    window_values: int = 10000
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def get_types(self, pairs: List[tuple]) -> List[str]:
+        """
+        Return the type of every (device_id, datapoint) pair
+
+        Returns:
+            types (list[str]): 'numeric' or 'categorical', or None for pairs that are unknown or due to be
+                observed again
+
+        """
+        with self._lock:
+            registry = state.read_json(self.path, default={})
+
+        now = time.time()
+        types = []
+        for device_id, datapoint in pairs:
+            entry = registry.get(device_id, {}).get(datapoint)
+            if entry is None or (entry["type"] == CATEGORICAL and now - entry["observed_at"] > self.ttl_seconds):
+                types.append(None)
+            else:
+                types.append(entry["type"])
+        return types
+
+    def observe(self, pairs: List[tuple], values: List[int], non_numeric: List[int]) -> List[str]:
+        """
+        Add the counts observed in a run and return the updated types
+
+        Args:
+            pairs (list[tuple]): (device_id, datapoint) pairs that were converted to float
+            values (list[int]): Number of non-null values of every pair
+            non_numeric (list[int]): Number of values of every pair that could not be converted
+
+        Returns:
+            types (list[str]): Type of every pair after the update
+
+        """
+        now = time.time()
+        types = []
+        with self._lock, state.locked(self.path):
+            registry = state.read_json(self.path, default={})
+            changed = False
+            for (device_id, datapoint), n_values, n_non_numeric in zip(pairs, values, non_numeric):
+                previous = registry.setdefault(device_id, {}).get(datapoint)
+                if previous is None or previous["type"] == CATEGORICAL:
+                    # Categorical datapoints start over from the new observation
+                    entry = {"values": 0, "non_numeric": 0}
+                else:
+                    entry = dict(previous)
+
+                # Step 1: Scale the older counts down to make room for the new values in the window
+                n_values, n_non_numeric = int(n_values), int(n_non_numeric)
+                if entry["values"] + n_values > self.window_values:
+                    kept = max(self.window_values - n_values, 0)
+                    entry["non_numeric"] = round(entry["non_numeric"] * kept / entry["values"], 6) if entry["values"] else 0
+                    entry["values"] = kept
+                entry["values"] += n_values
+                entry["non_numeric"] += n_non_numeric
+                entry["type"] = NUMERIC if entry["non_numeric"] <= self.tolerance * entry["values"] else CATEGORICAL
+                entry["aggregations"] = AGGREGATIONS[entry["type"]]
+                types.append(entry["type"])
+
+                # Step 2: Keep the entry as it is when the observation changed nothing
+                if previous is not None and previous["type"] == NUMERIC and \
+                        {**entry, "observed_at": previous["observed_at"]} == previous:
+                    continue
+                entry["observed_at"] = now
+                registry[device_id][datapoint] = entry
+                changed = True
+
+            if changed:
+                state.write_json(self.path, registry)
+        return types
+
+    def invalidate(self, device_id: str = None) -> None:
+        """ Forget the types of a device, or of every device, so that they are learned again """
+        with self._lock, state.locked(self.path):
+            registry = state.read_json(self.path, default={})
+            if device_id is None:
+                registry = {}
+            else:
+                registry.pop(device_id, None)
+            state.write_json(self.path, registry)
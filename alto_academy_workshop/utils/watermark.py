@@ -0,0 +1,147 @@
+import threading
+import time
+from dataclasses import dataclass, field
+
+from alto_academy_workshop.utils import state
+
+
+@dataclass
+class FileWatermarkStore:
+    """
+    Watermarks (epoch seconds) keyed by name, persisted in a local JSON state file
+
+    The file is shared by the pipelines and blocks running in other processes. `set` re-reads the file and
+    writes it under a file lock (see `state.locked`), so that the watermarks set by another process are kept.
+    """
+    path: str = field(default_factory=lambda: state.state_path("watermarks.json"))
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def get(self, key: str):
+        entry = state.read_json(self.path, default={}).get(key)
+        return entry["watermark"] if entry else None
+
+    def set(self, key: str, watermark: float) -> None:
+        with self._lock, state.locked(self.path):
+            watermarks = state.read_json(self.path, default={})
+            watermarks[key] = {"watermark": float(watermark), "updated_at": time.time()}
+            state.write_json(self.path, watermarks)
+
+    def close(self) -> None:
+        pass
+
+
+@dataclass
+class TimescaleDBWatermarkStore:
+    """ Watermarks (epoch seconds) keyed by name, persisted in a TimescaleDB table """
+    timescaledb: object
+    table_name: str = "alto_pipeline_watermarks"
+
+    def __post_init__(self):
+        with self.timescaledb.session() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    key TEXT PRIMARY KEY,
+                    watermark DOUBLE PRECISION NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );""")
+
+    def get(self, key: str):
+        with self.timescaledb.session() as cursor:
+            cursor.execute(f"SELECT watermark FROM {self.table_name} WHERE key = %s", (key,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, watermark: float) -> None:
+        with self.timescaledb.session() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {self.table_name} (key, watermark, updated_at) VALUES (%s, %s, now())
+                ON CONFLICT (key) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at
+                """, (key, float(watermark)))
+
+    def close(self) -> None:
+        self.timescaledb.close()
+
+
+def get_watermark_store(**kwargs):
+    """
+    Create the watermark store configured by the pipeline variables
+
+    'watermark_store' selects 'file' (default, at 'watermark_path' or in the default state directory)
+    or 'timescaledb' (in the 'watermark_table' table of the destination TimescaleDB).
+    """
+    store_type = kwargs.get("watermark_store", "file")
+    if store_type == "file":
+        path = kwargs.get("watermark_path") or state.state_path("watermarks.json")
+        return FileWatermarkStore(path=path)
+    elif store_type == "timescaledb":
+        from alto_academy_workshop.utils.database import AltoTimescaleDB
+        timescaledb = AltoTimescaleDB(
+            db_name=kwargs.get("timescaledb_db_name"),
+            username=kwargs.get("timescaledb_username"),
+            password=kwargs.get("timescaledb_password"),
+            host=kwargs.get("timescaledb_host"),
+            port=kwargs.get("timescaledb_port", 5432),
+            pool_size=1
+        )
+        return TimescaleDBWatermarkStore(
+            timescaledb=timescaledb,
+            table_name=kwargs.get("watermark_table", "alto_pipeline_watermarks")
+        )
+    else:
+        raise ValueError(f"Unknown watermark store: {store_type}")
+
+
+def watermark_key(**kwargs) -> str:
+    """ Name of the watermark of this pipeline, the CrateDB source table unless 'watermark_key' is given """
+    return kwargs.get("watermark_key") or kwargs.get("cratedb_source_table")
+
+
+def resolve_extraction_window(**kwargs):
+    """
+    Return the (start, end) epoch seconds of the raw data to extract in this run
+
+    With 'extraction_mode' = 'window' (default), the window is the `query_period_seconds` before
+    `interval_start_datetime`. With 'incremental', the window starts at the stored watermark and ends at
+    `interval_start_datetime - watermark_grace_seconds`, aligned down to `resample_seconds`. At most
+    `max_catchup_seconds` are extracted per run so that a long outage is caught up in large, bounded batches.
+    Without a stored watermark, the incremental window falls back to the last `query_period_seconds`.
+
+    The window is half-open, [start, end), as in the filters of `construct_filter`. The watermark only
+    moves once the exporter has written the window (see `commit_extraction_window`).
+    """
+    query_period_seconds = int(kwargs.get("query_period_seconds", 60))
+    interval_end = kwargs["interval_start_datetime"].timestamp()
+
+    extraction_mode = kwargs.get("extraction_mode", "window")
+    if extraction_mode == "window":
+        return interval_end - query_period_seconds, interval_end
+    elif extraction_mode != "incremental":
+        raise ValueError(f"Unknown extraction mode: {extraction_mode}")
+
+    resample_seconds = int(kwargs.get("resample_seconds", 60))
+    grace_seconds = int(kwargs.get("watermark_grace_seconds", 0))
+    max_catchup_seconds = int(kwargs.get("max_catchup_seconds", 86400))
+
+    end = interval_end - grace_seconds
+    end -= end % resample_seconds
+    store = get_watermark_store(**kwargs)
+    start = store.get(watermark_key(**kwargs))
+    store.close()
+    if start is None:
+        start = end - query_period_seconds
+
+    # Only extract whole buckets. A partial bucket is left for the next run.
+    end = min(end, start + max_catchup_seconds)
+    end = start + max(end - start, 0) // resample_seconds * resample_seconds
+
+    return start, end
+
+
+def commit_extraction_window(**kwargs) -> None:
+    """ Move the watermark to the end of the window of this run, in incremental extraction mode only """
+    if kwargs.get("extraction_mode", "window") != "incremental":
+        return
+    _, end = resolve_extraction_window(**kwargs)
+    store = get_watermark_store(**kwargs)
+    store.set(watermark_key(**kwargs), end)
+    store.close()
@@ -0,0 +1,8 @@
+"""
+Throughput benchmarks of the cratedb2timescaledb pipeline stages
+
+The blocks run in-process against a synthetic `raw_data` table (see `synthetic.py`) through stand-ins of the
+CrateDB and PostgreSQL connections (see `standins.py`), so no database is needed:
+
+    python -m benchmarks.run --devices 500 --datapoints 20 --output bench.json
+"""
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import platform
+import runpy
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from alto_academy_workshop.utils.database import AltoTimescaleDB
+from alto_academy_workshop.utils.handoff import maybe_read
+from benchmarks.standins import use_standins
+from benchmarks.synthetic import devices_datapoints, generate_raw_data
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alto_academy_workshop")
+DECORATORS = ("data_loader", "transformer", "data_exporter", "custom", "test")
+
+
+def load_block(relative_path: str, function_name: str):
+    """ Load the function of a Mage block file without Mage, with its decorators replaced by the identity """
+    identity = {name: (lambda f: f) for name in DECORATORS}
+    namespace = runpy.run_path(os.path.join(PROJECT_DIR, relative_path), init_globals=identity)
+    return namespace[function_name]
+
+
+def measure(stage: str, rows: int, func, *args, **kwargs):
+    """ Run `func` once and return its result with the duration, rows/s and peak traced memory """
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - started_at
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = {
+        "stage": stage,
+        "rows": int(rows),
+        "seconds": round(seconds, 6),
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_memory_bytes": peak,
+    }
+    print(f"{stage:<28} {rows:>10} rows {seconds:>9.3f}s {stats['rows_per_second'] or 0:>14,.0f} rows/s "
+          f"{peak / 2 ** 20:>9.1f} MiB peak")
+    return result, stats
+
+
+def run(args) -> dict:
+    """ Run every stage once on the synthetic data and return the report """
+    end_timestamp = pd.Timestamp.now(tz="UTC").floor("min").timestamp()
+    raw_df = generate_raw_data(
+        n_devices=args.devices,
+        datapoints_per_device=args.datapoints,
+        sample_seconds=args.sample_seconds,
+        duration_seconds=args.query_period_seconds,
+        non_numeric_share=args.non_numeric_share,
+        end_timestamp=end_timestamp,
+        seed=args.seed
+    )
+    kwargs = {
+        "cratedb_source_table": "raw_data",
+        "timescaledb_destination_table": "aggregated_data",
+        "interval_start_datetime": datetime.fromtimestamp(end_timestamp, tz=timezone.utc),
+        "query_period_seconds": args.query_period_seconds,
+        "resample_seconds": args.resample_seconds,
+        "extraction_batch_size": args.extraction_batch_size,
+        "aggregation_engine": args.aggregation_engine,
+        "block_handoff": args.block_handoff,
+    }
+    print(f"Generated {len(raw_df)} raw rows for {args.devices} device(s) x {args.datapoints} datapoint(s)")
+
+    construct_filter = load_block("data_loaders/construct_filter.py", "load_data")
+    extract = load_block("data_loaders/extract_data_from_cratedb.py", "load_data")
+    aggregate = load_block("transformers/aggregate.py", "transform")
+
+    stages = []
+    with use_standins({"raw_data": raw_df}):
+        devices = devices_datapoints(raw_df)
+        (shards, _), stats = measure("construct_filter", len(devices), construct_filter, devices, **kwargs)
+        stages.append(stats)
+        filter_list = [f for shard in shards for f in shard]  # Measure the stages on every shard at once
+
+        extracted, stats = measure("extract_data_from_cratedb", len(raw_df), extract, filter_list, **kwargs)
+        stages.append(stats)
+
+        (agg_data, table_name), stats = measure("aggregate.transform", len(raw_df), aggregate, extracted, **kwargs)
+        stages.append(stats)
+
+        agg_data = maybe_read(agg_data)
+        timescaledb = AltoTimescaleDB(db_name="benchmark")
+        _, stats = measure(
+            f"insert_data ({args.insert_method}/{args.copy_format})",
+            len(agg_data),
+            timescaledb.insert_data,
+            table_name,
+            agg_data,
+            method=args.insert_method,
+            copy_format=args.copy_format
+        )
+        timescaledb.close()
+        stages.append(stats)
+
+    return {
+        "created_at": datetime.now(tz=timezone.utc).isoformat(),
+        "parameters": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "raw_rows": len(raw_df),
+        "stages": stages,
+    }
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """ Print the rows/s and peak memory of every stage relative to a previous report """
+    previous = {stats["stage"]: stats for stats in baseline.get("stages", [])}
+    for stats in report["stages"]:
+        before = previous.get(stats["stage"])
+        if before is None or not before.get("rows_per_second") or not stats.get("rows_per_second"):
+            continue
+        print(f"{stats['stage']:<28} {stats['rows_per_second'] / before['rows_per_second']:>6.2f}x rows/s "
+              f"{stats['peak_memory_bytes'] / max(before['peak_memory_bytes'], 1):>6.2f}x peak memory")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cratedb2timescaledb pipeline stages on synthetic data")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--datapoints", type=int, default=10, help="datapoints per device")
+    parser.add_argument("--sample-seconds", type=float, default=10, help="sampling period of every datapoint")
+    parser.add_argument("--query-period-seconds", type=int, default=3600, help="time span of the data")
+    parser.add_argument("--non-numeric-share", type=float, default=0.1, help="share of non-numeric datapoints")
+    parser.add_argument("--resample-seconds", type=int, default=60)
+    parser.add_argument("--extraction-batch-size", type=int, default=500)
+    parser.add_argument("--aggregation-engine", default="vectorized", choices=["vectorized", "loop", "pushdown"],
+                        help="engine of the aggregate block")
+    parser.add_argument("--block-handoff", default="pickle", choices=["pickle", "arrow", "parquet"])
+    parser.add_argument("--insert-method", default="copy", choices=["copy", "executemany"])
+    parser.add_argument("--copy-format", default="text", choices=["text", "binary"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="path of the JSON report")
+    parser.add_argument("--baseline", help="path of a previous JSON report to compare with")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved the report to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
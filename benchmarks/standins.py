@@ -0,0 +1,212 @@
+import re
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from alto_academy_workshop.utils.database import AltoCrateDB, AltoTimescaleDB
+
+_SELECT = re.compile(r"^SELECT \* FROM (\w+)(?: WHERE (.*))?$", re.DOTALL)
+_ANY = re.compile(r"^(NOT \()?(\w+) = ANY\(\?\)\)?$")
+_COMPARISON = re.compile(r"^(\w+) (>=|<=|!=|=|>|<) \?$")
+_BUCKETS = re.compile(
+    r"^SELECT device_id, datapoint,\s+DATE_BIN\(INTERVAL '(\d+) seconds'.*?FROM (\w+)(?: WHERE (.*?))?"
+    r"\nGROUP BY 1, 2, 3(, 4)?$",
+    re.DOTALL
+)
+
+AGGREGATED_DATA_COLUMNS = [
+    ("timestamp", "timestamp with time zone"),
+    ("device_id", "character varying"),
+    ("aggregation_type", "character varying"),
+    ("datapoint", "character varying"),
+    ("value", "double precision"),
+    ("value_text", "text"),
+]
+
+
+class CrateCursor:
+    """
+    In-process stand-in of a CrateDB cursor over a dataframe
+
+    Supports `SELECT 1`, the `SELECT * FROM <table> WHERE ...` statements built by `compile_query`
+    with the qmark paramstyle and the bucket queries of `AltoCrateDB.query_bucket_stats` and
+    `query_bucket_value_counts`. Rows are returned as lists, as the crate client does.
+    """
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql_string: str, args: list = None):
+        args = list(args or [])
+        if sql_string.strip() == "SELECT 1":
+            self.description, self._rows = (("1",),), [[1]]
+            return
+
+        match = _BUCKETS.match(sql_string.strip())
+        if match is not None:
+            selected = self._select(self.tables[match.group(2)], match.group(3), args)
+            selected = self._bucket_value_counts(selected, int(match.group(1))) if match.group(4) \
+                else self._bucket_stats(selected, int(match.group(1)))
+        else:
+            match = _SELECT.match(sql_string.strip())
+            if match is None:
+                raise NotImplementedError(f"Unsupported statement: {sql_string}")
+            selected = self._select(self.tables[match.group(1)], match.group(2), args)
+
+        self.description = tuple((name,) for name in selected.columns)
+        self._rows = [list(row) for row in selected.itertuples(index=False, name=None)]
+
+    @classmethod
+    def _select(cls, table: pd.DataFrame, where: str, args: list) -> pd.DataFrame:
+        mask = np.ones(len(table), dtype=bool)
+        for condition, value in zip(where.split("\nAND ") if where else [], args):
+            mask &= cls._evaluate(table, condition, value)
+        return table[mask]
+
+    @staticmethod
+    def _bucketed(table: pd.DataFrame, resample_seconds: int) -> pd.DataFrame:
+        # DATE_BIN with an origin of 0, in epoch milliseconds
+        width = resample_seconds * 1000
+        return table[["device_id", "datapoint"]].assign(bucket=table["timestamp"] // width * width)
+
+    @classmethod
+    def _bucket_stats(cls, table: pd.DataFrame, resample_seconds: int) -> pd.DataFrame:
+        numeric = pd.to_numeric(table["value"], errors="coerce")
+        stats = cls._bucketed(table, resample_seconds).assign(
+            value_count=table["value"].notna(), numeric_count=numeric.notna(), numeric_mean=numeric
+        ).groupby(["device_id", "datapoint", "bucket"]).agg(
+            value_count=("value_count", "sum"), numeric_count=("numeric_count", "sum"),
+            numeric_mean=("numeric_mean", "mean")
+        ).reset_index()
+        stats["numeric_mean"] = stats["numeric_mean"].astype(object).where(stats["numeric_mean"].notna(), None)
+        return stats
+
+    @classmethod
+    def _bucket_value_counts(cls, table: pd.DataFrame, resample_seconds: int) -> pd.DataFrame:
+        return cls._bucketed(table, resample_seconds).assign(value=table["value"]).groupby(
+            ["device_id", "datapoint", "bucket", "value"], dropna=False
+        ).size().rename("count").reset_index()
+
+    @staticmethod
+    def _evaluate(table: pd.DataFrame, condition: str, value) -> np.ndarray:
+        match = _ANY.match(condition)
+        if match is not None:
+            isin = table[match.group(2)].isin(value).to_numpy()
+            return ~isin if match.group(1) else isin
+
+        match = _COMPARISON.match(condition)
+        if match is None:
+            raise NotImplementedError(f"Unsupported condition: {condition}")
+        column = table[match.group(1)]
+        return {
+            ">=": column >= value, "<=": column <= value, ">": column > value,
+            "<": column < value, "=": column == value, "!=": column != value,
+        }[match.group(2)].to_numpy()
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class CrateConnection:
+    """ In-process stand-in of a CrateDB connection """
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+
+    def cursor(self):
+        return CrateCursor(self.tables)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PostgresCursor:
+    """
+    In-process stand-in of a psycopg2 cursor that accepts writes and discards them
+
+    The column types of every table are answered from `columns`. COPY input is read to the end and
+    `executemany` rows are iterated, so that the cost of producing the data is measured.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql_string: str, args=None):
+        self.description, self._rows = None, []
+        if "information_schema.columns" in sql_string:
+            self.description = (("column_name",), ("data_type",))
+            self._rows = list(self.connection.columns)
+        elif sql_string.strip() == "SELECT 1":
+            self.description, self._rows = (("?column?",),), [(1,)]
+
+    def executemany(self, sql_string: str, rows):
+        for _ in rows:
+            self.connection.rows_written += 1
+
+    def copy_expert(self, sql_string: str, file, size: int = 8192):
+        while True:
+            data = file.read(size)
+            if not data:
+                break
+            self.connection.bytes_written += len(data)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class PostgresConnection:
+    """ In-process stand-in of a psycopg2 connection """
+
+    def __init__(self, columns=AGGREGATED_DATA_COLUMNS):
+        self.columns = columns
+        self.closed = 0
+        self.autocommit = False
+        self.rows_written = 0
+        self.bytes_written = 0
+
+    def cursor(self, name: str = None):
+        return PostgresCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@contextmanager
+def use_standins(tables: dict, columns=AGGREGATED_DATA_COLUMNS):
+    """
+    Make `AltoCrateDB` and `AltoTimescaleDB` connect to the in-process stand-ins instead of real databases
+
+    Args:
+        tables (dict): Dataframes of the CrateDB tables keyed by table name, ex. {'raw_data': raw_df}
+        columns (list[tuple]): (column name, data type) of the TimescaleDB tables
+
+    """
+    crate_connect, timescale_connect = AltoCrateDB._connect, AltoTimescaleDB._connect
+    AltoCrateDB._connect = lambda self: CrateConnection(tables)
+    AltoTimescaleDB._connect = lambda self: PostgresConnection(columns)
+    try:
+        yield
+    finally:
+        AltoCrateDB._connect, AltoTimescaleDB._connect = crate_connect, timescale_connect
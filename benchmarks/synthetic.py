@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+CATEGORICAL_VALUES = np.array(["on", "off", "auto", "fault", "standby"], dtype=object)
+
+
+def generate_raw_data(n_devices: int = 100,
+                      datapoints_per_device: int = 10,
+                      sample_seconds: float = 10,
+                      duration_seconds: float = 3600,
+                      non_numeric_share: float = 0.1,
+                      end_timestamp: float = None,
+                      seed: int = 0
+                      ) -> pd.DataFrame:
+    """
+    Generate rows shaped like the CrateDB `raw_data` table
+
+    Every datapoint is sampled every `sample_seconds` (with up to 10% jitter) over the `duration_seconds`
+    before `end_timestamp`. A share of the datapoints is non-numeric (status values such as 'on'/'off'),
+    the others are noisy random walks. Values are strings, as in `raw_data`.
+
+    Args:
+        n_devices (int): Number of devices
+        datapoints_per_device (int): Number of datapoints of every device
+        sample_seconds (float): Sampling period of every datapoint in seconds
+        duration_seconds (float): Time span of the data in seconds
+        non_numeric_share (float): Share of the datapoints with non-numeric values, from 0 to 1
+        end_timestamp (float): End of the data in epoch seconds, the start of the current minute if not given
+        seed (int): Seed of the random generator
+
+    Returns:
+        raw_df (pd.DataFrame): Rows with 'timestamp' (epoch milliseconds), 'location', 'device_id',
+            'subdevice_idx', 'type', 'datapoint' and 'value'
+
+    """
+    rng = np.random.default_rng(seed)
+    if end_timestamp is None:
+        end_timestamp = pd.Timestamp.now(tz="UTC").floor("min").timestamp()
+    start_ms = int((end_timestamp - duration_seconds) * 1000)
+    n_series = n_devices * datapoints_per_device
+    n_samples = max(int(duration_seconds // sample_seconds), 1)
+
+    # One row per (series, sample), series-major
+    series = np.repeat(np.arange(n_series), n_samples)
+    sample = np.tile(np.arange(n_samples), n_series)
+    jitter = rng.uniform(0, 0.1 * sample_seconds * 1000, len(series))
+    timestamps = start_ms + (sample * sample_seconds * 1000 + jitter).astype(np.int64)
+
+    device_idx, datapoint_idx = np.divmod(series, datapoints_per_device)
+    is_categorical = rng.random(n_series) < non_numeric_share
+
+    steps = rng.normal(0, 1, (n_series, n_samples)).cumsum(axis=1) + rng.uniform(10, 1000, (n_series, 1))
+    values = np.round(steps.ravel(), 3).astype(str).astype(object)
+    categorical_rows = is_categorical[series]
+    values[categorical_rows] = CATEGORICAL_VALUES[rng.integers(0, len(CATEGORICAL_VALUES), categorical_rows.sum())]
+
+    device_names = np.array([f"device_{i:05d}" for i in range(n_devices)], dtype=object)
+    datapoint_names = np.array([f"datapoint_{j:03d}" for j in range(datapoints_per_device)], dtype=object)
+    raw_df = pd.DataFrame({
+        "timestamp": timestamps,
+        "location": "building_1/floor_1",
+        "device_id": device_names[device_idx],
+        "subdevice_idx": 0,
+        "type": "sensor",
+        "datapoint": datapoint_names[datapoint_idx],
+        "value": values,
+    })
+    return raw_df.sort_values("timestamp", kind="stable", ignore_index=True)
+
+
+def devices_datapoints(raw_df: pd.DataFrame) -> dict:
+    """ Return the device_id -> datapoints dictionary of the data, as `get_unique_deviceid_datapoint` """
+    pairs = raw_df[["device_id", "datapoint"]].drop_duplicates().sort_values(["device_id", "datapoint"])
+    return pairs.groupby("device_id")["datapoint"].agg(list).to_dict()
@@ -0,0 +1,230 @@
+import re
+from datetime import datetime
+
+import psycopg2.errors
+
+from alto_academy_workshop.utils import pgcopy
+
+# (column name, data type) of the aggregated data table, as answered by information_schema.columns
+AGGREGATED_DATA_COLUMNS = [
+    ("timestamp", "timestamp with time zone"),
+    ("device_id", "character varying"),
+    ("aggregation_type", "character varying"),
+    ("datapoint", "character varying"),
+    ("value", "double precision"),
+    ("value_text", "text"),
+]
+
+
+def timescaledb_handler(sql_string, args):
+    """ Handler of a fake TimescaleDB connection with the aggregated data table """
+    if "information_schema.columns" in sql_string:
+        return ["column_name", "data_type"], AGGREGATED_DATA_COLUMNS
+    return None
+
+
+class FakeCursor:
+    """ DB-API cursor answering every statement with the `handler` of its connection """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+
+    def execute(self, sql_string: str, args=None):
+        self.connection.statements.append((sql_string, args))
+        self.description, self._rows = None, []
+        if sql_string.strip() == "SELECT 1":
+            self.description, self._rows = (("1",),), [(1,)]
+            return
+        result = self.connection.handler(sql_string, args)
+        if result is not None:
+            column_names, self._rows = result
+            self.description = tuple((name,) for name in column_names)
+
+    def executemany(self, sql_string: str, rows):
+        rows = list(rows)
+        self.connection.statements.append((sql_string, rows))
+        return self.connection.bulk_handler(sql_string, rows)
+
+    def copy_expert(self, sql_string: str, file, size: int = 8192):
+        data = file.read()
+        self.connection.statements.append((sql_string, data))
+        self.connection.copy_handler(sql_string, data)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    DB-API connection recording every statement
+
+    Args:
+        handler (callable): Function (sql_string, args) -> (column_names, rows) or None, which may raise
+        bulk_handler (callable): Function (sql_string, rows) -> result of `executemany`
+        copy_handler (callable): Function (sql_string, data) called with the data of `copy_expert`
+
+    """
+
+    def __init__(self, handler=None, bulk_handler=None, copy_handler=None):
+        self.handler = handler or (lambda sql_string, args: None)
+        self.bulk_handler = bulk_handler or (lambda sql_string, rows: None)
+        self.copy_handler = copy_handler or (lambda sql_string, data: None)
+        self.statements = []
+        self.closed = 0
+        self.autocommit = False
+
+    def cursor(self, name: str = None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+_COPY = re.compile(r"^COPY (\w+) \((.*?)\) FROM STDIN$")
+_INSERT = re.compile(r"^INSERT INTO (\w+) \((.*?)\) VALUES")
+_MERGE = re.compile(r"^INSERT INTO (\w+) .*?FROM (\w+)\s+ORDER BY .*?ON CONFLICT \((.*?)\) (DO UPDATE|DO NOTHING)", re.DOTALL)
+_DELETE = re.compile(r"^DELETE FROM (\w+)(?: WHERE (.*))?$", re.DOTALL)
+_CONDITION = re.compile(r"^(\w+) (>=|<=|=|>|<) %s$")
+
+
+class FakeTimescale:
+    """
+    Fake TimescaleDB server holding tables of AGGREGATED_DATA_COLUMNS in memory, ex. `AltoTimescaleDB._connect = server.connect`
+
+    It understands what `AltoTimescaleDB.insert_data` and `delete_data` send: COPY in the text format, INSERT
+    with executemany, the staging table and `INSERT ... SELECT DISTINCT ON ... ON CONFLICT` of the upsert mode,
+    and DELETE by comparisons. The writes of a connection are only seen by the others once committed. With a
+    `unique_key`, a duplicated key raises UniqueViolation like a unique index does; without it, ON CONFLICT
+    raises like PostgreSQL does for a table without a matching index.
+    """
+
+    def __init__(self, unique_key: tuple = None, table_name: str = "aggregated_data"):
+        self.unique_key = unique_key
+        self.tables = {table_name: []}
+
+    def connect(self):
+        return FakeTimescaleConnection(self)
+
+    def rows(self, table_name: str = "aggregated_data") -> list:
+        """ Committed rows of a table as dictionaries """
+        return [dict(zip(_COLUMN_NAMES, row)) for row in self.tables[table_name]]
+
+
+_COLUMN_NAMES = [name for name, _ in AGGREGATED_DATA_COLUMNS]
+
+
+def _parse_copy_text(data: str) -> list:
+    """ Rows of AGGREGATED_DATA_COLUMNS from the COPY text format, with the timestamps parsed """
+    rows = []
+    for line in data.splitlines():
+        row = [None if field == "\\N" else field for field in line.split("\t")]
+        row[0] = datetime.fromisoformat(row[0])
+        row[4] = None if row[4] is None else float(row[4])
+        rows.append(tuple(row))
+    return rows
+
+
+class FakeTimescaleConnection(FakeConnection):
+    """ Connection to a `FakeTimescale` server """
+
+    def __init__(self, server: FakeTimescale):
+        super().__init__(handler=self.handle, bulk_handler=self.handle_many, copy_handler=self.handle_copy)
+        self.server = server
+        self.tables = None  # Tables as seen by the open transaction
+
+    def _table(self, table_name: str) -> list:
+        return self._begin()[table_name]
+
+    def _begin(self) -> dict:
+        if self.tables is None:
+            self.tables = {name: list(rows) for name, rows in self.server.tables.items()}
+        return self.tables
+
+    def _append(self, table_name: str, rows: list) -> None:
+        table = self._table(table_name)
+        if self.server.unique_key and table_name in self.server.tables:
+            positions = [_COLUMN_NAMES.index(col) for col in self.server.unique_key]
+            keys = {tuple(row[i] for i in positions) for row in table}
+            for row in rows:
+                key = tuple(row[i] for i in positions)
+                if key in keys:
+                    raise psycopg2.errors.UniqueViolation(f"duplicate key value violates unique constraint: {key}")
+                keys.add(key)
+        table.extend(rows)
+
+    def handle(self, sql_string, args):
+        sql_string = sql_string.strip()
+        if "information_schema.columns" in sql_string:
+            return ["column_name", "data_type"], AGGREGATED_DATA_COLUMNS
+        if "pg_index" in sql_string:
+            return ["columns"], [(list(self.server.unique_key),)] if self.server.unique_key else []
+        if sql_string.startswith("CREATE TEMPORARY TABLE"):
+            self._begin()[sql_string.split()[3]] = []
+            return None
+
+        match = _MERGE.match(sql_string)
+        if match is not None:
+            target, staging, key = match.group(1), match.group(2), match.group(3).split(", ")
+            if not self.server.unique_key or set(key) != set(self.server.unique_key):
+                raise psycopg2.errors.InvalidColumnReference(
+                    "there is no unique or exclusion constraint matching the ON CONFLICT specification"
+                )
+            positions = [_COLUMN_NAMES.index(col) for col in key]
+            merged = {tuple(row[i] for i in positions): row for row in self._table(target)}
+            for row in self._table(staging):  # DISTINCT ON ... ORDER BY ctid DESC: the last copy wins
+                if match.group(4) == "DO UPDATE" or tuple(row[i] for i in positions) not in merged:
+                    merged[tuple(row[i] for i in positions)] = row
+            self.tables[target] = list(merged.values())
+            return None
+
+        match = _DELETE.match(sql_string)
+        if match is not None:
+            conditions = match.group(2).split("\nAND ") if match.group(2) else []
+            table = self._table(match.group(1))
+            kept = [row for row in table if not all(_compare(row, condition, value)
+                                                    for condition, value in zip(conditions, args or []))]
+            table[:] = kept
+            return None
+        return None
+
+    def handle_many(self, sql_string, rows):
+        match = _INSERT.match(sql_string.strip())
+        data = pgcopy.encode_text(rows, [data_type for _, data_type in AGGREGATED_DATA_COLUMNS]).getvalue()
+        self._append(match.group(1), _parse_copy_text(data))
+
+    def handle_copy(self, sql_string, data):
+        match = _COPY.match(sql_string.strip())
+        if match is None:
+            raise NotImplementedError(f"Unsupported COPY: {sql_string}")
+        self._append(match.group(1), _parse_copy_text(data))
+
+    def commit(self):
+        if self.tables is not None:
+            # Temporary tables are dropped at commit
+            self.server.tables = {name: rows for name, rows in self.tables.items() if name in self.server.tables}
+        self.tables = None
+
+    def rollback(self):
+        self.tables = None
+
+
+def _compare(row: tuple, condition: str, value) -> bool:
+    column, oper = _CONDITION.match(condition).groups()
+    field = row[_COLUMN_NAMES.index(column)]
+    return {">=": field >= value, "<=": field <= value, "=": field == value, ">": field > value, "<": field < value}[oper]
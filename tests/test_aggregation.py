@@ -0,0 +1,130 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pendulum")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils.aggregation import (
+    OUTPUT_COLUMNS, aggregate_frame, aggregate_pushdown, categorical_aggregate, index_by_timestamp
+)
+from alto_academy_workshop.utils.filters import build_device_filters
+from benchmarks.run import load_block
+
+START_MS = 1700000040000  # A multiple of a minute
+
+SERIES = {
+    ("d1", "temperature"): ["20.5", "21", "22.25", "23", "24", "25.5"],
+    # Strings that float() accepts but pd.to_numeric does not, and nulls: numeric for both engines
+    ("d1", "humidity"): ["nan", None, "40", " 41.5", "NaN", "inf"],
+    ("d2", "state"): ["on", "off", "on", "off", "off", None],
+    ("d2", "setpoint"): ["25", "x", "25", "26", "26", "26"],
+}
+
+
+def _raw_data():
+    rows = []
+    for (device_id, datapoint), values in SERIES.items():
+        for i, value in enumerate(values):
+            # 3 rows per minute, with one empty minute between the two halves
+            offset = i * 20000 if i < 3 else (i + 3) * 20000
+            rows.append({"timestamp": START_MS + offset, "device_id": device_id, "datapoint": datapoint, "value": value})
+    return pd.DataFrame(rows)
+
+
+def _normalize(rows):
+    frame = pd.DataFrame(list(rows))
+    frame["timestamp"] = [int(pd.Timestamp(ts).timestamp()) for ts in frame["timestamp"]]
+    frame = frame.sort_values(["device_id", "datapoint", "aggregation_type", "timestamp"])
+    return [tuple(row) for row in frame[["timestamp", "device_id", "aggregation_type", "datapoint", "value"]].itertuples(index=False)]
+
+
+def _same(left, right) -> bool:
+    if isinstance(left, float) and isinstance(right, float):
+        return (math.isnan(left) and math.isnan(right)) or left == right
+    if left is None or right is None or (isinstance(left, float) and math.isnan(left)):
+        return pd.isna(left) and pd.isna(right)
+    return left == right
+
+
+def test_vectorized_and_loop_engines_match():
+    filter_list = build_device_filters(
+        {device_id: [dp for d, dp in SERIES if d == device_id] for device_id, _ in SERIES},
+        START_MS // 1000,
+        START_MS // 1000 + 180
+    )
+    loop = load_block("transformers/aggregate.py", "transform")
+    loop_rows, _ = loop([filter_list, index_by_timestamp(_raw_data())], resample_seconds=60,
+                        query_period_seconds=180, aggregation_engine="loop")
+    vectorized = aggregate_frame(index_by_timestamp(_raw_data()), resample_seconds=60, filter_list=filter_list)
+
+    expected, actual = _normalize(loop_rows), _normalize(vectorized.to_dict("records"))
+    assert [row[:4] for row in actual] == [row[:4] for row in expected]
+    for left, right in zip(actual, expected):
+        assert _same(left[4], right[4]), (left, right)
+
+    types = {row[3]: row[2] for row in actual}
+    assert types == {"temperature": "mean_1min", "humidity": "mean_1min", "state": "mode_1min", "setpoint": "mode_1min"}
+
+
+def test_buckets_are_rounded_and_converted_to_bangkok_time_with_empty_buckets_filled():
+    raw = pd.DataFrame({
+        "timestamp": [START_MS, START_MS + 30000, START_MS + 180000],
+        "device_id": ["d1", "d1", "d1"],
+        "datapoint": ["power", "power", "power"],
+        "value": [1.0, 2.00004, 5.0],
+    })
+
+    agg = aggregate_frame(index_by_timestamp(raw), resample_seconds=60)
+
+    assert str(agg["timestamp"].dt.tz) == "Asia/Bangkok"
+    assert [ts.value // 10 ** 6 for ts in agg["timestamp"]] == [START_MS + i * 60000 for i in range(4)]
+    assert _same_list(agg["value"].tolist(), [1.5, math.nan, math.nan, 5.0])
+    assert set(agg["aggregation_type"]) == {"mean_1min"}
+
+
+def test_only_the_series_of_the_filters_are_aggregated():
+    filter_list = build_device_filters({"d2": ["state"]}, START_MS // 1000, START_MS // 1000 + 180)
+
+    agg = aggregate_frame(index_by_timestamp(_raw_data()), resample_seconds=60, filter_list=filter_list)
+
+    assert set(zip(agg["device_id"], agg["datapoint"])) == {("d2", "state")}
+    assert agg["value"].tolist()[0] == "on"
+
+
+def test_categorical_aggregate_breaks_mode_ties_with_the_smallest_value():
+    groups = np.array([0, 0, 0, 0, 2, 2])
+    values = ["on", "off", "on", "off", None, "idle"]
+
+    assert categorical_aggregate(groups, values, 3, "mode").tolist() == ["off", None, "idle"]
+    assert categorical_aggregate(groups, values, 3, "first").tolist() == ["on", None, "idle"]
+    assert categorical_aggregate(groups, values, 3, "last").tolist() == ["off", None, "idle"]
+
+
+def _same_list(left, right) -> bool:
+    return len(left) == len(right) and all(_same(a, b) for a, b in zip(left, right))
+
+
+@pytest.mark.parametrize("devices, stats_rows", [
+    ({}, []),
+    ({"d2": ["state"]}, []),
+    ({"d2": ["state"]}, [("d2", "state", START_MS, 1, 0, None)]),
+])
+def test_pushdown_without_rows_returns_an_empty_frame(devices, stats_rows):
+    stats_columns = ["device_id", "datapoint", "bucket", "value_count", "numeric_count", "numeric_mean"]
+    # The raw rows of 'state' are gone by the time their values are counted
+    cratedb = SimpleNamespace(
+        query_bucket_stats=lambda *args: pd.DataFrame(stats_rows, columns=stats_columns),
+        query_bucket_value_counts=lambda *args: pd.DataFrame(
+            columns=["device_id", "datapoint", "bucket", "value", "count"]
+        ),
+    )
+    filter_list = build_device_filters(devices, START_MS // 1000, START_MS // 1000 + 60)
+
+    agg_df = aggregate_pushdown(cratedb, "raw_data", filter_list)
+
+    assert agg_df.empty and list(agg_df.columns) == OUTPUT_COLUMNS
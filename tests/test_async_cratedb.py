@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+pytest.importorskip("aiohttp")
+
+from aiohttp import web
+
+from alto_academy_workshop.utils.async_cratedb import AsyncAltoCrateDB, CrateDBHTTPError, split_range
+
+
+async def _serve(handler):
+    """ Start a local fake of the CrateDB `_sql` endpoint and return its runner and port """
+    app = web.Application()
+    app.router.add_post("/_sql", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+def test_split_range():
+    assert split_range(5, 25, 10) == [(5, 10), (10, 20), (20, 25)]
+    assert split_range(10, 20, 10) == [(10, 20)]
+    assert split_range(10, 10, 10) == []
+
+
+def test_range_scans_run_concurrently_and_merge_in_order():
+    in_flight = {"now": 0, "max": 0}
+
+    async def handler(request):
+        payload = await request.json()
+        lo, hi = payload["args"]
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.05 if lo == 0 else 0)  # The first sub-range answers last
+        in_flight["now"] -= 1
+        return web.json_response({"cols": ["timestamp", "value"], "rows": [[ts, ts * 2] for ts in range(lo, hi, 5)]})
+
+    async def run():
+        runner, port = await _serve(handler)
+        try:
+            async with AsyncAltoCrateDB(host="127.0.0.1", port=port, max_concurrency=2) as cratedb:
+                return await cratedb.aquery_range("raw_data", {}, 0, 100, partition_ms=20)
+        finally:
+            await runner.cleanup()
+
+    rows = asyncio.run(run())
+    assert [row["timestamp"] for row in rows] == list(range(0, 100, 5))
+    assert rows[1] == {"timestamp": 5, "value": 10}
+    assert in_flight["max"] == 2
+
+
+def test_error_response_raises():
+    async def handler(request):
+        return web.json_response({"error": {"code": 4041, "message": "Relation 'raw_data' unknown"}}, status=404)
+
+    async def run():
+        runner, port = await _serve(handler)
+        try:
+            async with AsyncAltoCrateDB(host="127.0.0.1", port=port) as cratedb:
+                await cratedb.aquery_data("raw_data", {"device_id": {"=": "d1"}})
+        finally:
+            await runner.cleanup()
+
+    with pytest.raises(CrateDBHTTPError, match="4041"):
+        asyncio.run(run())
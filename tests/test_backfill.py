@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils import backfill, state
+from alto_academy_workshop.utils.backfill import plan_work_units, run_backfill
+from alto_academy_workshop.utils.database import UPSERT_KEY, AltoCrateDB, AltoTimescaleDB
+from alto_academy_workshop.utils.pipeline import PipelineConfig
+from tests.fakes import FakeConnection, FakeTimescale, timescaledb_handler
+
+DAY = 86400
+
+
+def test_plan_work_units_is_aligned_to_the_chunk_interval():
+    assert plan_work_units(DAY // 2, 2 * DAY + 10, "1 day") == [
+        (DAY // 2, DAY), (DAY, 2 * DAY), (2 * DAY, 2 * DAY + 10)
+    ]
+
+
+def test_units_with_query_errors_are_not_checkpointed(tmp_path, monkeypatch):
+    def cratedb_handler(sql_string, args):
+        if "DISTINCT" in sql_string:
+            if args[0] == DAY * 1000:
+                raise ConnectionError("CrateDB is unavailable")
+            return ["device_id", "datapoint"], [("d1", "power")]
+        return ["timestamp", "device_id", "datapoint", "value"], [(args[2], "d1", "power", 1.5)]
+
+    # Run the units in threads so that the fake connections are used by the workers
+    monkeypatch.setattr(backfill, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(AltoCrateDB, "_connect", lambda self: FakeConnection(handler=cratedb_handler))
+    monkeypatch.setattr(AltoTimescaleDB, "_connect", lambda self: FakeConnection(handler=timescaledb_handler))
+
+    config = PipelineConfig(
+        cratedb_source_table="raw_data",
+        timescaledb_db_name="postgres",
+        timescaledb_destination_table="aggregated_data"
+    )
+    checkpoint_path = str(tmp_path / "checkpoints.json")
+    summary = run_backfill(config, 0, 2 * DAY, processes=1, checkpoint_path=checkpoint_path)
+
+    assert (summary["done"], summary["failed"]) == (1, 1)
+    assert list(state.read_json(checkpoint_path).values()) == [[0]]
+
+
+@pytest.mark.parametrize("unique_key", [UPSERT_KEY, None])
+def test_unit_failed_after_a_written_batch_is_written_again_without_duplicates(tmp_path, monkeypatch, unique_key):
+    attempts = []
+
+    def cratedb_handler(sql_string, args):
+        if "DISTINCT" in sql_string:
+            return ["device_id", "datapoint"], [("d1", "power"), ("d2", "power")]
+        device_id = args[0][0]
+        if device_id == "d2" and not attempts:
+            attempts.append(device_id)
+            raise ConnectionError("CrateDB is unavailable")
+        return ["timestamp", "device_id", "datapoint", "value"], [(args[2], device_id, "power", 1.5)]
+
+    server = FakeTimescale(unique_key=unique_key)
+    monkeypatch.setattr(backfill, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(AltoCrateDB, "_connect", lambda self: FakeConnection(handler=cratedb_handler))
+    monkeypatch.setattr(AltoTimescaleDB, "_connect", lambda self: server.connect())
+
+    # Streaming one device at a time, d1 is written before the query of d2 fails
+    config = PipelineConfig(
+        cratedb_source_table="raw_data",
+        timescaledb_db_name="postgres",
+        timescaledb_destination_table="aggregated_data",
+        execution_mode="streaming",
+        extraction_batch_size=1,
+        timescaledb_write_mode="insert"
+    )
+    checkpoint_path = str(tmp_path / "checkpoints.json")
+    assert run_backfill(config, 0, DAY, processes=1, checkpoint_path=checkpoint_path)["failed"] == 1
+    assert [row["device_id"] for row in server.rows()] == ["d1"]
+
+    assert run_backfill(config, 0, DAY, processes=1, checkpoint_path=checkpoint_path)["done"] == 1
+    assert sorted(row["device_id"] for row in server.rows()) == ["d1", "d2"]
@@ -0,0 +1,81 @@
+import multiprocessing
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils import state
+from alto_academy_workshop.utils.catalog import DeviceCatalog
+from alto_academy_workshop.utils.database import AltoCrateDB
+from tests.fakes import FakeConnection
+
+
+class RawTable:
+    """ Rows (timestamp, device_id, datapoint) of a fake CrateDB table answering the queries of `DeviceCatalog` """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def handler(self, sql_string, args):
+        rows, counted_after = self.rows, None
+        if args:
+            counted_after, after = args
+            rows = [row for row in rows if row[0] > after]
+        groups = {}
+        for timestamp, device_id, datapoint in rows:
+            max_timestamp, count = groups.get((device_id, datapoint), (None, 0))
+            counted = counted_after is None or timestamp > counted_after
+            groups[(device_id, datapoint)] = (max(timestamp, max_timestamp or timestamp), count + counted)
+        return ["device_id", "datapoint", "max", "count"], [key + value for key, value in groups.items()]
+
+
+def _catalog(table: RawTable, path: str, **kwargs) -> DeviceCatalog:
+    cratedb = AltoCrateDB(pool_size=1)
+    cratedb._connect = lambda: FakeConnection(handler=table.handler)
+    return DeviceCatalog(cratedb=cratedb, path=path, **kwargs)
+
+
+def test_late_rows_within_the_grace_period_are_found_and_counted_once(tmp_path):
+    table = RawTable([(60_000, "d1", "power"), (120_000, "d1", "power")])
+    catalog = _catalog(table, str(tmp_path / "catalog.json"), grace_seconds=60)
+    assert catalog.get("raw_data") == {"d1": ["power"]}
+
+    # d2 arrives late, 30 seconds before the latest row already seen
+    table.rows += [(90_000, "d2", "power"), (180_000, "d1", "status")]
+    assert catalog.get("raw_data") == {"d1": ["power", "status"], "d2": ["power"]}
+    assert catalog.row_counts("raw_data") == {"d1": 3, "d2": 0}
+
+    table.rows += [(240_000, "d1", "power")]
+    catalog.get("raw_data")
+    assert catalog.row_counts("raw_data") == {"d1": 4, "d2": 0}
+
+
+def test_late_rows_before_the_grace_period_wait_for_the_rebuild(tmp_path):
+    table = RawTable([(120_000, "d1", "power")])
+    catalog = _catalog(table, str(tmp_path / "catalog.json"))
+    catalog.get("raw_data")
+
+    table.rows.append((90_000, "d2", "power"))
+    assert catalog.get("raw_data") == {"d1": ["power"]}
+    catalog.ttl_seconds = -1
+    assert catalog.get("raw_data") == {"d1": ["power"], "d2": ["power"]}
+
+
+def _lookup(path: str, table_name: str, runs: int):
+    catalog = _catalog(RawTable([(60_000, table_name, "power")]), path)
+    for _ in range(runs):
+        catalog.get(table_name)
+
+
+def test_concurrent_processes_keep_each_other_s_catalogs(tmp_path):
+    path = str(tmp_path / "catalog.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_lookup, args=(path, f"raw_data_{i}", 20)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert sorted(state.read_json(path)) == [f"raw_data_{i}" for i in range(4)]
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils import database
+from alto_academy_workshop.utils.database import AltoCrateDB
+from tests.fakes import FakeConnection
+
+COLUMNS = ["timestamp", "device_id", "datapoint", "value"]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(database.time, "sleep", lambda seconds: None)
+
+
+def _columns(sql_string, args):
+    if "information_schema.columns" in sql_string:
+        return ["column_name"], [(name,) for name in COLUMNS]
+    return None
+
+
+def _cratedb(bulk_handler, pool_size: int = 2):
+    """ AltoCrateDB on fake connections, with the list of the connections it opened """
+    connections = []
+
+    def connect():
+        connection = FakeConnection(handler=_columns, bulk_handler=bulk_handler)
+        connections.append(connection)
+        return connection
+
+    cratedb = AltoCrateDB(pool_size=pool_size)
+    cratedb._connect = connect
+    return cratedb, connections
+
+
+def _rows(n: int) -> list:
+    return [{"timestamp": i, "device_id": f"d{i}", "datapoint": "power", "value": i} for i in range(n)]
+
+
+def test_only_failed_rows_are_retried():
+    requests = []
+    failed_once = set()
+
+    def bulk(sql_string, rows):
+        requests.append([row[1] for row in rows])
+        results = []
+        for row in rows:
+            if row[3] % 3 == 0 and row[1] not in failed_once:
+                failed_once.add(row[1])
+                results.append({"rowcount": -2})
+            else:
+                results.append({"rowcount": 1})
+        return results
+
+    cratedb, _ = _cratedb(bulk)
+    summary = cratedb.insert_data("raw_data", _rows(10), batch_size=10)
+    cratedb.close()
+
+    assert summary == {"rows": 10, "inserted": 10, "failed": 0}
+    assert requests == [[f"d{i}" for i in range(10)], ["d0", "d3", "d6", "d9"]]
+
+
+def test_rows_failing_every_attempt_are_reported():
+    lock = threading.Lock()
+    attempts = []
+
+    def bulk(sql_string, rows):
+        with lock:
+            attempts.extend(row[1] for row in rows if row[1] == "d5")
+        return [{"rowcount": -2 if row[1] == "d5" else 1} for row in rows]
+
+    cratedb, _ = _cratedb(bulk)
+    summary = cratedb.insert_data("raw_data", _rows(25), batch_size=10, max_retries=2)
+    cratedb.close()
+
+    assert summary == {"rows": 25, "inserted": 24, "failed": 1}
+    assert attempts == ["d5"] * 3
+
+
+def test_failed_request_is_sent_again():
+    calls = []
+
+    def bulk(sql_string, rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise ConnectionError("connection reset")
+        return [{"rowcount": 1}] * len(rows)
+
+    cratedb, _ = _cratedb(bulk, pool_size=1)
+    summary = cratedb.insert_data("raw_data", _rows(5), batch_size=5)
+    cratedb.close()
+
+    assert summary == {"rows": 5, "inserted": 5, "failed": 0}
+    assert calls == [5, 5]
+
+
+def test_column_names_are_read_once_per_table():
+    cratedb, connections = _cratedb(lambda sql_string, rows: [{"rowcount": 1}] * len(rows), pool_size=1)
+    cratedb.insert_data("raw_data", _rows(3))
+    cratedb.insert_data("raw_data", _rows(3))
+    cratedb.close()
+
+    lookups = [sql for connection in connections for sql, _ in connection.statements if "information_schema" in sql]
+    inserts = [sql for connection in connections for sql, _ in connection.statements if sql.startswith("INSERT")]
+    assert len(lookups) == 1
+    assert inserts[0] == "INSERT INTO raw_data (timestamp,device_id,datapoint,value) VALUES (?,?,?,?)"
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils.database import AltoCrateDB
+from tests.fakes import FakeConnection
+
+# Many rows share a timestamp, more than a page holds
+ROWS = [(timestamp, f"d{i}", "temperature", str(i), f"id{timestamp}-{i:02d}")
+        for timestamp in (1000, 2000, 3000) for i in range(7)]
+
+
+def _paged_select(sql_string, args):
+    """ Answer the keyset pages of `iter_query` over ROWS, ordered by (timestamp, _id) """
+    rows = sorted(ROWS, key=lambda row: (row[0], row[4]))
+    *args, limit = args
+    if "timestamp > ? OR" in sql_string:
+        last_key, _, last_id = args[-3:]
+        rows = [row for row in rows if (row[0], row[4]) > (last_key, last_id)]
+    return ["timestamp", "device_id", "datapoint", "value", "_page_tiebreaker"], rows[:limit]
+
+
+def test_iter_query_reads_every_row_once():
+    connection = FakeConnection(handler=_paged_select)
+    cratedb = AltoCrateDB()
+    cratedb._connect = lambda: connection
+
+    chunks = list(cratedb.iter_query("raw_data", {"timestamp": {">=": 0}}, chunk_rows=5))
+
+    rows = [row for chunk in chunks for row in chunk]
+    assert [(row["timestamp"], row["device_id"]) for row in rows] == [(row[0], row[1]) for row in ROWS]
+    assert all("_page_tiebreaker" not in row for row in rows)
+    assert all("OFFSET" not in sql_string for sql_string, _ in connection.statements)
+    assert connection.statements[-1][1][-4:] == [3000, 3000, "id3000-05", 5]
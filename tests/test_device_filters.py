@@ -0,0 +1,17 @@
+from alto_academy_workshop.utils.filters import batch_device_filters, build_device_filters
+
+
+def test_batch_device_filters_merges_devices_of_the_same_window():
+    filter_list = build_device_filters({"d1": ["a"], "d2": ["a", "b"], "d3": ["c"]}, 10, 20)
+    batches = batch_device_filters(filter_list, batch_size=2)
+
+    assert [merged["device_id"]["IN"] for merged, _ in batches] == [["d1", "d2"], ["d3"]]
+    merged, wanted = batches[0]
+    assert merged["datapoint"] == {"IN": ["a", "b"]}
+    assert merged["timestamp"] == {">=": 10000, "<": 20000}
+    assert wanted == {("d1", "a"), ("d2", "a"), ("d2", "b")}
+
+
+def test_batch_device_filters_keeps_other_shapes():
+    other = {"timestamp": {">": 1}}
+    assert batch_device_filters([other, "not a filter"]) == [(other, None)]
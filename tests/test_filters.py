@@ -0,0 +1,42 @@
+from alto_academy_workshop.utils.filters import compile_filters, compile_query
+
+
+def test_compile_filters_binds_values():
+    conditions, args = compile_filters({
+        "device_id": {"IN": ["d1", "d2"]},
+        "timestamp": {">=": 100, "<": 200},
+    })
+    assert conditions == "device_id = ANY(?)\nAND timestamp >= ?\nAND timestamp < ?"
+    assert args == [["d1", "d2"], 100, 200]
+
+
+def test_compile_filters_text_only_depends_on_shape():
+    first, _ = compile_filters({"device_id": {"=": "d1"}, "timestamp": {">": 1}})
+    second, _ = compile_filters({"device_id": {"=": "d2"}, "timestamp": {">": 2}})
+    longer_list, _ = compile_filters({"device_id": {"IN": ["d1", "d2", "d3"]}})
+    shorter_list, _ = compile_filters({"device_id": {"IN": ["d1"]}})
+    assert first == second
+    assert longer_list == shorter_list
+
+
+def test_compile_filters_paramstyles():
+    filters = {"device_id": {"=": "d1"}, "datapoint": {"NOT IN": ["a"]}}
+    assert compile_filters(filters, "format")[0] == "device_id = %s\nAND NOT (datapoint = ANY(%s))"
+    assert compile_filters(filters, "numeric")[0] == "device_id = $1\nAND NOT (datapoint = ANY($2))"
+
+
+def test_compile_filters_skips_invalid_conditions():
+    conditions, args = compile_filters({
+        "device_id": {"=": None},
+        "datapoint": {"IN": "not a list"},
+        "timestamp": {"~": 1, "<=": 5},
+    })
+    assert conditions == "timestamp <= ?"
+    assert args == [5]
+
+
+def test_compile_query_without_filters():
+    assert compile_query("SELECT * FROM raw_data", {}) == ("SELECT * FROM raw_data", [])
+    assert compile_query("SELECT * FROM raw_data", {"value": {"like": "1%"}}) == (
+        "SELECT * FROM raw_data WHERE value LIKE ?", ["1%"]
+    )
@@ -0,0 +1,42 @@
+import math
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from alto_academy_workshop.utils.handoff import maybe_read, read_frame, write_frame
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_mixed_column_round_trip_keeps_none_and_nan(tmp_path, fmt):
+    frame = pd.DataFrame({
+        "aggregation_type": ["avg_1min", "mode_1min", "mode_1min", "avg_1min"],
+        "value": [1.5, "on", None, float("nan")],
+    })
+
+    handle = write_frame(frame, fmt=fmt, directory=str(tmp_path))
+    assert handle["mixed_columns"] == ["value"]
+
+    values = read_frame(handle)["value"].tolist()
+    assert values[:3] == [1.5, "on", None]
+    assert math.isnan(values[3])
+    assert list(read_frame(handle).columns) == ["aggregation_type", "value"]
+
+
+def test_numeric_strings_stay_text_and_missing_values_come_back_as_none(tmp_path):
+    frame = pd.DataFrame({"value": [2.0, "25", pd.NA, 7]})
+
+    handle = write_frame(frame, directory=str(tmp_path))
+
+    assert read_frame(handle)["value"].tolist() == [2.0, "25", None, 7.0]
+
+
+def test_consumer_deletes_the_file_once_read(tmp_path):
+    handle = write_frame(pd.DataFrame({"value": [1.0, 2.0]}), directory=str(tmp_path))
+
+    frame = maybe_read(handle, delete=True)
+
+    assert frame["value"].tolist() == [1.0, 2.0]
+    assert list(tmp_path.iterdir()) == []
+    assert maybe_read(frame, delete=True) is frame
@@ -0,0 +1,46 @@
+from alto_academy_workshop.utils.metrics import PrometheusTextfileSink, _read_textfile
+
+
+def test_prometheus_label_values_are_escaped(tmp_path):
+    path = tmp_path / "alto.prom"
+    sink = PrometheusTextfileSink(str(path))
+    sink.emit({"metric": "block", "labels": {"block": 'C:\\blocks\\"export"\nnext'}, "seconds": 1.5})
+
+    lines = path.read_text().splitlines()
+    assert 'alto_block_last_seconds{block="C:\\\\blocks\\\\\\"export\\"\\nnext"} 1.5' in lines
+    assert len(lines) == 5
+
+
+def _event(seconds: float, **fields) -> dict:
+    return {"metric": "db_call", "labels": {"method": "query_data"}, "seconds": seconds, **fields}
+
+
+def test_processes_writing_the_same_file_add_up_their_totals(tmp_path):
+    path = str(tmp_path / "alto.prom")
+    # One sink per process
+    sinks = [PrometheusTextfileSink(path, flush_seconds=0) for _ in range(2)]
+
+    sinks[0].emit(_event(1.0, rows=10))
+    sinks[1].emit(_event(2.0, rows=5))
+    sinks[0].emit(_event(0.5, rows=1, error="ConnectionError"))
+
+    series = _read_textfile(path)
+    assert series['alto_db_call_total{method="query_data",status="ok"}'] == 2
+    assert series['alto_db_call_total{method="query_data",status="error"}'] == 1
+    assert series['alto_db_call_rows_total{method="query_data"}'] == 16
+    assert series['alto_db_call_seconds_total{method="query_data"}'] == 3.5
+    assert series['alto_db_call_last_seconds{method="query_data"}'] == 0.5
+
+
+def test_writes_are_throttled(tmp_path):
+    path = tmp_path / "alto.prom"
+    sink = PrometheusTextfileSink(str(path), flush_seconds=3600)
+
+    sink.emit(_event(1.0))
+    written = path.read_text()
+    sink.emit(_event(2.0))
+    sink.emit(_event(3.0))
+    assert path.read_text() == written
+
+    sink.flush()
+    assert _read_textfile(str(path))['alto_db_call_total{method="query_data",status="ok"}'] == 3
@@ -0,0 +1,56 @@
+import struct
+from datetime import datetime, timezone
+
+import pandas as pd
+import pendulum
+
+from alto_academy_workshop.utils import pgcopy
+
+COLUMN_TYPES = ["character varying", "double precision", "text"]
+
+
+def test_encode_text_writes_nan_as_null_in_text_columns():
+    rows = [("d1", float("nan"), float("nan")), ("d2", 1.5, "on")]
+    buffer = pgcopy.encode_text(rows, COLUMN_TYPES)
+    assert buffer.getvalue() == "d1\tNaN\t\\N\nd2\t1.5\ton\n"
+
+
+def test_encode_text_keeps_nan_without_column_types():
+    assert pgcopy.encode_text([(float("nan"), None)]).getvalue() == "NaN\t\\N\n"
+
+
+def test_encode_binary_writes_nan_as_null_in_text_columns():
+    encoders = pgcopy.binary_encoders(COLUMN_TYPES)
+    rows = [("d1", float("nan"), float("nan"))]
+    data = pgcopy.encode_binary(rows, encoders, COLUMN_TYPES).getvalue()
+    assert data.endswith(struct.pack("!i", -1) + struct.pack("!h", -1))
+    assert data.count(struct.pack("!d", float("nan"))) == 1
+
+
+def test_pandas_missing_values_are_null():
+    rows = [(pd.NA, pd.NaT, "on")]
+    assert pgcopy.encode_text(rows).getvalue() == "\\N\t\\N\ton\n"
+    encoders = pgcopy.binary_encoders(["double precision", "timestamp with time zone", "text"])
+    assert pgcopy.encode_binary(rows, encoders).getvalue().count(struct.pack("!i", -1)) == 2
+
+
+def test_pendulum_datetimes_are_encoded_like_datetimes():
+    moment = pendulum.datetime(2024, 1, 1, 7, 30, 0, 250, tz="Asia/Bangkok")
+    plain = datetime(2024, 1, 1, 0, 30, 0, 250, tzinfo=timezone.utc)
+    assert pgcopy._encode_timestamptz(moment) == pgcopy._encode_timestamptz(plain)
+    assert pgcopy._encode_timestamptz(pd.Timestamp(plain)) == pgcopy._encode_timestamptz(plain)
+    assert pgcopy._encode_timestamp(moment) == pgcopy._encode_timestamp(datetime(2024, 1, 1, 7, 30, 0, 250))
+
+    encoders = pgcopy.binary_encoders(["timestamp with time zone"])
+    assert pgcopy.encode_binary([(moment,)], encoders).getvalue() == pgcopy.encode_binary([(plain,)], encoders).getvalue()
+
+
+def test_naive_datetimes_are_utc_in_both_formats():
+    column_types = ["timestamp with time zone", "timestamp without time zone"]
+    naive = datetime(2024, 1, 1, 0, 30)
+    assert pgcopy.encode_text([(naive, naive)], column_types).getvalue() == \
+        "2024-01-01T00:30:00+00:00\t2024-01-01T00:30:00\n"
+
+    encoders = pgcopy.binary_encoders(column_types)
+    assert pgcopy.encode_binary([(naive, naive)], encoders, column_types).getvalue() == \
+        pgcopy.encode_binary([(naive.replace(tzinfo=timezone.utc), naive)], encoders, column_types).getvalue()
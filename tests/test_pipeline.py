@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils.database import AltoCrateDB, AltoTimescaleDB
+from alto_academy_workshop.utils.pipeline import PipelineConfig, run_pipelined, stream_window
+from alto_academy_workshop.utils.watermark import FileWatermarkStore
+from benchmarks.run import load_block
+from tests.fakes import FakeConnection, timescaledb_handler
+
+
+def _failing_extraction(sql_string, args):
+    if "DISTINCT" in sql_string:
+        return ["device_id", "datapoint"], [("d1", "power")]
+    raise ConnectionError("CrateDB is unavailable")
+
+
+@pytest.fixture
+def inserts(monkeypatch):
+    """ Make CrateDB fail every data query and record the statements sent to TimescaleDB """
+    timescaledb_connections = []
+
+    def timescaledb_connect(self):
+        connection = FakeConnection()
+        timescaledb_connections.append(connection)
+        return connection
+
+    monkeypatch.setattr(AltoCrateDB, "_connect", lambda self: FakeConnection(handler=_failing_extraction))
+    monkeypatch.setattr(AltoTimescaleDB, "_connect", timescaledb_connect)
+    return timescaledb_connections
+
+
+def _kwargs(tmp_path):
+    return {
+        "cratedb_source_table": "raw_data",
+        "timescaledb_db_name": "postgres",
+        "timescaledb_destination_table": "aggregated_data",
+        "interval_start_datetime": datetime.fromtimestamp(7200, tz=timezone.utc),
+        "query_period_seconds": 3600,
+        "extraction_mode": "incremental",
+        "watermark_path": str(tmp_path / "watermarks.json"),
+    }
+
+
+def test_stream_window_raises_on_query_errors(tmp_path, inserts):
+    config = PipelineConfig.from_kwargs(**_kwargs(tmp_path))
+    with pytest.raises(ConnectionError):
+        stream_window(config, 3600, 7200)
+    assert inserts == []
+
+
+def test_stream_block_does_not_commit_a_failed_window(tmp_path, inserts):
+    kwargs = _kwargs(tmp_path)
+    FileWatermarkStore(path=kwargs["watermark_path"]).set("raw_data", 3600)
+
+    stream = load_block("custom/stream_cratedb2timescaledb.py", "stream")
+    with pytest.raises(ConnectionError):
+        stream(**kwargs)
+    assert FileWatermarkStore(path=kwargs["watermark_path"]).get("raw_data") == 3600
+
+
+def test_pipelined_run_stops_at_a_failed_extraction(monkeypatch):
+    def cratedb_handler(sql_string, args):
+        if "DISTINCT" in sql_string:
+            return ["device_id", "datapoint"], [("d1", "power")]
+        start_ms = args[2]
+        if start_ms == 6120 * 1000:
+            raise ConnectionError("CrateDB is unavailable")
+        return ["timestamp", "device_id", "datapoint", "value"], [(start_ms, "d1", "power", 1.5)]
+
+    copies = []
+
+    def timescaledb_connect(self):
+        connection = FakeConnection(handler=timescaledb_handler)
+        copies.append(connection)
+        return connection
+
+    monkeypatch.setattr(AltoCrateDB, "_connect", lambda self: FakeConnection(handler=cratedb_handler))
+    monkeypatch.setattr(AltoTimescaleDB, "_connect", timescaledb_connect)
+
+    written = []
+    config = PipelineConfig(
+        cratedb_source_table="raw_data",
+        timescaledb_db_name="postgres",
+        timescaledb_destination_table="aggregated_data"
+    )
+    with pytest.raises(ConnectionError):
+        run_pipelined(config, 6000, 60, end_timestamp=6240, on_written=lambda start, end: written.append((start, end)))
+
+    # The windows before the failed one are written and committed, the failed and later ones are not
+    assert written == [(6000, 6060), (6060, 6120)]
+    copied = [sql for connection in copies for sql, _ in connection.statements if sql.startswith("COPY")]
+    assert len(copied) == 2
+
+
+def test_window_without_data_has_no_devices():
+    connection = FakeConnection(handler=lambda sql_string, args: (["device_id", "datapoint"], []))
+    cratedb = AltoCrateDB(pool_size=1)
+    cratedb._connect = lambda: connection
+
+    assert cratedb.get_unique_deviceid_datapoint("raw_data", 6000 * 1000, 6060 * 1000) == {}
+    # One query, bounded by the window: the pairs of the whole table are not read instead
+    assert [args for sql, args in connection.statements if "DISTINCT" in sql] == [[6000 * 1000, 6060 * 1000]]
@@ -0,0 +1,156 @@
+import threading
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+psycopg2 = pytest.importorskip("psycopg2")
+
+import psycopg2.errors
+
+from alto_academy_workshop.utils.database import AltoTimescaleDB
+from alto_academy_workshop.utils.pool import ConnectionPool, PoolClosedError, PoolTimeoutError
+from tests.fakes import FakeConnection
+
+
+class Connections:
+    """ Factory of fake connections remembering every connection it opened """
+
+    def __init__(self, handler=None):
+        self.handler = handler
+        self.opened = []
+
+    def __call__(self):
+        connection = FakeConnection(handler=self.handler)
+        self.opened.append(connection)
+        return connection
+
+
+def test_idle_connections_are_reused_most_recently_used_first():
+    connections = Connections()
+    pool = ConnectionPool(connect=connections, max_size=2)
+
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    assert pool.acquire() is second
+    assert pool.acquire() is first
+    assert len(connections.opened) == 2
+
+
+def test_acquire_waits_for_a_released_connection_and_times_out():
+    pool = ConnectionPool(connect=Connections(), max_size=1, timeout=0.05)
+    connection = pool.acquire()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+
+    threading.Timer(0.01, pool.release, [connection]).start()
+    pool.timeout = 5
+    assert pool.acquire() is connection
+
+
+def test_idle_connections_are_checked_and_broken_ones_replaced():
+    connections = Connections()
+    checked = []
+    pool = ConnectionPool(connect=connections, check=lambda c: checked.append(c) or c is not connections.opened[0],
+                          check_interval=0)
+
+    broken = pool.acquire()
+    pool.release(broken)
+    connection = pool.acquire()
+
+    assert checked == [broken]
+    assert broken.closed and connection is connections.opened[1]
+    assert pool.size == 1
+
+
+def test_connections_are_checked_after_a_failed_borrower_only():
+    checked = []
+    pool = ConnectionPool(connect=Connections(), check=lambda c: checked.append(c) or True, check_interval=3600)
+
+    with pool.connection():
+        pass
+    with pytest.raises(RuntimeError):
+        with pool.connection():
+            raise RuntimeError("query failed")
+    assert checked == []
+
+    with pool.connection() as connection:
+        assert checked == [connection]
+    with pool.connection():
+        pass
+    assert checked == [connection]
+
+
+def test_connections_that_cannot_be_reset_are_discarded():
+    connections = Connections()
+
+    def reset(connection):
+        if connection is connections.opened[0]:
+            raise psycopg2.InterfaceError("connection already closed")
+
+    pool = ConnectionPool(connect=connections, reset=reset)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first.closed and not second.closed
+    assert pool.acquire() is second
+
+
+def test_info_lives_as_long_as_the_connection():
+    connections = Connections()
+    pool = ConnectionPool(connect=connections, check=lambda c: not c.closed, check_interval=0)
+
+    with pool.connection() as connection:
+        pool.info(connection)["prepared"] = {"alto_1"}
+    with pool.connection() as connection:
+        assert pool.info(connection) == {"prepared": {"alto_1"}}
+        connection.closed = 1
+
+    with pool.connection() as connection:
+        assert connection is connections.opened[1]
+        assert pool.info(connection) == {}
+
+
+def test_closed_pool_closes_released_connections_and_refuses_new_borrowers():
+    pool = ConnectionPool(connect=Connections(), max_size=2)
+    idle, borrowed = pool.acquire(), pool.acquire()
+    pool.release(idle)
+
+    pool.close()
+    assert idle.closed and not borrowed.closed
+    pool.release(borrowed)
+    assert borrowed.closed and pool.size == 0
+    with pytest.raises(PoolClosedError):
+        pool.acquire()
+
+
+def test_timescaledb_prepares_again_on_a_replaced_connection():
+    restarts = []
+
+    def handler(sql_string, args):
+        if restarts and restarts.pop() is connections.opened[-1]:
+            connections.opened[-1].closed = 1
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if sql_string.startswith("EXECUTE"):
+            return ["timestamp", "value"], [("2024-01-01 00:00:00+00", 1.0)]
+        return None
+
+    connections = Connections(handler)
+    timescaledb = AltoTimescaleDB(db_name="postgres", pool_size=1)
+    timescaledb._connect = connections
+    filters = {"device_id": {"=": "d1"}}
+
+    timescaledb.query_data("aggregated_data", filters)
+    restarts.append(connections.opened[0])  # The server restarts before the next query
+    with pytest.raises(psycopg2.OperationalError):
+        timescaledb.query_data("aggregated_data", filters)
+    rows = timescaledb.query_data("aggregated_data", filters)
+
+    assert len(rows) == 1 and len(connections.opened) == 2
+    prepares = [[sql for sql, _ in c.statements if sql.startswith("PREPARE")] for c in connections.opened]
+    assert len(prepares[0]) == 1 and prepares[1] == prepares[0]
@@ -0,0 +1,112 @@
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+psycopg2 = pytest.importorskip("psycopg2")
+
+import psycopg2.errors
+
+from alto_academy_workshop.utils.database import AltoTimescaleDB
+from tests.fakes import FakeConnection
+
+
+class FakePostgres(FakeConnection):
+    """ Fake PostgreSQL session: prepared statements outlive transactions, errors abort the transaction """
+
+    def __init__(self):
+        super().__init__(handler=self.handle)
+        self.prepared = set()
+        self.aborted = False
+
+    def handle(self, sql_string, args):
+        if self.aborted and not sql_string.startswith("ROLLBACK"):
+            raise psycopg2.errors.InFailedSqlTransaction("current transaction is aborted")
+        try:
+            return self._handle(sql_string, args)
+        except psycopg2.Error:
+            self.aborted = True
+            raise
+
+    def _handle(self, sql_string, args):
+        if sql_string.startswith("ROLLBACK TO SAVEPOINT"):
+            self.aborted = False
+        elif sql_string.startswith("PREPARE"):
+            name = sql_string.split()[1]
+            if name in self.prepared:
+                raise psycopg2.errors.DuplicatePreparedStatement(f'prepared statement "{name}" already exists')
+            self.prepared.add(name)
+        elif sql_string.startswith("EXECUTE"):
+            if sql_string.split()[1] not in self.prepared:
+                raise psycopg2.errors.InvalidSqlStatementName("prepared statement does not exist")
+            if args and args[0] == "not a date":
+                raise psycopg2.errors.InvalidDatetimeFormat("invalid input syntax for type timestamp")
+            return ["timestamp", "value"], [("2024-01-01 00:00:00+00", 1.0)]
+        return None
+
+    def rollback(self):
+        self.aborted = False
+
+
+def _timescaledb(connection):
+    timescaledb = AltoTimescaleDB(db_name="postgres", pool_size=1)
+    timescaledb._connect = lambda: connection
+    return timescaledb
+
+
+def _statements(connection, prefix):
+    return [sql for sql, _ in connection.statements if sql.startswith(prefix)]
+
+
+def test_failed_execute_is_followed_by_a_successful_one():
+    connection = FakePostgres()
+    timescaledb = _timescaledb(connection)
+
+    with pytest.raises(psycopg2.errors.InvalidDatetimeFormat):
+        timescaledb.query_data("aggregated_data", {"timestamp": {">=": "not a date"}})
+    rows = timescaledb.query_data("aggregated_data", {"timestamp": {">=": "2024-01-01"}})
+    rows += timescaledb.query_data("aggregated_data", {"timestamp": {">=": "2024-01-02"}})
+
+    assert [row["value"] for row in rows] == [1.0, 1.0]
+    assert len(_statements(connection, "PREPARE")) == 1
+    assert len(_statements(connection, "EXECUTE")) == 3
+
+
+def test_statement_prepared_already_is_executed():
+    connection = FakePostgres()
+    timescaledb = _timescaledb(connection)
+    timescaledb.query_data("aggregated_data", {"device_id": {"=": "d1"}})
+
+    # The bookkeeping of the connection is lost, but the statement still exists in the session
+    with timescaledb.pool.connection() as borrowed:
+        timescaledb.pool.info(borrowed)["prepared"].clear()
+    rows = timescaledb.query_data("aggregated_data", {"device_id": {"=": "d2"}})
+
+    assert len(rows) == 1
+    assert len(_statements(connection, "PREPARE")) == 2
+    assert len(_statements(connection, "ROLLBACK TO SAVEPOINT")) == 1
+
+
+def test_statement_on_an_altered_table_is_prepared_again():
+    connection = FakePostgres()
+    timescaledb = _timescaledb(connection)
+    timescaledb.query_data("aggregated_data", {"device_id": {"=": "d1"}})
+
+    # A column was added to the table, so the plan of the 'SELECT *' statement is stale
+    stale = set(connection.prepared)
+    handle = connection._handle
+
+    def _handle(sql_string, args):
+        if sql_string.startswith("EXECUTE") and sql_string.split()[1] in stale:
+            raise psycopg2.errors.FeatureNotSupported("cached plan must not change result type")
+        if sql_string.startswith("DEALLOCATE"):
+            connection.prepared.discard(sql_string.split()[1])
+            stale.discard(sql_string.split()[1])
+        return handle(sql_string, args)
+
+    connection._handle = _handle
+    rows = timescaledb.query_data("aggregated_data", {"device_id": {"=": "d2"}})
+
+    assert len(rows) == 1
+    assert len(_statements(connection, "DEALLOCATE")) == 1
+    assert len(_statements(connection, "PREPARE")) == 2
+    assert len(_statements(connection, "EXECUTE")) == 3
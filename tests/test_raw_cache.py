@@ -0,0 +1,136 @@
+import os
+import re
+from types import SimpleNamespace
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils import raw_cache
+from alto_academy_workshop.utils.database import AltoCrateDB
+from alto_academy_workshop.utils.filters import compile_query
+from alto_academy_workshop.utils.raw_cache import RawDataCache
+from tests.fakes import FakeConnection
+
+HOUR_MS = 3600 * 1000
+NOW_MS = 100 * HOUR_MS + 30 * 60 * 1000  # Half past the hour
+
+# One row per device, datapoint and 10 minutes over the last 5 hours
+ROWS = [(ts, device_id, datapoint, float(ts // HOUR_MS))
+        for ts in range(95 * HOUR_MS, NOW_MS, 10 * 60 * 1000)
+        for device_id in ("d1", "d2")
+        for datapoint in ("power", "status")]
+
+_CONDITION = re.compile(r"^(\w+) (= ANY\(\?\)|=|>=|<) ?\??$")
+
+
+def raw_data_handler(sql_string, args):
+    """ Handler of a fake CrateDB connection answering the queries of `compile_query` from ROWS """
+    conditions = sql_string.split(" WHERE ")[1].split("\nAND ")
+    rows = ROWS
+    for condition, value in zip(conditions, args):
+        column, oper = _CONDITION.match(condition).groups()
+        i = ["timestamp", "device_id", "datapoint", "value"].index(column)
+        if oper == "= ANY(?)":
+            rows = [row for row in rows if row[i] in value]
+        elif oper == "=":
+            rows = [row for row in rows if row[i] == value]
+        elif oper == ">=":
+            rows = [row for row in rows if row[i] >= value]
+        else:
+            rows = [row for row in rows if row[i] < value]
+    return ["timestamp", "device_id", "datapoint", "value"], rows
+
+
+@pytest.fixture
+def connection():
+    return FakeConnection(handler=raw_data_handler)
+
+
+@pytest.fixture
+def cratedb(tmp_path, monkeypatch, connection):
+    """ CrateDB with a cache of 1 hour buckets closed 10 minutes after their end, at NOW_MS """
+    monkeypatch.setattr(raw_cache, "time", SimpleNamespace(time=lambda: NOW_MS / 1000))
+    cache = RawDataCache(directory=str(tmp_path), bucket_seconds=3600, grace_seconds=600)
+    cratedb = AltoCrateDB(cache=cache, pool_size=1)
+    cratedb._connect = lambda: connection
+    return cratedb
+
+
+def _expected(filters: dict) -> pd.DataFrame:
+    _, rows = raw_data_handler(*compile_query("SELECT * FROM raw_data", filters))
+    return pd.DataFrame(rows, columns=["timestamp", "device_id", "datapoint", "value"])
+
+
+def _sorted(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.sort_values(["timestamp", "device_id", "datapoint"]).reset_index(drop=True)
+
+
+def _queries(connection) -> list:
+    return [args for sql, args in connection.statements if sql.startswith("SELECT * FROM")]
+
+
+def test_closed_buckets_are_fetched_once_and_the_open_part_every_time(cratedb, connection):
+    filters = {"device_id": {"IN": ["d1", "d2"]}, "datapoint": {"=": "power"},
+               "timestamp": {">=": 96 * HOUR_MS + 1, "<": NOW_MS}}
+
+    first = cratedb.query_data("raw_data", filters, as_frame=True)
+    second = cratedb.query_data("raw_data", filters, as_frame=True)
+
+    pd.testing.assert_frame_equal(_sorted(first), _sorted(_expected(filters)))
+    pd.testing.assert_frame_equal(_sorted(second), _sorted(first))
+    queries = _queries(connection)
+    # Buckets 96 to 99 are closed: one query each, for both devices and every datapoint
+    assert queries[:4] == [[["d1", "d2"], hour * HOUR_MS, (hour + 1) * HOUR_MS] for hour in range(96, 100)]
+    # Bucket 100 is still open, so it is fetched with the requested datapoint on both runs
+    assert queries[4:] == [[["d1", "d2"], "power", 100 * HOUR_MS, NOW_MS]] * 2
+
+
+def test_buckets_in_the_grace_period_are_cached_once_closed(cratedb, connection, monkeypatch):
+    filters = {"device_id": {"=": "d1"}, "timestamp": {">=": 99 * HOUR_MS, "<": 100 * HOUR_MS}}
+    monkeypatch.setattr(raw_cache, "time", SimpleNamespace(time=lambda: (100 * HOUR_MS + 5 * 60 * 1000) / 1000))
+
+    cratedb.query_data("raw_data", filters)
+    cratedb.query_data("raw_data", filters)
+    assert len(_queries(connection)) == 2
+    assert not os.path.exists(cratedb.cache._path("raw_data", "d1", 99 * HOUR_MS))
+
+    monkeypatch.setattr(raw_cache, "time", SimpleNamespace(time=lambda: NOW_MS / 1000))
+    cratedb.query_data("raw_data", filters)
+    rows = cratedb.query_data("raw_data", filters)
+    assert len(_queries(connection)) == 3
+    assert len(rows) == 12 and os.path.exists(cratedb.cache._path("raw_data", "d1", 99 * HOUR_MS))
+
+
+def test_least_recently_used_buckets_are_evicted(cratedb):
+    cache = cratedb.cache
+    for hour in (96, 97, 98):
+        cratedb.query_data("raw_data", {"device_id": {"=": "d1"}, "timestamp": {">=": hour * HOUR_MS, "<": (hour + 1) * HOUR_MS}})
+    paths = [cache._path("raw_data", "d1", hour * HOUR_MS) for hour in (96, 97, 98)]
+    for age, path in zip((300, 200, 100), paths):
+        os.utime(path, (os.path.getmtime(path) - age, os.path.getmtime(path) - age))
+
+    # Reading the oldest bucket makes it the most recently used
+    cratedb.query_data("raw_data", {"device_id": {"=": "d1"}, "timestamp": {">=": 96 * HOUR_MS, "<": 97 * HOUR_MS}})
+    cache.max_bytes = sum(os.path.getsize(path) for path in paths) - 1
+
+    assert cache.evict() == 1
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+
+
+def test_failed_fetch_is_not_cached(cratedb, connection):
+    filters = {"device_id": {"=": "d1"}, "timestamp": {">=": 96 * HOUR_MS, "<": 97 * HOUR_MS}}
+
+    def failing_handler(sql_string, args):
+        raise ConnectionError("CrateDB is unavailable")
+
+    connection.handler = failing_handler
+    with pytest.raises(ConnectionError):
+        cratedb.query_data("raw_data", filters)
+    assert not os.path.exists(cratedb.cache._path("raw_data", "d1", 96 * HOUR_MS))
+
+    connection.handler = raw_data_handler
+    assert len(cratedb.query_data("raw_data", filters)) == 12
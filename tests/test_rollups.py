@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils import backfill
+from alto_academy_workshop.utils.backfill import run_backfill
+from alto_academy_workshop.utils.database import AltoCrateDB, AltoTimescaleDB, rollup_name
+from alto_academy_workshop.utils.pipeline import PipelineConfig
+from tests.fakes import FakeConnection, timescaledb_handler
+
+DAY = 86400
+
+# Rows of timescaledb_information.continuous_aggregates joined with the refresh policies, children first
+ROLLUPS = [
+    ("aggregated_data_1h", "_materialized_15min", "_materialized_1h", True, timedelta(hours=1), {}),
+    ("aggregated_data_15min", "aggregated_data", "_materialized_15min", True, timedelta(minutes=15), {}),
+]
+
+
+def rollups_handler(sql_string, args):
+    if "timescaledb_information.continuous_aggregates" in sql_string:
+        return ["view_name", "hypertable_name", "materialization_hypertable_name", "materialized_only",
+                "schedule_interval", "config"], ROLLUPS
+    return timescaledb_handler(sql_string, args)
+
+
+def _timescaledb(connection) -> AltoTimescaleDB:
+    timescaledb = AltoTimescaleDB(db_name="postgres", pool_size=1)
+    timescaledb._connect = lambda: connection
+    return timescaledb
+
+
+@pytest.mark.parametrize("resolution, name", [
+    ("15min", "aggregated_data_15min"),
+    ("1h", "aggregated_data_1h"),
+    ("60min", "aggregated_data_1h"),
+    ("1d", "aggregated_data_1d"),
+    ("1 day", "aggregated_data_1d"),
+    ("90min", "aggregated_data_90min"),
+    (30, "aggregated_data_30sec"),
+])
+def test_rollups_are_named_after_the_normalised_resolution(resolution, name):
+    assert rollup_name("aggregated_data", resolution) == name
+
+
+def test_rollups_are_refreshed_over_whole_buckets_parents_first():
+    connection = FakeConnection(handler=rollups_handler)
+
+    view_names = _timescaledb(connection).refresh_rollups("aggregated_data", 1000, 5000)
+
+    assert view_names == ["aggregated_data_15min", "aggregated_data_1h"]
+    refreshes = [args for sql, args in connection.statements if sql.startswith("CALL refresh_continuous_aggregate")]
+    assert refreshes == [["aggregated_data_15min", 900, 5400], ["aggregated_data_1h", 0, 7200]]
+    assert connection.autocommit is False
+
+
+def test_backfill_refreshes_the_rollups_over_the_written_units(tmp_path, monkeypatch):
+    def cratedb_handler(sql_string, args):
+        if "DISTINCT" in sql_string:
+            return ["device_id", "datapoint"], [("d1", "power")]
+        return ["timestamp", "device_id", "datapoint", "value"], [(args[2], "d1", "power", 1.5)]
+
+    connections = []
+
+    def timescaledb_connect(self):
+        connections.append(FakeConnection(handler=rollups_handler))
+        return connections[-1]
+
+    monkeypatch.setattr(backfill, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(AltoCrateDB, "_connect", lambda self: FakeConnection(handler=cratedb_handler))
+    monkeypatch.setattr(AltoTimescaleDB, "_connect", timescaledb_connect)
+
+    config = PipelineConfig(
+        cratedb_source_table="raw_data",
+        timescaledb_db_name="postgres",
+        timescaledb_destination_table="aggregated_data"
+    )
+    summary = run_backfill(config, DAY, 3 * DAY, processes=1, checkpoint_path=str(tmp_path / "checkpoints.json"))
+
+    assert summary["rollups"] == ["aggregated_data_15min", "aggregated_data_1h"]
+    refreshes = [args for connection in connections for sql, args in connection.statements
+                 if sql.startswith("CALL refresh_continuous_aggregate")]
+    assert refreshes == [["aggregated_data_15min", DAY, 3 * DAY], ["aggregated_data_1h", DAY, 3 * DAY]]
+
+
+def test_each_rollup_is_computed_from_the_previous_one():
+    connection = FakeConnection(handler=rollups_handler)
+
+    view_names = _timescaledb(connection).create_rollups("aggregated_data", ["15min", "1h", "1d"])
+
+    assert view_names == ["aggregated_data_15min", "aggregated_data_1h", "aggregated_data_1d"]
+    views = [sql for sql, _ in connection.statements if sql.startswith("CREATE MATERIALIZED VIEW")]
+    assert [view.split()[6] for view in views] == view_names
+    assert "FROM aggregated_data\n" in views[0] and "aggregation_type LIKE 'mean%'" in views[0]
+    assert "FROM aggregated_data_15min" in views[1] and "SUM(value_count)" in views[1]
+    assert "FROM aggregated_data_1h" in views[2]
+
+    policies = [sql for sql, _ in connection.statements if "add_continuous_aggregate_policy" in sql]
+    assert "start_offset => INTERVAL '2700 seconds'" in policies[0]
+    assert "end_offset => INTERVAL '86400 seconds'" in policies[2]
+    refreshes = [sql for sql, _ in connection.statements if sql.startswith("CALL refresh_continuous_aggregate")]
+    assert len(refreshes) == 3 and connection.autocommit is False
+
+
+@pytest.mark.parametrize("resolutions", [["1h", "15min"], ["15min", "20min"]])
+def test_resolutions_that_do_not_nest_are_rejected(resolutions):
+    connection = FakeConnection(handler=rollups_handler)
+
+    with pytest.raises(ValueError):
+        _timescaledb(connection).create_rollups("aggregated_data", resolutions)
+    assert connection.statements == []
+
+
+def test_rollup_is_queried_with_a_prepared_statement_on_its_view():
+    def handler(sql_string, args):
+        if sql_string.startswith("EXECUTE"):
+            return ["timestamp", "device_id", "datapoint", "value", "value_min", "value_max", "value_count"], [
+                ("2024-01-01 00:00:00+00", "d1", "power", 2.5, 1.0, 4.0, 4),
+            ]
+        return None
+
+    connection = FakeConnection(handler=handler)
+    rows = _timescaledb(connection).query_rollup(
+        "aggregated_data", "60min", {"device_id": {"=": "d1"}, "timestamp": {">=": "2024-01-01"}}, as_frame=True
+    )
+
+    assert rows.to_dict("records") == [{"timestamp": "2024-01-01 00:00:00+00", "device_id": "d1", "datapoint": "power",
+                                        "value": 2.5, "value_min": 1.0, "value_max": 4.0, "value_count": 4}]
+    prepare = next(sql for sql, _ in connection.statements if sql.startswith("PREPARE"))
+    assert "value_sum / NULLIF(value_count, 0) AS value" in prepare and "FROM aggregated_data_1h" in prepare
+    assert [args for sql, args in connection.statements if sql.startswith("EXECUTE")] == [["d1", "2024-01-01"]]
@@ -0,0 +1,51 @@
+import subprocess
+import sys
+
+from alto_academy_workshop.utils.filters import build_device_filters
+from alto_academy_workshop.utils.sharding import assign_shards, dynamic_block_output, shard_filters, stable_hash
+
+DEVICE_IDS = [f"device_{i}" for i in range(200)]
+
+
+def test_hash_is_stable_across_processes():
+    script = "from alto_academy_workshop.utils.sharding import stable_hash; print(stable_hash('device_1'))"
+    outputs = {subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                              env={"PYTHONHASHSEED": seed}).stdout.strip() for seed in ("1", "2")}
+    assert outputs == {str(stable_hash("device_1"))}
+
+
+def test_devices_keep_their_shard_when_devices_are_added():
+    before = assign_shards(DEVICE_IDS[:100], 4)
+    after = assign_shards(DEVICE_IDS, 4)
+
+    assert all(after[device_id] == shard for device_id, shard in before.items())
+    assert set(after.values()) == {0, 1, 2, 3}
+
+
+def test_row_counts_balance_the_shards_within_one_device():
+    row_counts = {device_id: (i % 7 + 1) * 1000 for i, device_id in enumerate(DEVICE_IDS)}
+    row_counts["device_0"] = 50_000
+
+    shards = assign_shards(DEVICE_IDS, 4, row_counts)
+
+    loads = [sum(row_counts[d] for d, shard in shards.items() if shard == i) for i in range(4)]
+    assert max(loads) - min(loads) <= max(row_counts.values())
+    assert shards == assign_shards(list(reversed(DEVICE_IDS)), 4, row_counts)
+
+
+def test_devices_without_a_row_count_weigh_as_much_as_the_average_device():
+    shards = assign_shards(["big", "small", "new"], 2, {"big": 300, "small": 100})
+
+    # 'new' weighs 200, so it joins 'small' rather than 'big'
+    assert shards["big"] != shards["small"] == shards["new"]
+
+
+def test_filters_are_split_into_non_empty_shards():
+    filter_list = build_device_filters({"d1": ["power"], "d2": ["power"], "d3": ["power"]}, 0, 60)
+
+    shards = shard_filters(filter_list, 8, {"d1": 10, "d2": 10, "d3": 10})
+    items, metadata = dynamic_block_output(shards)
+
+    assert sorted(f["device_id"]["="] for shard in items for f in shard) == ["d1", "d2", "d3"]
+    assert [len(shard) for shard in items] == [1, 1, 1]
+    assert metadata == [{"block_uuid": "shard_0"}, {"block_uuid": "shard_1"}, {"block_uuid": "shard_2"}]
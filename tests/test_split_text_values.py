@@ -0,0 +1,24 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("crate")
+pytest.importorskip("psycopg2")
+
+from alto_academy_workshop.utils.database import _split_text_values
+
+
+def test_empty_buckets_are_null_in_both_columns():
+    data = pd.DataFrame({
+        "aggregation_type": ["mode_15min", "mode_15min", "avg_15min", "avg_15min"],
+        "value": ["on", float("nan"), 1.5, float("nan")],
+    })
+    split = _split_text_values(data)
+    assert split["value_text"].tolist() == ["on", None, None, None]
+    assert split["value"].tolist() == [None, None, 1.5, None]
+
+
+def test_empty_buckets_are_null_in_records():
+    records = [{"aggregation_type": "mode_15min", "value": float("nan")},
+               {"aggregation_type": "avg_15min", "value": float("nan")}]
+    split = _split_text_values(records)
+    assert [(row["value"], row["value_text"]) for row in split] == [(None, None), (None, None)]
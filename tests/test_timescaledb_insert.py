@@ -0,0 +1,118 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("crate")
+psycopg2 = pytest.importorskip("psycopg2")
+
+import psycopg2.errors
+
+from alto_academy_workshop.utils.database import UPSERT_KEY, AltoTimescaleDB
+from tests.fakes import FakeTimescale
+
+
+def _window(value: float) -> pd.DataFrame:
+    """ Aggregated rows of one window of two buckets """
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime([0, 60_000, 0], unit="ms").tz_localize("UTC").tz_convert("Asia/Bangkok"),
+        "device_id": ["d1", "d1", "d1"],
+        "aggregation_type": ["mean_1min", "mean_1min", "mode_1min"],
+        "datapoint": ["power", "power", "status"],
+        "value": [value, value + 1, "on"],
+    })
+
+
+def _timescaledb(server: FakeTimescale) -> AltoTimescaleDB:
+    timescaledb = AltoTimescaleDB(db_name="postgres", pool_size=1)
+    timescaledb._connect = server.connect
+    return timescaledb
+
+
+@pytest.mark.parametrize("method", ["copy", "executemany"])
+def test_rerun_of_a_written_window_replaces_its_rows(method):
+    server = FakeTimescale(unique_key=UPSERT_KEY)
+    timescaledb = _timescaledb(server)
+
+    timescaledb.insert_data("aggregated_data", _window(1.5), method=method)
+    timescaledb.insert_data("aggregated_data", _window(2.5), method=method)
+
+    rows = server.rows()
+    assert len(rows) == 3
+    assert sorted(row["value"] for row in rows if row["value"] is not None) == [2.5, 3.5]
+    assert [row["value_text"] for row in rows if row["value_text"] is not None] == ["on"]
+
+
+def test_insert_mode_fails_on_the_rows_of_a_written_window():
+    server = FakeTimescale(unique_key=UPSERT_KEY)
+    timescaledb = _timescaledb(server)
+    timescaledb.insert_data("aggregated_data", _window(1.5), mode="insert")
+
+    with pytest.raises(psycopg2.errors.UniqueViolation):
+        timescaledb.insert_data("aggregated_data", _window(2.5), mode="insert")
+    assert len(server.rows()) == 3
+
+
+def test_tables_without_a_unique_index_are_inserted_into():
+    server = FakeTimescale()
+    timescaledb = _timescaledb(server)
+
+    timescaledb.insert_data("aggregated_data", _window(1.5))
+
+    assert len(server.rows()) == 3
+    assert not timescaledb.has_unique_key("aggregated_data")
+
+
+def test_upsert_copies_into_a_staging_table_merged_in_one_statement():
+    server = FakeTimescale(unique_key=UPSERT_KEY)
+    connection = server.connect()
+    timescaledb = _timescaledb(server)
+    timescaledb._connect = lambda: connection
+
+    timescaledb.insert_data("aggregated_data", _window(1.5), mode="upsert")
+
+    statements = [sql.strip() for sql, _ in connection.statements if "information_schema" not in sql]
+    staging = statements[0].split()[3]
+    assert statements[0] == f"CREATE TEMPORARY TABLE {staging} (LIKE aggregated_data INCLUDING DEFAULTS) ON COMMIT DROP;"
+    assert statements[1].startswith(f"COPY {staging} (")
+    assert statements[2].startswith("INSERT INTO aggregated_data")
+    assert f"SELECT DISTINCT ON ({', '.join(UPSERT_KEY)})" in statements[2]
+    assert "DO UPDATE SET value = EXCLUDED.value, value_text = EXCLUDED.value_text" in statements[2]
+    assert len(statements) == 3
+    assert len(server.rows()) == 3 and set(server.tables) == {"aggregated_data"}
+
+
+def test_last_row_of_a_duplicated_key_wins():
+    server = FakeTimescale(unique_key=UPSERT_KEY)
+    window = _window(1.5)
+    window = pd.concat([window, window.assign(value=[7.5, 8.5, "off"])], ignore_index=True)
+
+    _timescaledb(server).insert_data("aggregated_data", window, mode="upsert")
+
+    rows = server.rows()
+    assert sorted(row["value"] for row in rows if row["value"] is not None) == [7.5, 8.5]
+    assert [row["value_text"] for row in rows if row["value_text"] is not None] == ["off"]
+
+
+def test_failed_upsert_writes_nothing():
+    server = FakeTimescale(unique_key=UPSERT_KEY)
+    timescaledb = _timescaledb(server)
+    timescaledb.insert_data("aggregated_data", _window(1.5))
+
+    with pytest.raises(psycopg2.errors.InvalidColumnReference):
+        timescaledb.insert_data("aggregated_data", _window(2.5), mode="upsert", conflict_columns=("timestamp", "device_id"))
+
+    assert sorted(row["value"] for row in server.rows() if row["value"] is not None) == [1.5, 2.5]
+    assert set(server.tables) == {"aggregated_data"}
+
+
+def test_column_types_are_read_once_with_the_table_name_bound():
+    server = FakeTimescale()
+    connection = server.connect()
+    timescaledb = _timescaledb(server)
+    timescaledb._connect = lambda: connection
+
+    timescaledb.insert_data("aggregated_data", _window(1.5))
+    timescaledb.insert_data("aggregated_data", _window(2.5))
+
+    lookups = [(sql, args) for sql, args in connection.statements if "information_schema.columns" in sql]
+    assert len(lookups) == 1
+    assert "aggregated_data" not in lookups[0][0] and lookups[0][1] == ["aggregated_data"]
@@ -0,0 +1,63 @@
+import json
+import multiprocessing
+
+from alto_academy_workshop.utils import state
+from alto_academy_workshop.utils.type_registry import CATEGORICAL, NUMERIC, DatapointTypeRegistry
+
+
+def _observe(path: str, device_id: str, runs: int):
+    registry = DatapointTypeRegistry(path=path)
+    for _ in range(runs):
+        registry.observe([(device_id, "temperature")], [10], [0])
+
+
+def test_observe_learns_and_invalidates_types(tmp_path):
+    registry = DatapointTypeRegistry(path=str(tmp_path / "types.json"), tolerance=0.1)
+    assert registry.observe([("d1", "temperature"), ("d1", "status")], [100, 10], [5, 10]) == [NUMERIC, CATEGORICAL]
+    assert registry.get_types([("d1", "temperature"), ("d2", "temperature")]) == [NUMERIC, None]
+
+    registry.invalidate("d1")
+    assert registry.get_types([("d1", "temperature")]) == [None]
+
+
+def test_concurrent_processes_merge_their_observations(tmp_path):
+    path = str(tmp_path / "types.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_observe, args=(path, f"d{i}", 20)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    registry = DatapointTypeRegistry(path=path)
+    assert registry.get_types([(f"d{i}", "temperature") for i in range(4)]) == [NUMERIC] * 4
+    with open(path) as f:
+        entries = json.load(f)
+    assert [entries[f"d{i}"]["temperature"]["values"] for i in range(4)] == [200] * 4
+
+
+def test_type_change_is_detected_after_a_long_numeric_history(tmp_path):
+    registry = DatapointTypeRegistry(path=str(tmp_path / "types.json"), tolerance=0.01, window_values=1000)
+    for _ in range(100):
+        assert registry.observe([("d1", "status")], [100], [0]) == [NUMERIC]
+
+    # After 10000 numbers, the datapoint starts sending text: 2 runs of text are over 1% of the window
+    assert registry.observe([("d1", "status")], [5], [5]) == [NUMERIC]
+    assert registry.observe([("d1", "status")], [10], [10]) == [CATEGORICAL]
+
+
+def test_state_file_is_only_written_when_an_entry_changed(tmp_path, monkeypatch):
+    registry = DatapointTypeRegistry(path=str(tmp_path / "types.json"), window_values=100)
+    writes = []
+    write_json = state.write_json
+    monkeypatch.setattr(state, "write_json", lambda path, data: writes.append(path) or write_json(path, data))
+
+    for _ in range(5):
+        registry.observe([("d1", "temperature")], [50], [0])
+    # The window is full of numbers after 2 runs, then the counts no longer change
+    assert len(writes) == 2
+    with open(registry.path) as f:
+        assert json.load(f)["d1"]["temperature"]["values"] == 100
+
+    registry.observe([("d1", "temperature")], [50], [1])
+    assert len(writes) == 3
@@ -0,0 +1,85 @@
+import multiprocessing
+from datetime import datetime, timezone
+
+import pytest
+
+from alto_academy_workshop.utils.watermark import (
+    FileWatermarkStore, commit_extraction_window, resolve_extraction_window
+)
+
+
+def _kwargs(tmp_path, now: float, **overrides):
+    return {
+        "cratedb_source_table": "raw_data",
+        "interval_start_datetime": datetime.fromtimestamp(now, tz=timezone.utc),
+        "query_period_seconds": 600,
+        "resample_seconds": 60,
+        "extraction_mode": "incremental",
+        "watermark_path": str(tmp_path / "watermarks.json"),
+        **overrides,
+    }
+
+
+def test_file_store_round_trip(tmp_path):
+    store = FileWatermarkStore(path=str(tmp_path / "watermarks.json"))
+    assert store.get("raw_data") is None
+    store.set("raw_data", 120)
+    assert FileWatermarkStore(path=store.path).get("raw_data") == 120
+
+
+def test_window_mode_ignores_the_watermark(tmp_path):
+    kwargs = _kwargs(tmp_path, 3600, extraction_mode="window")
+    FileWatermarkStore(path=kwargs["watermark_path"]).set("raw_data", 0)
+    assert resolve_extraction_window(**kwargs) == (3000, 3600)
+    commit_extraction_window(**kwargs)
+    assert FileWatermarkStore(path=kwargs["watermark_path"]).get("raw_data") == 0
+
+
+def test_incremental_commit_and_resume(tmp_path):
+    # Without a watermark, the first run extracts the last query period
+    kwargs = _kwargs(tmp_path, 3630)
+    assert resolve_extraction_window(**kwargs) == (3000, 3600)
+    commit_extraction_window(**kwargs)
+
+    # The next run resumes at the committed end
+    kwargs = _kwargs(tmp_path, 3750)
+    assert resolve_extraction_window(**kwargs) == (3600, 3720)
+
+
+def test_uncommitted_window_is_extracted_again(tmp_path):
+    kwargs = _kwargs(tmp_path, 3600)
+    FileWatermarkStore(path=kwargs["watermark_path"]).set("raw_data", 3000)
+    assert resolve_extraction_window(**kwargs) == (3000, 3600)
+
+    # The run failed before committing: a later run still starts at the old watermark
+    assert resolve_extraction_window(**_kwargs(tmp_path, 3900)) == (3000, 3900)
+
+
+def test_catch_up_is_bounded(tmp_path):
+    kwargs = _kwargs(tmp_path, 100000, max_catchup_seconds=3600, watermark_grace_seconds=30)
+    FileWatermarkStore(path=kwargs["watermark_path"]).set("raw_data", 0)
+    assert resolve_extraction_window(**kwargs) == (0, 3600)
+
+
+def test_unknown_extraction_mode(tmp_path):
+    with pytest.raises(ValueError):
+        resolve_extraction_window(**_kwargs(tmp_path, 3600, extraction_mode="other"))
+
+
+def _set_watermarks(path: str, key: str, count: int):
+    store = FileWatermarkStore(path=path)
+    for i in range(count):
+        store.set(key, i + 1)
+
+
+def test_concurrent_processes_keep_each_other_s_watermarks(tmp_path):
+    path = str(tmp_path / "watermarks.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_set_watermarks, args=(path, f"raw_data_{i}", 50)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    store = FileWatermarkStore(path=path)
+    assert [store.get(f"raw_data_{i}") for i in range(4)] == [50] * 4